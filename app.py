@@ -8,35 +8,97 @@ MIT License - LeaveSystem Project 2024
 """
 
 import os
+import io
+import csv
 import json
+import time
+import zlib
+import base64
+import queue
 import threading
+from bisect import bisect_right
+from contextlib import contextmanager
 from datetime import datetime
-from flask import Flask, request, jsonify, send_from_directory, send_file
+from flask import Flask, request, jsonify, send_from_directory, g
+from werkzeug.http import unquote_etag
 import logging
 
+from db_pool import get_pool
+from db_sqlite import SQLITE_PATH
+from leave_calendar import CALENDAR_MAX_DAYS, LEAVE_MAX_DAYS, DailyCalendar
+from leave_compress import (COMPRESS_MIN_SIZE, CompressedVariants, StaticAssets, choose_encoding, compress,
+                            is_compressible)
+from leave_logging import setup_logging
+from leave_metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, TimedStore, metrics
+from leave_stats import leave_days
+from leave_store import ConflictError, DuplicateIdError, conflict_details, create_store, new_record_id
+
 app = Flask(__name__)
 
-# 配置日誌
-logging.basicConfig(level=logging.INFO)
+# 配置日誌：背景執行緒寫出，高頻路由抽樣（見 leave_logging.py）
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # 環境變數
 PORT = int(os.environ.get('PORT', 10000))
 HOST = os.environ.get('HOST', '0.0.0.0')
 DATABASE_URL = os.environ.get('DATABASE_URL')
+# 未設定 DATABASE_URL 時，STORAGE_BACKEND=sqlite 改用單機 SQLite、memory 使用記憶體
+# （僅限單一 worker），否則使用本地 JSON 文件
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', '').lower()
+STORAGE_TYPE = 'postgresql' if DATABASE_URL else (
+    STORAGE_BACKEND if STORAGE_BACKEND in ('sqlite', 'memory') else 'json')
+STORAGE_LABELS = {
+    'postgresql': '數據庫',
+    'sqlite': ' SQLite ',
+    'memory': '記憶體',
+    'json': '本地文件'
+}
+
+# Server-Sent Events 設定
+SSE_MAX_CLIENTS = int(os.environ.get('SSE_MAX_CLIENTS', 50))              # 每個 worker 的最大連線數
+SSE_HEARTBEAT_INTERVAL = float(os.environ.get('SSE_HEARTBEAT_INTERVAL', 15))
+SSE_MAX_DURATION = float(os.environ.get('SSE_MAX_DURATION', 600))        # 超過後結束串流，由瀏覽器自動重連
+SSE_FILE_POLL_INTERVAL = float(os.environ.get('SSE_FILE_POLL_INTERVAL', 2))
+
+# 分頁與串流設定
+PAGE_MAX_LIMIT = int(os.environ.get('PAGE_MAX_LIMIT', 1000))
+STREAM_BATCH_SIZE = int(os.environ.get('STREAM_BATCH_SIZE', 500))        # 具名游標每次讀取筆數
+
+# 刪除墓碑清除間隔（保留天數見 TOMBSTONE_RETENTION_DAYS）
+TOMBSTONE_PURGE_INTERVAL = float(os.environ.get('TOMBSTONE_PURGE_INTERVAL', 3600))
+
+# 批次匯入設定
+BULK_MAX_ROWS = int(os.environ.get('BULK_MAX_ROWS', 100000))
+BULK_MAX_BYTES = int(os.environ.get('BULK_MAX_BYTES', 64 * 1024 * 1024))
+BULK_MAX_ERRORS = int(os.environ.get('BULK_MAX_ERRORS', 1000))            # 回應中最多列出的錯誤筆數
+JSON_LINES_TYPES = ('application/x-ndjson', 'application/jsonl', 'application/x-jsonlines',
+                    'application/json-lines')
+
+# 批次刪除單次最多的 ID 數（SQLite 引擎會依參數上限分段執行）
+DELETE_MAX_IDS = int(os.environ.get('DELETE_MAX_IDS', 1000))
+
+# 匯出設定
+EXPORT_COLUMNS = ['id', 'name', 'type', 'startDate', 'endDate', 'days', 'reason', 'createTime']
+EXPORT_GZIP_LEVEL = int(os.environ.get('EXPORT_GZIP_LEVEL', 6))
 
 # 數據庫連接
 data_lock = threading.Lock()
 
+# 儲存引擎（見 leave_store.py）：JSON 模式為 data.json 快照 + 追加式日誌
+# 以 TimedStore 包裝，每個操作的耗時記錄在 /metrics
+if STORAGE_TYPE == 'postgresql':
+    store = TimedStore(create_store('postgresql', dsn=DATABASE_URL, sslmode='require'), metrics)
+else:
+    store = TimedStore(create_store(STORAGE_TYPE), metrics)
+
 def get_db_connection():
-    """獲取數據庫連接"""
+    """從連接池借出數據庫連接（用完須呼叫 release_db_connection 歸還）"""
     try:
         if DATABASE_URL:
-            # 生產環境：使用 PostgreSQL
+            # 生產環境：使用 PostgreSQL 連接池
             try:
-                import psycopg2
-                conn = psycopg2.connect(DATABASE_URL, sslmode='require')
-                return conn
+                return get_pool(DATABASE_URL, sslmode='require').getconn()
             except ImportError:
                 logger.error("❌ psycopg2 未安裝，請檢查 requirements.txt")
                 logger.error("💡 嘗試重新部署或檢查構建日誌")
@@ -49,87 +111,70 @@ def get_db_connection():
         logger.error(f"❌ 數據庫連接失敗: {e}")
         return None
 
+def release_db_connection(conn, discard=False):
+    """將連接歸還連接池；連接已損壞時以 discard=True 丟棄"""
+    try:
+        get_pool(DATABASE_URL, sslmode='require').putconn(conn, discard=discard)
+    except Exception as e:
+        logger.error(f"❌ 歸還數據庫連接失敗: {e}")
+
+@contextmanager
+def db_connection():
+    """借出數據庫連接並在區塊結束時自動歸還（未設定 DATABASE_URL 時為 None）"""
+    conn = get_db_connection()
+    try:
+        yield conn
+    finally:
+        if conn:
+            release_db_connection(conn)
+
 def init_database():
     """初始化數據庫表"""
-    if not DATABASE_URL:
+    if STORAGE_TYPE == 'json':
         logger.info("📁 使用本地文件儲存模式")
         return
     
     try:
-        conn = get_db_connection()
-        if conn:
-            with conn.cursor() as cur:
-                # 創建請假記錄表
-                cur.execute('''
-                    CREATE TABLE IF NOT EXISTS leave_records (
-                        id VARCHAR(50) PRIMARY KEY,
-                        name VARCHAR(100) NOT NULL,
-                        start_date DATE NOT NULL,
-                        end_date DATE NOT NULL,
-                        reason TEXT NOT NULL,
-                        type VARCHAR(50) NOT NULL,
-                        create_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        data JSONB
-                    )
-                ''')
-                
-                # 創建索引提升查詢效能
-                cur.execute('''
-                    CREATE INDEX IF NOT EXISTS idx_leave_records_date 
-                    ON leave_records(start_date, end_date)
-                ''')
-                
-                conn.commit()
-                logger.info("✅ 數據庫表初始化完成")
-            conn.close()
+        store.init()
     except Exception as e:
         logger.error(f"❌ 數據庫初始化失敗: {e}")
+        return
+    purge_expired_tombstones(force=True)
+
+last_tombstone_purge = 0
+
+def purge_expired_tombstones(force=False):
+    """清除過期的刪除墓碑；每個 worker 每 TOMBSTONE_PURGE_INTERVAL 秒最多執行一次"""
+    global last_tombstone_purge
+    now = time.time()
+    if not force and now - last_tombstone_purge < TOMBSTONE_PURGE_INTERVAL:
+        return 0
+    last_tombstone_purge = now
+    try:
+        return store.purge_tombstones()
+    except Exception as e:
+        logger.error(f"❌ 清除刪除墓碑失敗: {e}")
+        return 0
+
+def get_change_feed():
+    """本 worker 的數據變更來源：PostgreSQL LISTEN，或定期檢查本地文件 / SQLite 版本"""
+    return store.change_feed(interval=SSE_FILE_POLL_INTERVAL)
+
+def get_data_version():
+    """目前的數據版本；無法判斷時回傳 None（此時不使用快取）"""
+    try:
+        # 尚未有數據文件時顯示演示數據，不使用快取
+        if STORAGE_TYPE == 'json' and not store.exists():
+            return None
+        return store.version()
+    except Exception as e:
+        logger.error(f"❌ 讀取數據版本失敗: {e}")
+        return None
 
 def load_data():
     """載入請假數據"""
     try:
-        if DATABASE_URL:
-            # 從 PostgreSQL 載入
-            conn = get_db_connection()
-            if conn:
-                import psycopg2.extras
-                with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
-                    cur.execute('''
-                        SELECT id, name, start_date, end_date, reason, type, 
-                               create_time, data
-                        FROM leave_records 
-                        ORDER BY create_time DESC
-                    ''')
-                    rows = cur.fetchall()
-                    
-                    # 轉換為前端格式
-                    data = []
-                    for row in rows:
-                        record = {
-                            'id': row['id'],
-                            'name': row['name'],
-                            'startDate': row['start_date'].strftime('%Y-%m-%d'),
-                            'endDate': row['end_date'].strftime('%Y-%m-%d'),
-                            'reason': row['reason'],
-                            'type': row['type'],
-                            'createTime': row['create_time'].isoformat() if row['create_time'] else None
-                        }
-                        # 合併額外數據
-                        if row['data']:
-                            record.update(row['data'])
-                        data.append(record)
-                    
-                conn.close()
-                logger.info(f"✅ 從數據庫載入 {len(data)} 筆記錄")
-                return data
-        
-        # 本地環境：使用 JSON 文件
-        if os.path.exists('data.json'):
-            with open('data.json', 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                logger.info(f"✅ 從本地文件載入 {len(data)} 筆記錄")
-                return data
-        else:
+        if STORAGE_TYPE == 'json' and not store.exists():
             # 返回演示數據
             demo_data = [
                 {
@@ -143,65 +188,274 @@ def load_data():
                 }
             ]
             return demo_data
+        
+        data = store.load()
+        metrics.observe('leave_load_data_rows', len(data))
+        logger.debug(f"✅ 從{STORAGE_LABELS[STORAGE_TYPE]}載入 {len(data)} 筆記錄")
+        return data
             
     except Exception as e:
         logger.error(f"❌ 載入數據失敗: {e}")
         return []
 
-def save_data(record):
-    """儲存單筆請假數據"""
+def load_data_snapshot():
+    """載入 (數據版本, 請假數據)；版本與數據在同一個交易內讀取，快取不會以舊版本標示新數據"""
+    if STORAGE_TYPE == 'json' and not store.exists():
+        # 演示數據沒有版本，不使用快取
+        return None, load_data()
     try:
-        with data_lock:
-            if DATABASE_URL:
-                # 儲存到 PostgreSQL
-                conn = get_db_connection()
-                if conn:
-                    with conn.cursor() as cur:
-                        # 準備額外數據
-                        extra_data = {k: v for k, v in record.items() 
-                                    if k not in ['id', 'name', 'startDate', 'endDate', 'reason', 'type', 'createTime']}
-                        
-                        cur.execute('''
-                            INSERT INTO leave_records 
-                            (id, name, start_date, end_date, reason, type, data)
-                            VALUES (%s, %s, %s, %s, %s, %s, %s)
-                            ON CONFLICT (id) DO UPDATE SET
-                            name = EXCLUDED.name,
-                            start_date = EXCLUDED.start_date,
-                            end_date = EXCLUDED.end_date,
-                            reason = EXCLUDED.reason,
-                            type = EXCLUDED.type,
-                            data = EXCLUDED.data
-                        ''', (
-                            record['id'],
-                            record['name'],
-                            record['startDate'],
-                            record['endDate'],
-                            record['reason'],
-                            record['type'],
-                            json.dumps(extra_data) if extra_data else None
-                        ))
-                        conn.commit()
-                    conn.close()
-                    logger.info(f"✅ 數據已儲存到數據庫: {record['id']}")
-                    return True
+        version, data = store.snapshot()
+    except Exception as e:
+        logger.error(f"❌ 載入數據失敗: {e}")
+        return None, []
+    metrics.observe('leave_load_data_rows', len(data))
+    logger.debug(f"✅ 從{STORAGE_LABELS[STORAGE_TYPE]}載入 {len(data)} 筆記錄")
+    return version, data
+
+# 讀取快取：(數據版本, 已序列化的數據, 筆數)，整個 tuple 一次替換
+data_cache = None
+cache_lock = threading.Lock()
+# /data.json 各版本的壓縮結果
+data_variants = CompressedVariants()
+
+def make_data_etag(version):
+    """由數據版本產生 ETag（不必重新雜湊回應內容）"""
+    if version is None:
+        return None
+    return f"data-{version}"
+
+def get_data_snapshot(version=None):
+    """取得數據快照；版本未變時直接回傳快取，不再查詢整張表"""
+    global data_cache
+    if version is None:
+        version = get_data_version()
+    snapshot = data_cache
+    if version is not None and snapshot is not None and snapshot[0] == version:
+        metrics.inc('leave_cache_requests_total', (('cache', 'data_snapshot'), ('result', 'hit')))
+        return snapshot
+    
+    with cache_lock:
+        # 其他執行緒可能已經重建過快取
+        snapshot = data_cache
+        if version is not None and snapshot is not None and snapshot[0] == version:
+            metrics.inc('leave_cache_requests_total', (('cache', 'data_snapshot'), ('result', 'hit')))
+            return snapshot
+        
+        metrics.inc('leave_cache_requests_total', (('cache', 'data_snapshot'), ('result', 'miss')))
+        version, data = load_data_snapshot()
+        snapshot = (version, app.json.dumps(data), len(data))
+        if version is not None:
+            data_cache = snapshot
+        return snapshot
+
+def iter_records(filters=None, after=None, limit=None, server_side=False):
+    """依篩選與分頁條件逐筆產生記錄；server_side=True 時以具名游標分批讀取"""
+    filters = filters or {}
+    yield from store.query(after=after, limit=limit, server_side=server_side, **filters)
+
+def encode_page_token(record):
+    """產生下一頁的游標（上一頁最後一筆的 createTime 與 id）"""
+    raw = json.dumps([record.get('createTime') or '', str(record.get('id'))])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_page_token(token):
+    """解析分頁游標；格式錯誤時拋出 ValueError"""
+    try:
+        create_time, record_id = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+        return str(create_time), str(record_id)
+    except Exception:
+        raise ValueError(token)
+
+def parse_page_args(args):
+    """解析分頁參數 limit / after；回傳 (分頁條件, 錯誤訊息)"""
+    limit = args.get('limit')
+    after = args.get('after')
+    if not limit and not after:
+        return None, None
+    
+    page = {'limit': None, 'after': None}
+    if limit:
+        try:
+            page['limit'] = int(limit)
+        except ValueError:
+            return None, "limit 必須為整數"
+        if not 1 <= page['limit'] <= PAGE_MAX_LIMIT:
+            return None, f"limit 必須介於 1 到 {PAGE_MAX_LIMIT}"
+    if after:
+        try:
+            page['after'] = decode_page_token(after)
+        except ValueError:
+            return None, "分頁游標格式錯誤"
+    return page, None
+
+def stream_records_json(filters, page, version):
+    """以 JSON 分段輸出記錄：邊讀邊送，不在記憶體中組出整份回應"""
+    page = page or {}
+    count = 0
+    yield '{"status":"success","data":['
+    try:
+        chunk = []
+        for record in iter_records(filters, page.get('after'), page.get('limit'), server_side=True):
+            chunk.append(app.json.dumps(record))
+            if len(chunk) >= STREAM_BATCH_SIZE:
+                yield (',' if count else '') + ','.join(chunk)
+                count += len(chunk)
+                chunk = []
+        if chunk:
+            yield (',' if count else '') + ','.join(chunk)
+            count += len(chunk)
+    except Exception as e:
+        # 回應標頭已送出，只能中斷串流；客戶端會因 JSON 不完整而得知失敗
+        logger.error(f"❌ 串流輸出失敗: {e}")
+        raise
+    yield '],"count":%d,"cursor":%s}' % (count, app.json.dumps(version))
+
+def csv_cell(value):
+    """避免試算表把以 = + - @ 開頭的內容當成公式執行"""
+    if isinstance(value, str) and value[:1] in ('=', '+', '-', '@'):
+        return "'" + value
+    return value
+
+def iter_export_chunks(filters, export_format):
+    """逐筆讀取記錄並轉為 CSV / JSON Lines，每 STREAM_BATCH_SIZE 筆送出一段，記憶體用量固定"""
+    buffer = io.StringIO()
+    writer = None
+    if export_format == 'csv':
+        writer = csv.writer(buffer)
+        buffer.write('\ufeff')  # BOM：讓 Excel 以 UTF-8 開啟中文
+        writer.writerow(EXPORT_COLUMNS)
+    count = 0
+    try:
+        for record in iter_records(filters, server_side=True):
+            if writer:
+                row = dict(record, days=leave_days(record))
+                writer.writerow([csv_cell(row.get(column)) for column in EXPORT_COLUMNS])
             else:
-                # 本地環境：儲存到 JSON
-                data = load_data()
-                # 移除舊記錄（如果存在）
-                data = [item for item in data if item.get('id') != record['id']]
-                # 添加新記錄
-                data.append(record)
-                
-                with open('data.json', 'w', encoding='utf-8') as f:
-                    json.dump(data, f, ensure_ascii=False, indent=2)
-                logger.info(f"✅ 數據已儲存到本地文件: {record['id']}")
-                return True
-                
+                buffer.write(json.dumps(record, ensure_ascii=False) + '\n')
+            count += 1
+            if count % STREAM_BATCH_SIZE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+    except Exception as e:
+        # 回應標頭已送出，只能中斷串流；客戶端會收到不完整的文件
+        logger.error(f"❌ 匯出失敗（已輸出 {count} 筆）: {e}")
+        raise
+    yield buffer.getvalue()
+    logger.info(f"📤 匯出完成: {count} 筆 ({export_format})")
+
+def gzip_chunks(chunks, level=EXPORT_GZIP_LEVEL):
+    """邊產生邊以 gzip 壓縮"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits=31：gzip 格式
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+def parse_range_args(args):
+    """解析查詢參數 from / to / name / type；回傳 (篩選條件, 錯誤訊息)"""
+    filters = {
+        'date_from': args.get('from') or None,
+        'date_to': args.get('to') or None,
+        'name': args.get('name') or None,
+        'leave_type': args.get('type') or None
+    }
+    for key in ('date_from', 'date_to'):
+        if filters[key]:
+            try:
+                datetime.strptime(filters[key], '%Y-%m-%d')
+            except ValueError:
+                return None, "日期格式錯誤，應為 YYYY-MM-DD"
+    if filters['date_from'] and filters['date_to'] and filters['date_from'] > filters['date_to']:
+        return None, "開始日期不能晚於結束日期"
+    if not any(filters.values()):
+        return None, None
+    return filters, None
+
+def load_changes(since):
+    """載入游標之後新增/修改的記錄與刪除墓碑；回傳 (cursor, changes, deleted)，無法提供差異時回傳 None"""
+    if since is None:
+        return None
+    # 本地文件尚未建立時只能整份重送（演示數據）
+    if STORAGE_TYPE == 'json' and not store.exists():
+        return None
+    purge_expired_tombstones()
+    # 日誌壓縮、墓碑清除後 / 游標超前時舊游標失效，由引擎回傳 None
+    return store.changes_since(since)
+
+# 每日請假人數索引與統計：依數據版本增量同步（任何 worker 的新增 / 刪除都會反映），每個 worker 一份
+leave_calendar = DailyCalendar()
+
+def sync_calendar():
+    """回傳 (數據版本, 已同步到該版本的日曆索引)"""
+    version = get_data_version()
+    if version is None:
+        # 演示數據沒有版本，直接以目前數據建立暫時的索引
+        calendar = DailyCalendar()
+        calendar.reset(load_data(), None)
+        return version, calendar
+    result = leave_calendar.sync(version, load_changes, store.snapshot)
+    metrics.inc('leave_cache_requests_total', (('cache', 'calendar'), ('result', result)))
+    return version, leave_calendar
+
+def get_calendar_window(date_from, date_to):
+    """回傳 (數據版本, 每日摘要, 範圍內的記錄)"""
+    version, calendar = sync_calendar()
+    days, records = calendar.window(date_from, date_to)
+    return version, days, records
+
+def get_leave_stats():
+    """回傳 (數據版本, 統計)；增量索引無法同步時改由儲存引擎重新計算（數據庫以 GROUP BY）"""
+    try:
+        version, calendar = sync_calendar()
+        stats = calendar.stats()
+        stats['source'] = 'incremental'
+    except Exception as e:
+        logger.error(f"❌ 統計索引同步失敗，改由{STORAGE_LABELS[STORAGE_TYPE]}重新計算: {e}")
+        version = get_data_version()
+        today = datetime.now().date().isoformat()
+        stats = store.aggregate_stats()
+        stats['on_leave_today'] = sum(1 for _ in iter_records({'date_from': today, 'date_to': today}))
+        stats['date'] = today
+        stats['source'] = 'rebuild'
+    return version, stats
+
+# 新增記錄時 ID 重複（機率極低）的重試次數
+CREATE_ID_ATTEMPTS = 3
+
+def save_data(record):
+    """新增單筆請假數據（不會取代既有記錄）；與同一員工的請假重疊會拋出 ConflictError
+
+    ID 已存在時換一個新 ID 重試，仍然重複則拋出 DuplicateIdError
+    """
+    try:
+        for attempt in range(CREATE_ID_ATTEMPTS):
+            try:
+                with data_lock:
+                    store.insert_checked(record)
+                break
+            except DuplicateIdError:
+                if attempt == CREATE_ID_ATTEMPTS - 1:
+                    raise
+                logger.warning(f"⚠️ 記錄 ID 重複，改用新 ID 重試: {record['id']}")
+                record['id'] = new_record_id()
+        logger.debug(f"✅ 數據已儲存到{STORAGE_LABELS[STORAGE_TYPE]}: {record['id']}")
+        return True
+    
+    except (ConflictError, DuplicateIdError):
+        raise
     except Exception as e:
         logger.error(f"❌ 儲存數據失敗: {e}")
         return False
-        return False
+
+def delete_data(record_ids):
+    """依主鍵刪除請假數據（數據庫一條 DELETE，JSON 模式追加日誌墓碑）；回傳實際刪除的 ID"""
+    with data_lock:
+        deleted = store.delete(record_ids)
+    if deleted:
+        logger.info(f"✅ 已從{STORAGE_LABELS[STORAGE_TYPE]}刪除 {len(deleted)} 筆: {', '.join(deleted[:10])}")
+    return deleted
 
 def validate_leave_data(data):
     """驗證請假數據"""
@@ -213,6 +467,8 @@ def validate_leave_data(data):
     for field in required_fields:
         if field not in data or not data[field]:
             return False, f"缺少必要欄位: {field}"
+        if not isinstance(data[field], str):
+            return False, f"欄位格式錯誤: {field}"
     
     # 驗證日期格式
     try:
@@ -220,34 +476,348 @@ def validate_leave_data(data):
         end_date = datetime.strptime(data['endDate'], '%Y-%m-%d')
         if start_date > end_date:
             return False, "開始日期不能晚於結束日期"
+        if (end_date - start_date).days + 1 > LEAVE_MAX_DAYS:
+            return False, f"單筆請假不能超過 {LEAVE_MAX_DAYS} 天"
     except ValueError:
         return False, "日期格式錯誤"
     
     return True, "驗證通過"
 
+def iter_bulk_rows():
+    """逐筆產生批次匯入的 (列號, 數據, 錯誤訊息)；JSON Lines 邊讀邊解析，不必先緩衝整個請求"""
+    if request.mimetype in JSON_LINES_TYPES or request.args.get('format') == 'jsonl':
+        for row_no, line in enumerate(request.stream, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield row_no, json.loads(line), None
+            except ValueError as e:
+                yield row_no, None, f"JSON 格式錯誤: {e}"
+        return
+    
+    rows = request.get_json(silent=True)
+    if not isinstance(rows, list):
+        raise ValueError("請求內容必須為 JSON 陣列或 JSON Lines")
+    for row_no, row in enumerate(rows, 1):
+        yield row_no, row, None
+
+def is_timestamp(value):
+    """ISO 8601 日期時間字串（YYYY-MM-DD 開頭），各儲存引擎都能保存"""
+    if not isinstance(value, str):
+        return False
+    try:
+        datetime.strptime(value[:10], '%Y-%m-%d')
+        datetime.fromisoformat(value)
+    except ValueError:
+        return False
+    return True
+
+def claim_leave_span(accepted, record, row_no):
+    """批次內同一員工的請假不可重疊：沒有重疊時登記區間並回傳 None，否則回傳錯誤訊息
+
+    accepted 為 {員工: ([開始日], [(結束日, 列號)])}，依開始日排序；已登記的區間互不重疊，
+    只需檢查開始日不晚於本筆結束日的最後一個區間
+    """
+    starts, spans = accepted.setdefault(record['name'], ([], []))
+    i = bisect_right(starts, record['endDate'])
+    if i and spans[i - 1][0] >= record['startDate']:
+        return f"與第 {spans[i - 1][1]} 列的請假日期重疊"
+    starts.insert(i, record['startDate'])
+    spans.insert(i, (record['endDate'], row_no))
+    return None
+
+def prepare_bulk_records(rows):
+    """單次走訪完成驗證（含同一批次內的請假重疊）並補上 ID / 建立時間
+
+    回傳 (可寫入的記錄, 各記錄的列號, 錯誤清單, 錯誤總數)
+    """
+    now = datetime.now()
+    # 同一毫秒的兩次匯入也不會得到相同的前綴
+    id_prefix = new_record_id(now)
+    create_time = now.isoformat()
+    records = []
+    row_numbers = []
+    errors = []
+    failed = 0
+    accepted = {}
+    for row_no, row, error in rows:
+        if row_no > BULK_MAX_ROWS:
+            raise OverflowError(f"超過單次匯入上限 {BULK_MAX_ROWS} 筆")
+        if error is None:
+            is_valid, message = validate_leave_data(row)
+            error = None if is_valid else message
+        if error is None and 'createTime' in row and not is_timestamp(row['createTime']):
+            error = "建立時間格式錯誤"
+        if error is None:
+            error = claim_leave_span(accepted, row, row_no)
+        if error is not None:
+            failed += 1
+            if len(errors) < BULK_MAX_ERRORS:
+                errors.append({'row': row_no, 'message': error})
+            continue
+        # 沒有 ID 的記錄以「匯入前綴_列號」編號：前綴含隨機碼，不同批次也不會重複
+        row['id'] = str(row.get('id') or f"{id_prefix}_{row_no:06d}")
+        row.setdefault('createTime', create_time)
+        records.append(row)
+        row_numbers.append(row_no)
+    return records, row_numbers, errors, failed
+
+def reject_existing_conflicts(records, row_numbers, errors):
+    """與既有記錄重疊的列改列為錯誤；回傳 (保留的記錄, 列號, 錯誤清單, 新增的錯誤數)
+
+    被剔除的列若原本要取代某筆既有記錄，該記錄會保留下來，因此重新比對直到沒有衝突
+    """
+    rejected = 0
+    while records:
+        conflicts = store.find_batch_conflicts(records)
+        if not conflicts:
+            break
+        kept, kept_rows = [], []
+        for record, row_no in zip(records, row_numbers):
+            existing = conflicts.get(str(record['id']))
+            if existing:
+                rejected += 1
+                errors.append({'row': row_no, 'message': f"與既有記錄 {existing[0]['id']} 的請假日期重疊"})
+            else:
+                kept.append(record)
+                kept_rows.append(row_no)
+        records, row_numbers = kept, kept_rows
+    errors = sorted(errors, key=lambda error: error['row'])[:BULK_MAX_ERRORS]
+    return records, row_numbers, errors, rejected
+
+@app.before_request
+def start_request_metrics():
+    """記錄請求開始時間與處理中的請求數"""
+    g.request_started = time.perf_counter()
+    metrics.inc('leave_http_requests_in_flight')
+
+@app.after_request
+def record_request_metrics(response):
+    """依路由（規則而非實際網址，避免標籤數量無限增加）記錄請求數、耗時與內容大小"""
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        labels = (('route', route), ('method', request.method), ('status', str(response.status_code)))
+        metrics.inc('leave_http_requests_total', labels)
+        metrics.observe('leave_http_request_duration_seconds', time.perf_counter() - started, labels)
+        if request.content_length:
+            metrics.observe('leave_http_request_size_bytes', request.content_length, (('route', route),))
+        if not response.is_streamed and response.content_length is not None:
+            metrics.observe('leave_http_response_size_bytes', response.content_length, (('route', route),))
+    return response
+
+@app.teardown_request
+def finish_request_metrics(error=None):
+    metrics.inc('leave_http_requests_in_flight', amount=-1)
+
+@app.after_request
+def compress_response(response):
+    """依 Accept-Encoding 壓縮 JSON / 文字回應（串流、已壓縮與過小的回應除外）"""
+    if (response.direct_passthrough or response.is_streamed or response.status_code < 200
+            or response.status_code in (204, 304) or 'Content-Encoding' in response.headers
+            or not is_compressible(response.mimetype)):
+        return response
+    response.vary.add('Accept-Encoding')
+    if response.content_length is None or response.content_length < COMPRESS_MIN_SIZE:
+        return response
+    encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+    if encoding:
+        set_encoded_body(response, encoding, compress(response.get_data(), encoding))
+    return response
+
+def set_encoded_body(response, encoding, body):
+    """以壓縮後的內容取代回應內容；ETag 改為弱 ETag（位元組與原始內容不同）"""
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus 指標（設定 METRICS_DIR 時彙總所有 gunicorn worker）"""
+    return app.response_class(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+# 靜態文件（index.html、script.js、styles.css…）啟動時預先壓縮並保存在記憶體
+static_assets = StaticAssets('.')
+
+def send_static_asset(asset):
+    """回傳預先壓縮的靜態文件，支援 If-None-Match"""
+    encoding, body, etag = asset.negotiate(request.headers.get('Accept-Encoding'))
+    if request.if_none_match.contains_weak(unquote_etag(etag)[0]):
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(body, content_type=asset.content_type)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Accept-Encoding')
+    return response
+
 @app.route('/')
 def index():
     """主頁面"""
-    return send_file('index.html')
+    return serve_static('index.html')
 
 @app.route('/<path:filename>')
 def serve_static(filename):
     """提供靜態文件"""
+    # 不可直接下載 SQLite 數據庫文件（含 -wal / -shm）
+    if STORAGE_TYPE == 'sqlite' and os.path.basename(filename).startswith(os.path.basename(SQLITE_PATH)):
+        return "File not found", 404
+    asset = static_assets.get(filename)
+    if asset is not None:
+        return send_static_asset(asset)
     try:
         return send_from_directory('.', filename)
     except FileNotFoundError:
         return "File not found", 404
 
+@app.route('/data.json')
+def serve_data_file():
+    """本地文件模式：回傳合併日誌後的數據（data.json 快照不一定包含最近的寫入）"""
+    if STORAGE_TYPE != 'json' or not store.exists():
+        return serve_static('data.json')
+
+    version = get_data_version()
+    etag = make_data_etag(version)
+    if etag and request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    else:
+        version, data_json, _ = get_data_snapshot(version)
+        etag = make_data_etag(version)
+        response = app.response_class(data_json, mimetype='application/json')
+    if etag:
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+        if response.status_code == 200 and encoding and response.content_length >= COMPRESS_MIN_SIZE:
+            # 同一版本只壓縮一次，之後的輪詢直接回傳快取的壓縮結果
+            set_encoded_body(response, encoding, data_variants.get(version, encoding, response.get_data()))
+    return response
+
 @app.route('/api/data', methods=['GET'])
 def get_data():
     """獲取請假數據"""
     try:
-        data = load_data()
+        filters, error = parse_range_args(request.args)
+        if not error:
+            page, error = parse_page_args(request.args)
+        if error:
+            return jsonify({
+                'status': 'error',
+                'message': error
+            }), 400
+        stream = request.args.get('stream') in ('1', 'true')
+        
+        # 以數據版本作為強 ETag，數據未變時回應 304 不傳送內容
+        # （篩選結果只取決於數據版本與查詢參數，同一網址可共用同一個 ETag）
+        version = get_data_version()
+        etag = make_data_etag(version)
+        if etag and request.if_none_match.contains_weak(etag):
+            response = app.response_class(status=304)
+        elif stream:
+            # 串流模式：大量匯出時每個 worker 的記憶體用量固定，且能立即開始傳送
+            response = app.response_class(stream_records_json(filters, page, version),
+                                          mimetype='application/json')
+        elif page:
+            # 多取一筆以判斷是否還有下一頁
+            limit = page['limit'] or PAGE_MAX_LIMIT
+            data = list(iter_records(filters, page['after'], limit + 1))
+            has_more = len(data) > limit
+            data = data[:limit]
+            response = jsonify({
+                'status': 'success',
+                'data': data,
+                'count': len(data),
+                'cursor': version,
+                'next': encode_page_token(data[-1]) if has_more else None,
+                'timestamp': datetime.now().isoformat()
+            })
+        elif filters:
+            data = list(iter_records(filters))
+            response = jsonify({
+                'status': 'success',
+                'data': data,
+                'count': len(data),
+                'cursor': version,
+                'timestamp': datetime.now().isoformat()
+            })
+        else:
+            version, data_json, count = get_data_snapshot(version)
+            etag = make_data_etag(version)
+            # 直接拼接已序列化的數據，避免每次輪詢都重新序列化整份清單
+            body = '{"count":%d,"cursor":%s,"data":%s,"status":"success","timestamp":%s}' % (
+                count, app.json.dumps(version), data_json, app.json.dumps(datetime.now().isoformat()))
+            response = app.response_class(body, mimetype='application/json')
+        if etag:
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'
+        return response
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@app.route('/api/export', methods=['GET'])
+def export_data():
+    """以 CSV 或 JSON Lines 串流匯出記錄（可依 from / to / name / type 篩選，gzip=1 時壓縮）"""
+    try:
+        export_format = request.args.get('format', 'csv')
+        if export_format not in ('csv', 'jsonl'):
+            return jsonify({
+                'status': 'error',
+                'message': 'format 必須為 csv 或 jsonl'
+            }), 400
+        filters, error = parse_range_args(request.args)
+        if error:
+            return jsonify({
+                'status': 'error',
+                'message': error
+            }), 400
+        
+        filename = f"leave_records_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{export_format}"
+        mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+        chunks = iter_export_chunks(filters, export_format)
+        if request.args.get('gzip') in ('1', 'true'):
+            filename += '.gz'
+            mimetype = 'application/gzip'
+            chunks = gzip_chunks(chunks)
+        response = app.response_class(chunks, mimetype=mimetype)
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+        response.headers['Cache-Control'] = 'no-store'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@app.route('/api/data/changes', methods=['GET'])
+def get_data_changes():
+    """獲取指定游標之後的變更（差異同步）"""
+    try:
+        result = load_changes(request.args.get('since'))
+        if result is None:
+            # 沒有游標或游標已失效：整份重送，客戶端以 reset 取代本地數據
+            version, data_json, count = get_data_snapshot()
+            body = '{"changes":%s,"count":%d,"cursor":%s,"deleted":[],"reset":true,"status":"success"}' % (
+                data_json, count, app.json.dumps(version))
+            return app.response_class(body, mimetype='application/json')
+        
+        cursor, changes, deleted = result
         return jsonify({
             'status': 'success',
-            'data': data,
-            'count': len(data),
-            'timestamp': datetime.now().isoformat()
+            'cursor': cursor,
+            'reset': False,
+            'changes': changes,
+            'deleted': deleted,
+            'count': len(changes)
         })
     except Exception as e:
         return jsonify({
@@ -255,13 +825,156 @@ def get_data():
             'message': str(e)
         }), 500
 
+@app.route('/api/calendar', methods=['GET'])
+def get_calendar():
+    """獲取日期範圍內每天的請假人數（依類型統計）與記錄 ID，供日曆直接渲染"""
+    try:
+        date_from = request.args.get('from')
+        date_to = request.args.get('to')
+        if not date_from or not date_to:
+            return jsonify({
+                'status': 'error',
+                'message': '缺少必要參數: from, to'
+            }), 400
+        try:
+            start = datetime.strptime(date_from, '%Y-%m-%d')
+            end = datetime.strptime(date_to, '%Y-%m-%d')
+        except ValueError:
+            return jsonify({
+                'status': 'error',
+                'message': '日期格式錯誤，應為 YYYY-MM-DD'
+            }), 400
+        if start > end:
+            return jsonify({
+                'status': 'error',
+                'message': '開始日期不能晚於結束日期'
+            }), 400
+        if (end - start).days + 1 > CALENDAR_MAX_DAYS:
+            return jsonify({
+                'status': 'error',
+                'message': f'查詢範圍不能超過 {CALENDAR_MAX_DAYS} 天'
+            }), 400
+        
+        version, days, records = get_calendar_window(date_from, date_to)
+        etag = make_data_etag(version)
+        if etag and request.if_none_match.contains_weak(etag):
+            response = app.response_class(status=304)
+        else:
+            response = jsonify({
+                'status': 'success',
+                'from': date_from,
+                'to': date_to,
+                'cursor': version,
+                'days': days,
+                'leaves': records,
+                'count': len(records)
+            })
+        if etag:
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'
+        return response
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@app.route('/api/stats', methods=['GET'])
+def get_stats():
+    """獲取統計資訊：依類型、員工、月份的筆數與請假天數，以及今天請假人數"""
+    try:
+        version, stats = get_leave_stats()
+        # ETag 包含日期：數據未變但跨日時「今天請假人數」仍會更新
+        etag = make_data_etag(version)
+        if etag:
+            etag = f"{etag}-{stats['date']}"
+        if etag and request.if_none_match.contains_weak(etag):
+            response = app.response_class(status=304)
+        else:
+            response = jsonify({
+                'status': 'success',
+                'cursor': version,
+                'type_statistics': {key: value['count'] for key, value in stats['by_type'].items()},
+                **stats
+            })
+        if etag:
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'
+        return response
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+# SSE 連線名額（每個連線佔用一個執行緒）
+sse_slots = threading.BoundedSemaphore(SSE_MAX_CLIENTS)
+
+def format_sse(event, data, event_id=None):
+    """格式化一則 Server-Sent Event"""
+    message = ''
+    if event_id is not None:
+        message += f'id: {event_id}\n'
+    message += f'event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'
+    return message
+
+@app.route('/api/events', methods=['GET'])
+def stream_events():
+    """推送數據變更通知（Server-Sent Events）"""
+    feed = get_change_feed()
+    if not feed.connected:
+        # 無法接收跨 worker 通知時拒絕連線，客戶端改用輪詢
+        return jsonify({
+            'status': 'error',
+            'message': '即時通知暫時無法使用'
+        }), 503
+    if not sse_slots.acquire(blocking=False):
+        return jsonify({
+            'status': 'error',
+            'message': '即時通知連線數已滿'
+        }), 503
+    
+    events = feed.subscribe()
+    last_event_id = request.headers.get('Last-Event-ID')
+    
+    def generate():
+        version = feed.current_version()
+        # retry 指定瀏覽器斷線後的重連間隔；id 讓重連時帶回 Last-Event-ID
+        yield f'retry: {int(SSE_HEARTBEAT_INTERVAL * 1000)}\n\n'
+        if last_event_id is not None and last_event_id != str(version):
+            # 重連期間有新變更：立即通知客戶端同步
+            yield format_sse('change', {'version': version}, version)
+        else:
+            yield format_sse('ready', {'version': version}, version)
+        
+        deadline = time.monotonic() + SSE_MAX_DURATION
+        while time.monotonic() < deadline:
+            try:
+                event = events.get(timeout=SSE_HEARTBEAT_INTERVAL)
+            except queue.Empty:
+                # 心跳：保持連線並及早偵測已離線的客戶端
+                yield ': ping\n\n'
+                continue
+            yield format_sse('change', event, event['version'])
+    
+    def cleanup():
+        feed.unsubscribe(events)
+        sse_slots.release()
+    
+    response = app.response_class(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # 客戶端離線或串流結束時由 WSGI 伺服器呼叫，即使串流尚未開始也會釋放名額
+    response.call_on_close(cleanup)
+    return response
+
 @app.route('/api/data', methods=['POST'])
 def save_leave_data():
     """儲存請假數據"""
     try:
         # 記錄請求詳情（用於除錯）
-        logger.info(f"📥 收到 POST 請求，Content-Type: {request.content_type}")
-        logger.info(f"📥 請求大小: {request.content_length} bytes")
+        logger.debug(f"📥 收到 POST 請求，Content-Type: {request.content_type}，大小: {request.content_length} bytes")
         
         # 檢查請求大小
         if request.content_length and request.content_length > 1024 * 1024:  # 1MB
@@ -278,8 +991,6 @@ def save_leave_data():
                 'message': '無效的JSON數據'
             }), 400
         
-        logger.info(f"📋 收到請假申請: {request_data.get('name')} - {request_data.get('type')}")
-        
         # 驗證數據
         is_valid, message = validate_leave_data(request_data)
         if not is_valid:
@@ -290,19 +1001,35 @@ def save_leave_data():
             }), 400
         
         # 添加時間戳和ID
-        request_data['id'] = datetime.now().strftime('%Y%m%d_%H%M%S_%f')[:-3]
-        request_data['createTime'] = datetime.now().isoformat()
+        now = datetime.now()
+        request_data['id'] = new_record_id(now)
+        request_data['createTime'] = now.isoformat()
         
-        logger.info(f"💾 準備儲存記錄 ID: {request_data['id']}")
+        # 儲存數據（單筆記錄）；重疊檢查在儲存引擎的寫入鎖 / 交易內進行，多人同時送出也只有一筆成功
+        try:
+            saved = save_data(request_data)
+        except DuplicateIdError as e:
+            logger.error(f"❌ 記錄 ID 重複: {e.record_id}")
+            return jsonify({
+                'status': 'error',
+                'message': '記錄 ID 重複，請重新送出'
+            }), 409
+        except ConflictError as e:
+            logger.warning(f"⚠️ 請假時間衝突: {request_data['name']} {request_data['startDate']} - {request_data['endDate']}")
+            return jsonify({
+                'status': 'error',
+                'message': '請假時間與既有記錄重疊',
+                'conflicts': e.conflicts
+            }), 409
         
-        # 儲存數據（單筆記錄）
-        if save_data(request_data):
-            logger.info(f"✅ 記錄儲存成功: {request_data['id']}")
+        if saved:
+            logger.info(f"✅ 記錄儲存成功: {request_data['id']}（{request_data['name']} - {request_data['type']}）",
+                        extra={'record_id': request_data['id']})
             return jsonify({
                 'status': 'success',
                 'message': '請假數據已儲存',
                 'id': request_data['id'],
-                'storage_type': 'postgresql' if DATABASE_URL else 'json'
+                'storage_type': STORAGE_TYPE
             })
         else:
             logger.error(f"❌ 記錄儲存失敗: {request_data['id']}")
@@ -318,34 +1045,174 @@ def save_leave_data():
             'message': f'伺服器錯誤: {str(e)}'
         }), 500
 
-@app.route('/api/data/<data_id>', methods=['DELETE'])
-def delete_leave_data(data_id):
-    """刪除請假數據"""
+@app.route('/api/data/bulk', methods=['POST'])
+def bulk_import_data():
+    """批次匯入 / 更新請假數據：JSON 陣列或 JSON Lines，所有有效記錄在一次寫入中儲存
+
+    有 ID 的記錄會取代相同 ID 的既有記錄；與既有記錄或同一批次較前面的列請假重疊的列
+    列為錯誤（任何儲存引擎的結果都相同）。atomic=1 時只要有任何一筆錯誤就全部不寫入
+    """
     try:
-        data = load_data()
-        original_count = len(data)
+        if request.content_length and request.content_length > BULK_MAX_BYTES:
+            return jsonify({
+                'status': 'error',
+                'message': '請求數據過大'
+            }), 413
         
-        # 過濾掉要刪除的項目
-        data = [item for item in data if item.get('id') != data_id]
+        started = time.time()
+        try:
+            records, row_numbers, errors, failed = prepare_bulk_records(iter_bulk_rows())
+        except OverflowError as e:
+            return jsonify({
+                'status': 'error',
+                'message': str(e)
+            }), 413
+        except ValueError as e:
+            return jsonify({
+                'status': 'error',
+                'message': str(e)
+            }), 400
         
-        if len(data) < original_count:
-            if save_data(data):
-                return jsonify({
-                    'status': 'success',
-                    'message': '數據已刪除'
-                })
-            else:
+        atomic = request.args.get('atomic') in ('1', 'true')
+        version = None
+        with data_lock:
+            # 與既有記錄的重疊在寫入鎖內檢查，檢查與寫入之間不會有本程序的其他寫入
+            records, row_numbers, errors, rejected = reject_existing_conflicts(records, row_numbers, errors)
+            failed += rejected
+            if failed and (atomic or not records):
+                logger.error(f"❌ 批次匯入驗證失敗: {failed} 筆錯誤")
                 return jsonify({
                     'status': 'error',
-                    'message': '刪除失敗'
-                }), 500
-        else:
+                    'message': f'{failed} 筆數據驗證失敗，未寫入任何記錄',
+                    'imported': 0,
+                    'failed': failed,
+                    'errors': errors
+                }), 400
+            
+            if records:
+                try:
+                    version = store.upsert_many(records)
+                except ConflictError as e:
+                    # 其他 worker 在檢查之後寫入了重疊的記錄（PostgreSQL 排除約束）
+                    logger.warning(f"⚠️ 批次匯入時請假時間衝突: {len(e.conflicts)} 筆")
+                    return jsonify({
+                        'status': 'error',
+                        'message': '請假時間與既有記錄重疊，未寫入任何記錄',
+                        'imported': 0,
+                        'conflicts': e.conflicts
+                    }), 409
+        
+        elapsed = time.time() - started
+        logger.info(f"✅ 批次匯入 {len(records)} 筆到{STORAGE_LABELS[STORAGE_TYPE]}"
+                    f"（{failed} 筆錯誤，{elapsed:.2f} 秒）")
+        return jsonify({
+            'status': 'success',
+            'message': f'已匯入 {len(records)} 筆記錄',
+            'imported': len(records),
+            'failed': failed,
+            'errors': errors,
+            'ids': [record['id'] for record in records],
+            'cursor': version,
+            'storage_type': STORAGE_TYPE
+        })
+    except Exception as e:
+        logger.error(f"❌ 批次匯入失敗: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f'伺服器錯誤: {str(e)}'
+        }), 500
+
+@app.route('/api/data/conflicts', methods=['GET'])
+def get_conflicts():
+    """查詢同一員工與指定區間重疊的請假記錄（送出前預先檢查）"""
+    try:
+        name = request.args.get('name')
+        date_from = request.args.get('from')
+        date_to = request.args.get('to')
+        if not name or not date_from or not date_to:
             return jsonify({
                 'status': 'error',
-                'message': '找不到指定的數據'
-            }), 404
+                'message': '缺少必要參數: name, from, to'
+            }), 400
+        try:
+            datetime.strptime(date_from, '%Y-%m-%d')
+            datetime.strptime(date_to, '%Y-%m-%d')
+        except ValueError:
+            return jsonify({
+                'status': 'error',
+                'message': '日期格式錯誤，應為 YYYY-MM-DD'
+            }), 400
+        
+        conflicts = conflict_details(store.find_conflicts(name, date_from, date_to,
+                                                          request.args.get('exclude')))
+        return jsonify({
+            'status': 'success',
+            'conflicts': conflicts,
+            'count': len(conflicts)
+        })
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@app.route('/api/data/<data_id>', methods=['DELETE'])
+def delete_leave_data(data_id):
+    """刪除單筆請假數據"""
+    try:
+        if delete_data([data_id]):
+            return jsonify({
+                'status': 'success',
+                'message': '數據已刪除',
+                'id': data_id,
+                'cursor': get_data_version()
+            })
+        return jsonify({
+            'status': 'error',
+            'message': '找不到指定的數據'
+        }), 404
             
     except Exception as e:
+        logger.error(f"❌ 刪除數據失敗: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f'刪除失敗: {str(e)}'
+        }), 500
+
+@app.route('/api/data', methods=['DELETE'])
+def delete_leave_data_batch():
+    """批次刪除請假數據：{"ids": [...]} 或 ID 陣列，在一次寫入中完成"""
+    try:
+        payload = request.get_json(silent=True)
+        record_ids = payload.get('ids') if isinstance(payload, dict) else payload
+        if (not isinstance(record_ids, list) or not record_ids
+                or not all(isinstance(record_id, (str, int)) and not isinstance(record_id, bool)
+                           for record_id in record_ids)):
+            return jsonify({
+                'status': 'error',
+                'message': '請提供要刪除的 ID 陣列: {"ids": [...]}'
+            }), 400
+        if len(record_ids) > DELETE_MAX_IDS:
+            return jsonify({
+                'status': 'error',
+                'message': f'超過單次刪除上限 {DELETE_MAX_IDS} 筆'
+            }), 413
+        
+        # 重複的 ID 只刪除一次，保留原順序
+        record_ids = list(dict.fromkeys(str(record_id) for record_id in record_ids))
+        deleted = delete_data(record_ids)
+        deleted_set = set(deleted)
+        not_found = [record_id for record_id in record_ids if record_id not in deleted_set]
+        return jsonify({
+            'status': 'success',
+            'message': f'已刪除 {len(deleted)} 筆記錄',
+            'deleted': deleted,
+            'not_found': not_found,
+            'count': len(deleted),
+            'cursor': get_data_version()
+        })
+    except Exception as e:
+        logger.error(f"❌ 批次刪除失敗: {str(e)}")
         return jsonify({
             'status': 'error',
             'message': f'刪除失敗: {str(e)}'
@@ -354,14 +1221,27 @@ def delete_leave_data(data_id):
 @app.route('/health')
 def health_check():
     """健康檢查"""
-    db_status = "connected" if get_db_connection() else "local"
-    return jsonify({
+    if STORAGE_TYPE == 'sqlite':
+        try:
+            store.version()
+            db_status = "connected"
+        except Exception as e:
+            logger.error(f"❌ SQLite 檢查失敗: {e}")
+            db_status = "error"
+        conn = None
+    else:
+        with db_connection() as conn:
+            db_status = "connected" if conn else "local"
+    result = {
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
         'version': '3.0.0',
         'database': db_status,
-        'storage': 'postgresql' if DATABASE_URL else 'json'
-    })
+        'storage': STORAGE_TYPE
+    }
+    if DATABASE_URL and conn:
+        result['pool'] = get_pool(DATABASE_URL, sslmode='require').stats()
+    return jsonify(result)
 
 @app.route('/debug/database')
 def debug_database():
@@ -370,8 +1250,8 @@ def debug_database():
         if not DATABASE_URL:
             return jsonify({
                 'status': 'error',
-                'message': '未設定 DATABASE_URL，使用本地 JSON 儲存',
-                'storage': 'json'
+                'message': '未設定 DATABASE_URL，使用本地儲存',
+                'storage': STORAGE_TYPE
             })
         
         conn = get_db_connection()
@@ -440,7 +1320,7 @@ def debug_database():
                 })
                 
         finally:
-            conn.close()
+            release_db_connection(conn)
             
     except Exception as e:
         return jsonify({
@@ -463,17 +1343,26 @@ def internal_error(error):
         'message': '伺服器內部錯誤'
     }), 500
 
+# gunicorn 以 app:app 匯入時不會執行 __main__，在此確保表結構存在
+if STORAGE_TYPE != 'json' and __name__ != '__main__':
+    init_database()
+
 if __name__ == '__main__':
     print(f"🚀 請假管理系統啟動中...")
     print(f"📍 Host: {HOST}")
     print(f"🔌 Port: {PORT}")
-    print(f"🗄️ 數據庫: {'PostgreSQL' if DATABASE_URL else 'Local JSON'}")
+    print(f"🗄️ 數據庫: {'PostgreSQL' if DATABASE_URL else {'sqlite': 'SQLite', 'memory': 'Memory'}.get(STORAGE_TYPE, 'Local JSON')}")
     print(f"🌐 環境: {'Production' if os.environ.get('PORT') else 'Development'}")
     
     # 初始化數據庫
     if DATABASE_URL:
         print("� 正在連接數據庫...")
         init_database()
+    elif STORAGE_TYPE == 'sqlite':
+        print(f"🗃️ 使用 SQLite 儲存: {SQLITE_PATH}")
+        init_database()
+    elif STORAGE_TYPE == 'memory':
+        print("💾 使用記憶體儲存（重啟後重置，僅限單一 worker）")
     else:
         print("📁 使用本地文件儲存")
     
@@ -9,11 +9,13 @@ MIT License - LeaveSystem Project 2024
 
 import os
 import json
-import threading
 from datetime import datetime
 from flask import Flask, request, jsonify, send_from_directory, send_file
 import logging
 
+from leave_calendar import DailyCalendar
+from leave_store import MemoryStore, new_record_id
+
 app = Flask(__name__)
 
 # 配置日誌
@@ -25,14 +27,13 @@ PORT = int(os.environ.get('PORT', 10000))
 HOST = os.environ.get('HOST', '0.0.0.0')
 
 # 使用記憶體儲存數據 (重啟後會清空，但單次會話中所有人共享)
-MEMORY_DATA = []
-data_lock = threading.Lock()
+store = MemoryStore()
+leave_calendar = DailyCalendar()   # 請假統計，依數據版本增量同步
 
 def load_initial_data():
     """載入初始演示數據"""
-    global MEMORY_DATA
-    if not MEMORY_DATA:  # 只在空的時候載入
-        MEMORY_DATA = [
+    if not store.count():  # 只在空的時候載入
+        store.upsert_many([
             {
                 "id": "demo_001",
                 "name": "演示用戶A",
@@ -51,43 +52,32 @@ def load_initial_data():
                 "type": "特休",
                 "createTime": datetime.now().isoformat()
             }
-        ]
-        logger.info(f"✅ 載入初始演示數據: {len(MEMORY_DATA)} 筆記錄")
+        ])
+        logger.info(f"✅ 載入初始演示數據: {store.count()} 筆記錄")
 
 def get_all_data():
     """獲取所有數據"""
-    global MEMORY_DATA
-    with data_lock:
-        return MEMORY_DATA.copy()
+    return store.load()
 
 def add_data(record):
-    """新增數據"""
-    global MEMORY_DATA
+    """新增數據（同 ID 則取代）"""
     try:
-        with data_lock:
-            # 移除舊記錄（如果ID重複）
-            MEMORY_DATA = [item for item in MEMORY_DATA if item.get('id') != record['id']]
-            # 添加新記錄
-            MEMORY_DATA.append(record)
-            logger.info(f"✅ 新增記錄: {record['id']}, 總計: {len(MEMORY_DATA)} 筆")
-            return True
+        store.upsert(record)
+        logger.info(f"✅ 新增記錄: {record['id']}, 總計: {store.count()} 筆")
+        return True
     except Exception as e:
         logger.error(f"❌ 新增記錄失敗: {e}")
         return False
 
 def delete_data(record_id):
     """刪除數據"""
-    global MEMORY_DATA
     try:
-        with data_lock:
-            original_count = len(MEMORY_DATA)
-            MEMORY_DATA = [item for item in MEMORY_DATA if item.get('id') != record_id]
-            if len(MEMORY_DATA) < original_count:
-                logger.info(f"✅ 刪除記錄: {record_id}, 剩餘: {len(MEMORY_DATA)} 筆")
-                return True
-            else:
-                logger.warning(f"⚠️ 找不到要刪除的記錄: {record_id}")
-                return False
+        if store.delete([record_id]):
+            logger.info(f"✅ 刪除記錄: {record_id}, 剩餘: {store.count()} 筆")
+            return True
+        else:
+            logger.warning(f"⚠️ 找不到要刪除的記錄: {record_id}")
+            return False
     except Exception as e:
         logger.error(f"❌ 刪除記錄失敗: {e}")
         return False
@@ -129,9 +119,23 @@ def serve_static(filename):
 
 @app.route('/api/data', methods=['GET'])
 def get_data():
-    """獲取請假數據"""
+    """獲取請假數據（可用 from / to 或 date 篩選區間，經由日期索引查詢）"""
     try:
-        data = get_all_data()
+        date_from = request.args.get('from') or request.args.get('date')
+        date_to = request.args.get('to') or request.args.get('date')
+        if date_from or date_to:
+            try:
+                for value in (date_from, date_to):
+                    if value:
+                        datetime.strptime(value, '%Y-%m-%d')
+            except ValueError:
+                return jsonify({
+                    'status': 'error',
+                    'message': '日期格式錯誤，應為 YYYY-MM-DD'
+                }), 400
+            data = list(store.query(date_from=date_from, date_to=date_to))
+        else:
+            data = get_all_data()
         return jsonify({
             'status': 'success',
             'data': data,
@@ -173,7 +177,7 @@ def save_leave_data():
             }), 400
         
         # 添加時間戳和ID
-        request_data['id'] = datetime.now().strftime('%Y%m%d_%H%M%S_%f')[:-3]
+        request_data['id'] = new_record_id()
         request_data['createTime'] = datetime.now().isoformat()
         
         # 儲存數據
@@ -183,7 +187,7 @@ def save_leave_data():
                 'message': '請假數據已儲存到記憶體',
                 'id': request_data['id'],
                 'storage': 'memory',
-                'total_records': len(get_all_data())
+                'total_records': store.count()
             })
         else:
             return jsonify({
@@ -206,7 +210,7 @@ def delete_leave_data(data_id):
                 'status': 'success',
                 'message': '數據已刪除',
                 'storage': 'memory',
-                'remaining_records': len(get_all_data())
+                'remaining_records': store.count()
             })
         else:
             return jsonify({
@@ -228,25 +232,21 @@ def health_check():
         'timestamp': datetime.now().isoformat(),
         'version': '2.1.0',
         'storage': 'memory',
-        'records_count': len(get_all_data()),
+        'records_count': store.count(),
         'note': '使用記憶體儲存，重啟後資料會重置'
     })
 
 @app.route('/api/stats')
 def get_stats():
     """獲取統計資訊"""
-    data = get_all_data()
-    
-    # 統計各種請假類型
-    type_stats = {}
-    for record in data:
-        leave_type = record.get('type', '未知')
-        type_stats[leave_type] = type_stats.get(leave_type, 0) + 1
+    # 統計隨寫入增量維護，不必每次走訪所有記錄
+    leave_calendar.sync(store.version(), store.changes_since, store.snapshot)
+    stats = leave_calendar.stats()
     
     return jsonify({
         'status': 'success',
-        'total_records': len(data),
-        'type_statistics': type_stats,
+        'type_statistics': {key: value['count'] for key, value in stats['by_type'].items()},
+        **stats,
         'storage_info': {
             'type': 'memory',
             'persistent': False,
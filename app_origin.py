@@ -8,48 +8,50 @@ MIT License - LeaveSystem Project 2024
 """
 
 import os
-import json
-import threading
 from datetime import datetime
 from flask import Flask, request, jsonify, send_from_directory, send_file
 
+from leave_store import create_store, new_record_id
+
 app = Flask(__name__)
 
 # 環境變數
 PORT = int(os.environ.get('PORT', 10000))
 HOST = os.environ.get('HOST', '0.0.0.0')
 
-# 數據文件
+# 數據文件（快照 + 追加式日誌，見 json_journal.py）
 DATA_FILE = 'data.json'
-data_lock = threading.Lock()
+store = create_store('json', path=DATA_FILE)
 
 def load_data():
     """載入請假數據"""
     try:
-        if os.path.exists(DATA_FILE):
-            with open(DATA_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        else:
-            # 初始化演示數據
-            initial_data = []
-            save_data(initial_data)
-            return initial_data
+        return store.load()
     except Exception as e:
         print(f"❌ 載入數據失敗: {e}")
         return []
 
-def save_data(data):
-    """儲存請假數據"""
+def save_data(record):
+    """儲存單筆請假數據（只追加一行日誌，不重寫整份文件）"""
     try:
-        with data_lock:
-            with open(DATA_FILE, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-        print(f"✅ 數據已儲存: {len(data)} 筆記錄")
+        store.upsert(record)
+        print(f"✅ 數據已儲存: {record['id']}")
         return True
     except Exception as e:
         print(f"❌ 儲存數據失敗: {e}")
         return False
 
+def delete_data(record_id):
+    """刪除請假數據"""
+    try:
+        if store.delete([record_id]):
+            print(f"✅ 數據已刪除: {record_id}")
+            return True
+        return False
+    except Exception as e:
+        print(f"❌ 刪除數據失敗: {e}")
+        raise
+
 def validate_leave_data(data):
     """驗證請假數據"""
     required_fields = ['name', 'startDate', 'endDate', 'reason', 'type']
@@ -128,18 +130,12 @@ def save_leave_data():
                 'message': message
             }), 400
         
-        # 載入現有數據
-        data = load_data()
-        
         # 添加時間戳和ID
-        request_data['id'] = datetime.now().strftime('%Y%m%d_%H%M%S_%f')[:-3]
+        request_data['id'] = new_record_id()
         request_data['createTime'] = datetime.now().isoformat()
         
-        # 添加新數據
-        data.append(request_data)
-        
         # 儲存數據
-        if save_data(data):
+        if save_data(request_data):
             return jsonify({
                 'status': 'success',
                 'message': '請假數據已儲存',
@@ -161,23 +157,11 @@ def save_leave_data():
 def delete_leave_data(data_id):
     """刪除請假數據"""
     try:
-        data = load_data()
-        original_count = len(data)
-        
-        # 過濾掉要刪除的項目
-        data = [item for item in data if item.get('id') != data_id]
-        
-        if len(data) < original_count:
-            if save_data(data):
-                return jsonify({
-                    'status': 'success',
-                    'message': '數據已刪除'
-                })
-            else:
-                return jsonify({
-                    'status': 'error',
-                    'message': '刪除失敗'
-                }), 500
+        if delete_data(data_id):
+            return jsonify({
+                'status': 'success',
+                'message': '數據已刪除'
+            })
         else:
             return jsonify({
                 'status': 'error',
@@ -220,9 +204,9 @@ if __name__ == '__main__':
     print(f"🌐 環境: {'Production' if os.environ.get('PORT') else 'Development'}")
     
     # 確保數據文件存在
-    if not os.path.exists(DATA_FILE):
+    if not store.exists():
         print(f"📁 初始化數據文件: {DATA_FILE}")
-        save_data([])
+        store.compact()
     
     # 啟動 Flask 應用
     app.run(host=HOST, port=PORT, debug=False)
@@ -10,12 +10,15 @@ MIT License - LeaveSystem Project 2024
 import os
 import json
 import threading
+from contextlib import contextmanager
 from datetime import datetime
 from flask import Flask, request, jsonify, send_from_directory, send_file
-import psycopg2
 from psycopg2.extras import RealDictCursor
 import logging
 
+from db_pool import get_pool
+from leave_store import new_record_id
+
 app = Flask(__name__)
 
 # 配置日誌
@@ -31,12 +34,11 @@ DATABASE_URL = os.environ.get('DATABASE_URL')
 data_lock = threading.Lock()
 
 def get_db_connection():
-    """獲取數據庫連接"""
+    """從連接池借出數據庫連接（用完須呼叫 release_db_connection 歸還）"""
     try:
         if DATABASE_URL:
-            # 生產環境：使用 PostgreSQL
-            conn = psycopg2.connect(DATABASE_URL, sslmode='require')
-            return conn
+            # 生產環境：使用 PostgreSQL 連接池
+            return get_pool(DATABASE_URL, sslmode='require').getconn()
         else:
             # 開發環境：使用本地 JSON 文件
             return None
@@ -44,38 +46,54 @@ def get_db_connection():
         logger.error(f"數據庫連接失敗: {e}")
         return None
 
+def release_db_connection(conn, discard=False):
+    """將連接歸還連接池"""
+    try:
+        get_pool(DATABASE_URL, sslmode='require').putconn(conn, discard=discard)
+    except Exception as e:
+        logger.error(f"歸還數據庫連接失敗: {e}")
+
+@contextmanager
+def db_connection():
+    """借出數據庫連接並在區塊結束時自動歸還"""
+    conn = get_db_connection()
+    try:
+        yield conn
+    finally:
+        if conn:
+            release_db_connection(conn)
+
 def init_database():
     """初始化數據庫表"""
     if not DATABASE_URL:
         return  # 本地環境跳過
     
     try:
-        conn = get_db_connection()
-        if conn:
-            with conn.cursor() as cur:
-                # 創建請假記錄表
-                cur.execute('''
-                    CREATE TABLE IF NOT EXISTS leave_records (
-                        id VARCHAR(50) PRIMARY KEY,
-                        name VARCHAR(100) NOT NULL,
-                        start_date DATE NOT NULL,
-                        end_date DATE NOT NULL,
-                        reason TEXT NOT NULL,
-                        type VARCHAR(50) NOT NULL,
-                        create_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        data JSONB
-                    )
-                ''')
+        with db_connection() as conn:
+            if conn:
+                with conn.cursor() as cur:
+                    # 創建請假記錄表
+                    cur.execute('''
+                        CREATE TABLE IF NOT EXISTS leave_records (
+                            id VARCHAR(50) PRIMARY KEY,
+                            name VARCHAR(100) NOT NULL,
+                            start_date DATE NOT NULL,
+                            end_date DATE NOT NULL,
+                            reason TEXT NOT NULL,
+                            type VARCHAR(50) NOT NULL,
+                            create_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                            data JSONB
+                        )
+                    ''')
                 
-                # 創建索引提升查詢效能
-                cur.execute('''
-                    CREATE INDEX IF NOT EXISTS idx_leave_records_date 
-                    ON leave_records(start_date, end_date)
-                ''')
+                    # 創建索引提升查詢效能
+                    cur.execute('''
+                        CREATE INDEX IF NOT EXISTS idx_leave_records_date 
+                        ON leave_records(start_date, end_date)
+                    ''')
                 
-                conn.commit()
-                logger.info("✅ 數據庫表初始化完成")
-            conn.close()
+                    conn.commit()
+                    logger.info("✅ 數據庫表初始化完成")
     except Exception as e:
         logger.error(f"❌ 數據庫初始化失敗: {e}")
 
@@ -84,37 +102,36 @@ def load_data():
     try:
         if DATABASE_URL:
             # 從 PostgreSQL 載入
-            conn = get_db_connection()
-            if conn:
-                with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                    cur.execute('''
-                        SELECT id, name, start_date, end_date, reason, type, 
-                               create_time, data
-                        FROM leave_records 
-                        ORDER BY create_time DESC
-                    ''')
-                    rows = cur.fetchall()
+            with db_connection() as conn:
+                if conn:
+                    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                        cur.execute('''
+                            SELECT id, name, start_date, end_date, reason, type, 
+                                   create_time, data
+                            FROM leave_records 
+                            ORDER BY create_time DESC
+                        ''')
+                        rows = cur.fetchall()
                     
-                    # 轉換為前端格式
-                    data = []
-                    for row in rows:
-                        record = {
-                            'id': row['id'],
-                            'name': row['name'],
-                            'startDate': row['start_date'].strftime('%Y-%m-%d'),
-                            'endDate': row['end_date'].strftime('%Y-%m-%d'),
-                            'reason': row['reason'],
-                            'type': row['type'],
-                            'createTime': row['create_time'].isoformat() if row['create_time'] else None
-                        }
-                        # 合併額外數據
-                        if row['data']:
-                            record.update(row['data'])
-                        data.append(record)
+                        # 轉換為前端格式
+                        data = []
+                        for row in rows:
+                            record = {
+                                'id': row['id'],
+                                'name': row['name'],
+                                'startDate': row['start_date'].strftime('%Y-%m-%d'),
+                                'endDate': row['end_date'].strftime('%Y-%m-%d'),
+                                'reason': row['reason'],
+                                'type': row['type'],
+                                'createTime': row['create_time'].isoformat() if row['create_time'] else None
+                            }
+                            # 合併額外數據
+                            if row['data']:
+                                record.update(row['data'])
+                            data.append(record)
                     
-                conn.close()
-                logger.info(f"✅ 從數據庫載入 {len(data)} 筆記錄")
-                return data
+                    logger.info(f"✅ 從數據庫載入 {len(data)} 筆記錄")
+                    return data
         
         # 本地環境：使用 JSON 文件
         if os.path.exists('data.json'):
@@ -147,37 +164,36 @@ def save_data(record):
         with data_lock:
             if DATABASE_URL:
                 # 儲存到 PostgreSQL
-                conn = get_db_connection()
-                if conn:
-                    with conn.cursor() as cur:
-                        # 準備額外數據
-                        extra_data = {k: v for k, v in record.items() 
-                                    if k not in ['id', 'name', 'startDate', 'endDate', 'reason', 'type', 'createTime']}
+                with db_connection() as conn:
+                    if conn:
+                        with conn.cursor() as cur:
+                            # 準備額外數據
+                            extra_data = {k: v for k, v in record.items() 
+                                        if k not in ['id', 'name', 'startDate', 'endDate', 'reason', 'type', 'createTime']}
                         
-                        cur.execute('''
-                            INSERT INTO leave_records 
-                            (id, name, start_date, end_date, reason, type, data)
-                            VALUES (%s, %s, %s, %s, %s, %s, %s)
-                            ON CONFLICT (id) DO UPDATE SET
-                            name = EXCLUDED.name,
-                            start_date = EXCLUDED.start_date,
-                            end_date = EXCLUDED.end_date,
-                            reason = EXCLUDED.reason,
-                            type = EXCLUDED.type,
-                            data = EXCLUDED.data
-                        ''', (
-                            record['id'],
-                            record['name'],
-                            record['startDate'],
-                            record['endDate'],
-                            record['reason'],
-                            record['type'],
-                            json.dumps(extra_data) if extra_data else None
-                        ))
-                        conn.commit()
-                    conn.close()
-                    logger.info(f"✅ 數據已儲存到數據庫: {record['id']}")
-                    return True
+                            cur.execute('''
+                                INSERT INTO leave_records 
+                                (id, name, start_date, end_date, reason, type, data)
+                                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                                ON CONFLICT (id) DO UPDATE SET
+                                name = EXCLUDED.name,
+                                start_date = EXCLUDED.start_date,
+                                end_date = EXCLUDED.end_date,
+                                reason = EXCLUDED.reason,
+                                type = EXCLUDED.type,
+                                data = EXCLUDED.data
+                            ''', (
+                                record['id'],
+                                record['name'],
+                                record['startDate'],
+                                record['endDate'],
+                                record['reason'],
+                                record['type'],
+                                json.dumps(extra_data) if extra_data else None
+                            ))
+                            conn.commit()
+                        logger.info(f"✅ 數據已儲存到數據庫: {record['id']}")
+                        return True
             else:
                 # 本地環境：儲存到 JSON
                 data = load_data()
@@ -201,20 +217,19 @@ def delete_data(record_id):
         with data_lock:
             if DATABASE_URL:
                 # 從 PostgreSQL 刪除
-                conn = get_db_connection()
-                if conn:
-                    with conn.cursor() as cur:
-                        cur.execute('DELETE FROM leave_records WHERE id = %s', (record_id,))
-                        affected_rows = cur.rowcount
-                        conn.commit()
-                    conn.close()
+                with db_connection() as conn:
+                    if conn:
+                        with conn.cursor() as cur:
+                            cur.execute('DELETE FROM leave_records WHERE id = %s', (record_id,))
+                            affected_rows = cur.rowcount
+                            conn.commit()
                     
-                    if affected_rows > 0:
-                        logger.info(f"✅ 已從數據庫刪除記錄: {record_id}")
-                        return True
-                    else:
-                        logger.warning(f"⚠️ 找不到要刪除的記錄: {record_id}")
-                        return False
+                        if affected_rows > 0:
+                            logger.info(f"✅ 已從數據庫刪除記錄: {record_id}")
+                            return True
+                        else:
+                            logger.warning(f"⚠️ 找不到要刪除的記錄: {record_id}")
+                            return False
             else:
                 # 本地環境：從 JSON 刪除
                 data = load_data()
@@ -314,7 +329,7 @@ def save_leave_data():
             }), 400
         
         # 添加時間戳和ID
-        request_data['id'] = datetime.now().strftime('%Y%m%d_%H%M%S_%f')[:-3]
+        request_data['id'] = new_record_id()
         request_data['createTime'] = datetime.now().isoformat()
         
         # 儲存數據
@@ -362,7 +377,8 @@ def delete_leave_data(data_id):
 @app.route('/health')
 def health_check():
     """健康檢查"""
-    db_status = "connected" if get_db_connection() else "local"
+    with db_connection() as conn:
+        db_status = "connected" if conn else "local"
     return jsonify({
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
@@ -0,0 +1,530 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+請假管理系統 - API 伺服器壓力測試 (Leave Management System - API Load Test)
+MIT License - LeaveSystem Project 2024
+
+在本機啟動各個伺服器版本，以 N 個模擬用戶送出接近實際使用的請求組合
+（定期同步、月曆範圍讀取、送出請假、刪除），輸出吞吐量與 p50 / p95 / p99 延遲：
+
+    python bench_api.py                                  # app.py (JSON / SQLite)、app_memory.py、cloud_server.py
+    python bench_api.py --clients 50 --duration 30 --employees 200 --years 3
+    python bench_api.py --targets app-sqlite --output result.json
+    python bench_api.py --baseline result.json           # 與上次結果比較，退步超過容許範圍時回傳 1
+    python bench_api.py --dataset-only seed.json         # 只產生合成數據
+
+任何請求得到非 2xx / 304 的回應時，該伺服器標記為 "clean": false 並回傳 1。
+app-postgresql 只在明確指定 --dsn 時測試（會匯入合成數據，請使用測試用數據庫）。
+每個伺服器在獨立的暫存目錄中執行，不會動到專案目錄下的 data.json
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+from collections import Counter
+from datetime import date, datetime, timedelta
+from urllib.parse import quote
+
+from bench_stores import LEAVE_TYPES
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 請假類型的出現比例（事假、病假最常見）
+LEAVE_TYPE_WEIGHTS = [30, 30, 25, 10, 2, 3]
+# 請假天數的出現比例：多數為 1 天
+LEAVE_LENGTHS = [1, 1, 1, 1, 1, 2, 2, 3, 5]
+
+# 預設的請求組合（權重）：前端每 30 秒同步一次，月曆切換次之，送出與刪除較少
+DEFAULT_MIX = 'poll=70,calendar=15,submit=10,delete=5'
+OPERATIONS = ('poll', 'calendar', 'submit', 'delete')
+
+# 可測試的伺服器：script 為啟動的程式，api 決定各操作對應的端點
+TARGETS = {
+    'app-json': {'script': 'app.py', 'api': 'app', 'env': {'STORAGE_BACKEND': 'json'}},
+    'app-sqlite': {'script': 'app.py', 'api': 'app', 'env': {'STORAGE_BACKEND': 'sqlite'}},
+    'app-postgresql': {'script': 'app.py', 'api': 'app', 'env': {}},
+    'app-memory': {'script': 'app_memory.py', 'api': 'memory', 'env': {}},
+    'cloud': {'script': 'cloud_server.py', 'api': 'cloud', 'env': {}},
+}
+DEFAULT_TARGETS = 'app-json,app-sqlite,app-memory,cloud'
+
+
+# ---------------------------------------------------------------- 合成數據
+
+def generate_dataset(employees, years, per_year=12, seed=42, start_year=None):
+    """產生 employees 位員工 × years 年的請假記錄；同一員工的請假不重疊（可通過衝突檢查）"""
+    rng = random.Random(seed)
+    start_year = start_year or date.today().year - years + 1
+    first_day, last_day = date(start_year, 1, 1), date(start_year + years, 1, 1)
+    records = []
+    for employee in range(employees):
+        name = f'員工{employee:04d}'
+        day = first_day + timedelta(days=rng.randrange(30))
+        serial = 0
+        while True:
+            day += timedelta(days=int(rng.expovariate(per_year / 365.0)))
+            length = rng.choice(LEAVE_LENGTHS)
+            end = day + timedelta(days=length - 1)
+            if end >= last_day:
+                break
+            created = datetime.combine(day, datetime.min.time()) - timedelta(days=rng.randrange(1, 30),
+                                                                               minutes=rng.randrange(1440))
+            records.append({
+                'id': f'seed_{employee:05d}_{serial:04d}',
+                'name': name,
+                'startDate': day.isoformat(),
+                'endDate': end.isoformat(),
+                'reason': '合成測試數據',
+                'type': rng.choices(LEAVE_TYPES, LEAVE_TYPE_WEIGHTS)[0],
+                'submitDate': created.date().isoformat(),
+                'createTime': created.isoformat()
+            })
+            serial += 1
+            day = end + timedelta(days=1)
+    return records
+
+
+def dataset_months(records):
+    """數據涵蓋的月份（月曆讀取從中隨機挑選）"""
+    months = sorted({record['startDate'][:7] for record in records})
+    return months or [date.today().isoformat()[:7]]
+
+
+# ---------------------------------------------------------------- 伺服器
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class ServerProcess:
+    """在暫存目錄中啟動一個伺服器程序，結束時一併清除"""
+
+    def __init__(self, target, dsn=None, gunicorn=False):
+        config = TARGETS[target]
+        self.target = target
+        self.api = config['api']
+        self.port = free_port()
+        self.workdir = tempfile.mkdtemp(prefix=f'bench_api_{target}_')
+        self.log_path = os.path.join(self.workdir, 'server.log')
+
+        env = dict(os.environ, HOST='127.0.0.1', PORT=str(self.port), PYTHONUNBUFFERED='1',
+                   PYTHONPATH=os.pathsep.join(filter(None, [REPO_DIR, os.environ.get('PYTHONPATH')])))
+        env.pop('DATABASE_URL', None)
+        env.update(config['env'])
+        if target == 'app-postgresql':
+            env['DATABASE_URL'] = dsn
+        self.env = env
+
+        if gunicorn and config['script'] == 'app.py':
+            # 與 Procfile 相同的部署方式
+            self.command = [sys.executable, '-m', 'gunicorn', 'app:app', '--bind', f'127.0.0.1:{self.port}',
+                            '--workers', '2', '--worker-class', 'gthread', '--threads', '64', '--preload']
+        else:
+            self.command = [sys.executable, os.path.join(REPO_DIR, config['script'])]
+        self.process = None
+
+    def write_seed_file(self, records):
+        """cloud_server.py 直接讀取工作目錄中的 data.json"""
+        with open(os.path.join(self.workdir, 'data.json'), 'w', encoding='utf-8') as f:
+            json.dump(records, f, ensure_ascii=False)
+
+    def start(self, timeout=30):
+        self.log_file = open(self.log_path, 'wb')
+        self.process = subprocess.Popen(self.command, cwd=self.workdir, env=self.env,
+                                        stdout=self.log_file, stderr=subprocess.STDOUT)
+        ready_path = '/data.json' if self.api == 'cloud' else '/health'
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                break
+            try:
+                conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=2)
+                conn.request('GET', ready_path)
+                if conn.getresponse().status == 200:
+                    conn.close()
+                    return
+                conn.close()
+            except OSError:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError(f'{self.target} 無法啟動，請查看 {self.log_path}')
+
+    def stop(self, keep=False):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        if self.process is not None:
+            self.log_file.close()
+        if not keep:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+# ---------------------------------------------------------------- 用戶端
+
+class Client:
+    """一個模擬用戶：保持連線（keep-alive），記錄每個請求的延遲"""
+
+    def __init__(self, port, api, index, months, rng):
+        self.port = port
+        self.api = api
+        self.index = index
+        self.months = months
+        self.rng = rng
+        self.conn = None
+        self.reused = False
+        self.cursor = None          # /api/data/changes 游標
+        self.etag = None            # cloud_server 的 data.json ETag
+        self.submitted = []         # 自己送出、尚未刪除的記錄 ID
+        # 每個用戶使用獨立的員工名稱與遞增的日期（遠離合成數據），送出的請假不會彼此重疊
+        self.next_day = date(2100, 1, 1)
+
+    def request(self, method, path, body=None, headers=None):
+        """送出請求並讀完回應；回傳 (狀態碼, 回應內容, 回應物件)"""
+        headers = dict(headers or {})
+        payload = None
+        if body is not None:
+            payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+                self.reused = False
+            try:
+                self.conn.request(method, path, body=payload, headers=headers)
+                response = self.conn.getresponse()
+                data = response.read()
+                if response.getheader('Connection', '').lower() == 'close' or response.version == 10:
+                    self.close()
+                else:
+                    self.reused = True
+                return response.status, data, response
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                # 伺服器關閉了閒置的連線：重新連線後重送一次
+                retry = self.reused and attempt == 0
+                self.close()
+                if not retry:
+                    raise
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    # ------------------------------------------------------------ 操作
+
+    def poll(self):
+        if self.api == 'app':
+            path = '/api/data/changes'
+            if self.cursor is not None:
+                path += '?since=' + quote(str(self.cursor))
+            status, data, _ = self.request('GET', path)
+            if status == 200:
+                self.cursor = json.loads(data).get('cursor')
+            return status
+        if self.api == 'memory':
+            return self.request('GET', '/api/data')[0]
+        headers = {'If-None-Match': self.etag} if self.etag else None
+        status, _, response = self.request('GET', '/data.json', headers=headers)
+        if status == 200:
+            self.etag = response.getheader('ETag')
+        return status
+
+    def calendar(self):
+        """切換到隨機月份：月曆顯示 6 週（42 天）"""
+        year, month = map(int, self.rng.choice(self.months).split('-'))
+        first = date(year, month, 1)
+        start = first - timedelta(days=first.weekday())
+        end = start + timedelta(days=41)
+        if self.api == 'app':
+            return self.request('GET', f'/api/calendar?from={start.isoformat()}&to={end.isoformat()}')[0]
+        # 沒有範圍查詢的伺服器：前端只能重新載入全部數據
+        if self.api == 'memory':
+            return self.request('GET', '/api/data')[0]
+        return self.request('GET', '/data.json')[0]
+
+    def submit(self):
+        length = self.rng.choice(LEAVE_LENGTHS)
+        start, end = self.next_day, self.next_day + timedelta(days=length - 1)
+        self.next_day = end + timedelta(days=1 + self.rng.randrange(7))
+        record = {
+            'name': f'壓測用戶{self.index:04d}',
+            'startDate': start.isoformat(),
+            'endDate': end.isoformat(),
+            'reason': '壓力測試',
+            'type': self.rng.choices(LEAVE_TYPES, LEAVE_TYPE_WEIGHTS)[0],
+            'submitDate': date.today().isoformat()
+        }
+        if self.api == 'cloud':
+            record['createTime'] = datetime.now().isoformat()
+            status, data, _ = self.request('POST', '/api/records', record)
+        else:
+            status, data, _ = self.request('POST', '/api/data', record)
+        if 200 <= status < 300:
+            record_id = json.loads(data).get('id')
+            if record_id is not None:
+                self.submitted.append(str(record_id))
+        return status
+
+    def delete(self):
+        record_id = quote(self.submitted.pop(self.rng.randrange(len(self.submitted))), safe='')
+        if self.api == 'cloud':
+            return self.request('DELETE', f'/api/records/{record_id}')[0]
+        return self.request('DELETE', f'/api/data/{record_id}')[0]
+
+
+def percentile(sorted_values, pct):
+    """最近排名法百分位數"""
+    if not sorted_values:
+        return None
+    rank = max(int(math.ceil(pct / 100.0 * len(sorted_values))) - 1, 0)
+    return sorted_values[rank]
+
+
+def summarize(samples, seconds):
+    """[(延遲秒數, 狀態碼)] → 吞吐量、錯誤數與延遲分佈（毫秒）"""
+    latencies = sorted(latency for latency, _ in samples)
+    statuses = Counter(str(status) for _, status in samples)
+    errors = sum(count for status, count in statuses.items()
+                 if not (status.startswith('2') or status == '304'))
+
+    def ms(value):
+        return round(value * 1000, 2) if value is not None else None
+
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'throughput_rps': round(len(samples) / seconds, 1) if seconds > 0 else None,
+        'latency_ms': {
+            'mean': ms(sum(latencies) / len(latencies)) if latencies else None,
+            'p50': ms(percentile(latencies, 50)),
+            'p95': ms(percentile(latencies, 95)),
+            'p99': ms(percentile(latencies, 99)),
+            'max': ms(latencies[-1]) if latencies else None
+        },
+        'status': dict(statuses)
+    }
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f'未知的操作: {name}（可用: {", ".join(OPERATIONS)}）')
+        mix[name] = float(weight or 0)
+    if not any(mix.values()):
+        raise ValueError('請求組合的權重總和必須大於 0')
+    return mix
+
+
+def run_load(port, api, months, clients, duration, warmup, mix, think, seed):
+    """N 個用戶同時執行 warmup + duration 秒；只統計暖機之後的請求"""
+    names = [name for name in OPERATIONS if mix.get(name)]
+    weights = [mix[name] for name in names]
+    samples = {name: [] for name in OPERATIONS}
+    samples_lock = threading.Lock()
+    started = time.perf_counter()
+    measure_from = started + warmup
+    deadline = measure_from + duration
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        client = Client(port, api, index, months, rng)
+        local = {name: [] for name in OPERATIONS}
+        try:
+            while True:
+                op = rng.choices(names, weights)[0]
+                if op == 'delete' and not client.submitted:
+                    op = 'submit'
+                begin = time.perf_counter()
+                if begin >= deadline:
+                    break
+                try:
+                    status = getattr(client, op)()
+                except (OSError, http.client.HTTPException, ValueError):
+                    client.close()
+                    status = 'connection_error'
+                end = time.perf_counter()
+                if begin >= measure_from:
+                    local[op].append((end - begin, status))
+                if think:
+                    time.sleep(rng.expovariate(1.0 / think))
+        finally:
+            client.close()
+            with samples_lock:
+                for name, values in local.items():
+                    samples[name].extend(values)
+
+    threads = [threading.Thread(target=worker, args=(index,), daemon=True) for index in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = max(time.perf_counter() - measure_from, 1e-9)
+
+    result = summarize([sample for values in samples.values() for sample in values], seconds)
+    result['operations'] = {name: summarize(values, seconds) for name, values in samples.items() if values}
+    return result
+
+
+# ---------------------------------------------------------------- 匯入合成數據
+
+def seed_server(server, records):
+    """以伺服器本身的寫入路徑匯入合成數據"""
+    client = Client(server.port, server.api, 0, [], random.Random(0))
+    try:
+        if server.api == 'app':
+            for i in range(0, len(records), 10000):
+                status, data, _ = client.request('POST', '/api/data/bulk?atomic=1', records[i:i + 10000])
+                if status != 200:
+                    raise RuntimeError(f'匯入合成數據失敗: HTTP {status} {data[:200]!r}')
+        elif server.api == 'memory':
+            # 記憶體版沒有批次匯入，逐筆送出
+            for record in records:
+                status, data, _ = client.request('POST', '/api/data', record)
+                if status != 200:
+                    raise RuntimeError(f'匯入合成數據失敗: HTTP {status} {data[:200]!r}')
+    finally:
+        client.close()
+
+
+# ---------------------------------------------------------------- 比較
+
+def compare(report, baseline, tolerance):
+    """與基準結果比較：吞吐量下降或 p95 延遲上升超過 tolerance 比例即視為退步"""
+    regressions = []
+    for target, current in report['targets'].items():
+        previous = baseline.get('targets', {}).get(target)
+        if not previous or 'throughput_rps' not in current or 'throughput_rps' not in previous:
+            continue
+        old_rps, new_rps = previous['throughput_rps'], current['throughput_rps']
+        if old_rps and new_rps is not None and new_rps < old_rps * (1 - tolerance):
+            regressions.append(f'{target}: 吞吐量 {old_rps} → {new_rps} req/s')
+        old_p95, new_p95 = previous['latency_ms']['p95'], current['latency_ms']['p95']
+        if old_p95 and new_p95 is not None and new_p95 > old_p95 * (1 + tolerance):
+            regressions.append(f'{target}: p95 延遲 {old_p95} → {new_p95} ms')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='API 伺服器壓力測試')
+    parser.add_argument('--targets', default=DEFAULT_TARGETS,
+                        help=f"以逗號分隔（可用: {', '.join(TARGETS)}）")
+    parser.add_argument('--clients', type=int, default=20, help='同時的模擬用戶數')
+    parser.add_argument('--duration', type=float, default=10, help='每個伺服器的測量秒數')
+    parser.add_argument('--warmup', type=float, default=2, help='暖機秒數（不列入統計）')
+    parser.add_argument('--think', type=float, default=0,
+                        help='用戶每次請求之間的平均等待秒數（0 表示持續送出）')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'請求組合權重（預設 {DEFAULT_MIX}）')
+    parser.add_argument('--employees', type=int, default=50, help='合成數據的員工數')
+    parser.add_argument('--years', type=int, default=2, help='合成數據涵蓋的年數')
+    parser.add_argument('--per-year', type=float, default=12, help='每位員工每年平均請假次數')
+    parser.add_argument('--seed', type=int, default=42, help='亂數種子')
+    parser.add_argument('--dsn', default=None, help='PostgreSQL 連線字串（測試 app-postgresql 時必填）')
+    parser.add_argument('--gunicorn', action='store_true', help='app.py 以 Procfile 的 gunicorn 設定啟動')
+    parser.add_argument('--keep', action='store_true', help='保留伺服器的暫存目錄與日誌')
+    parser.add_argument('--output', default=None, help='將結果寫入 JSON 文件')
+    parser.add_argument('--baseline', default=None, help='與先前的結果文件比較')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='容許的退步比例（預設 0.2）')
+    parser.add_argument('--dataset-only', metavar='PATH', default=None, help='只產生合成數據並寫入文件')
+    args = parser.parse_args(argv)
+
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+    records = generate_dataset(args.employees, args.years, per_year=args.per_year, seed=args.seed)
+    if args.dataset_only:
+        with open(args.dataset_only, 'w', encoding='utf-8') as f:
+            json.dump(records, f, ensure_ascii=False)
+        print(f'✅ 已產生 {len(records)} 筆合成數據: {args.dataset_only}', file=sys.stderr)
+        return 0
+    months = dataset_months(records)
+
+    report = {
+        'config': {
+            'clients': args.clients, 'duration': args.duration, 'warmup': args.warmup,
+            'think': args.think, 'mix': mix, 'employees': args.employees, 'years': args.years,
+            'records': len(records), 'seed': args.seed, 'gunicorn': args.gunicorn,
+            'python': sys.version.split()[0], 'timestamp': datetime.now().isoformat()
+        },
+        'targets': {}
+    }
+    ok = True
+    for target in [target.strip() for target in args.targets.split(',') if target.strip()]:
+        if target not in TARGETS:
+            parser.error(f'未知的伺服器: {target}')
+        if target == 'app-postgresql' and not args.dsn:
+            print('⚠️ 略過 app-postgresql：未指定 --dsn', file=sys.stderr)
+            continue
+        server = ServerProcess(target, dsn=args.dsn, gunicorn=args.gunicorn)
+        failed = False
+        try:
+            print(f'🚀 {target}: 啟動伺服器並匯入 {len(records)} 筆合成數據...', file=sys.stderr)
+            if server.api == 'cloud':
+                server.write_seed_file(records)
+            server.start()
+            seed_started = time.perf_counter()
+            seed_server(server, records)
+            seed_seconds = time.perf_counter() - seed_started
+            print(f'⏱️ {target}: {args.clients} 個用戶，{args.duration:g} 秒...', file=sys.stderr)
+            result = run_load(server.port, server.api, months, args.clients, args.duration,
+                              args.warmup, mix, args.think, args.seed)
+            result['seed_seconds'] = round(seed_seconds, 3)
+            report['targets'][target] = result
+            # 任何非 2xx / 304 的回應（例如剛建立的記錄刪除時 404）都代表伺服器有問題，整次測試不通過
+            result['clean'] = result['errors'] == 0
+            print(f"{'✅' if result['clean'] else '❌'} {target}: {result['throughput_rps']} req/s，"
+                  f"p50 {result['latency_ms']['p50']} ms，p95 {result['latency_ms']['p95']} ms，"
+                  f"p99 {result['latency_ms']['p99']} ms，錯誤 {result['errors']}", file=sys.stderr)
+            if not result['clean']:
+                ok = False
+                for op, summary in result['operations'].items():
+                    if summary['errors']:
+                        print(f"❌ {target} {op}: {summary['errors']} 筆錯誤 {summary['status']}", file=sys.stderr)
+        except Exception as e:
+            failed = True
+            ok = False
+            report['targets'][target] = {'error': str(e)}
+            print(f'❌ {target}: {e}', file=sys.stderr)
+        finally:
+            server.stop(keep=args.keep or failed)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        report['regressions'] = regressions
+        for regression in regressions:
+            print(f'❌ 效能退步 {regression}', file=sys.stderr)
+        ok = ok and not regressions
+
+    report['clean'] = ok
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    print(output)
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+請假管理系統 - 儲存引擎一致性檢查與效能比較 (Leave Management System - Storage Engine Benchmark)
+MIT License - LeaveSystem Project 2024
+
+以相同的工作負載檢查並測量每個儲存引擎，協助為各種部署選擇最快的引擎：
+
+    python bench_stores.py                              # memory / json / sqlite
+    python bench_stores.py --records 20000 --output result.json
+    python bench_stores.py --engines postgresql --dsn postgresql://...
+
+PostgreSQL 只在明確指定 --dsn 時測試；只會寫入並刪除本次執行產生的記錄
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import shutil
+import argparse
+import tempfile
+from datetime import date, datetime, timedelta
+
+from leave_store import STORAGE_ENGINES, ConflictError, DuplicateIdError, create_store
+
+LEAVE_TYPES = ['事假', '病假', '特休', '公假', '婚假', '喪假']
+
+
+def make_record(prefix, index, rng, start=date(2022, 1, 1), days=3 * 365, employees=200):
+    """產生一筆合成請假記錄"""
+    start_date = start + timedelta(days=rng.randrange(days))
+    end_date = start_date + timedelta(days=rng.choice([0, 0, 0, 1, 2, 4]))
+    return {
+        'id': f'{prefix}_{index:07d}',
+        'name': f'員工{rng.randrange(employees):04d}',
+        'startDate': start_date.isoformat(),
+        'endDate': end_date.isoformat(),
+        'reason': '合成測試數據',
+        'type': rng.choice(LEAVE_TYPES),
+        'createTime': (datetime(2022, 1, 1) + timedelta(seconds=index)).isoformat()
+    }
+
+
+# ---------------------------------------------------------------- 一致性檢查
+
+def check_conformance(store):
+    """所有引擎必須有相同的行為；回傳失敗項目清單"""
+    failures = []
+    prefix = f'conf_{uuid.uuid4().hex[:8]}'
+
+    def check(condition, message):
+        if not condition:
+            failures.append(message)
+
+    def mine(records):
+        return [r for r in records if str(r['id']).startswith(prefix)]
+
+    a = {'id': f'{prefix}_a', 'name': '甲', 'startDate': '2024-03-01', 'endDate': '2024-03-05',
+         'reason': 'r', 'type': '事假', 'createTime': '2024-02-01T09:00:00', 'note': 'extra'}
+    b = {'id': f'{prefix}_b', 'name': '乙', 'startDate': '2024-03-10', 'endDate': '2024-03-10',
+         'reason': 'r', 'type': '病假', 'createTime': '2024-02-02T09:00:00'}
+    c = {'id': f'{prefix}_c', 'name': '甲', 'startDate': '2024-04-01', 'endDate': '2024-04-02',
+         'reason': 'r', 'type': '特休', 'createTime': '2024-02-03T09:00:00'}
+
+    v0 = store.version()
+    v1 = store.upsert(a)
+    check(v1 != v0, 'upsert 後版本未改變')
+    check(store.version() == v1, 'upsert 回傳的版本與 version() 不一致')
+    got = store.get(a['id'])
+    check(got is not None and got.get('note') == 'extra', 'get 無法取回記錄或遺失額外欄位')
+    check(store.get(f'{prefix}_missing') is None, 'get 不存在的 ID 應回傳 None')
+
+    v2 = store.upsert_many([b, c])
+    check(v2 != v1, 'upsert_many 後版本未改變')
+    check(len(mine(store.load())) == 3, 'load 筆數不正確')
+
+    updated = dict(a, reason='updated')
+    store.upsert(updated)
+    check(len(mine(store.load())) == 3, '相同 ID 的 upsert 應取代而非新增')
+    check((store.get(a['id']) or {}).get('reason') == 'updated', 'upsert 未更新既有記錄')
+
+    # 區間重疊查詢
+    ids = {r['id'] for r in mine(store.query(date_from='2024-03-05', date_to='2024-03-10'))}
+    check(ids == {a['id'], b['id']}, f'區間重疊查詢結果錯誤: {sorted(ids)}')
+    ids = {r['id'] for r in mine(store.query(name='甲'))}
+    check(ids == {a['id'], c['id']}, 'name 篩選結果錯誤')
+    ids = {r['id'] for r in mine(store.query(leave_type='病假'))}
+    check(ids == {b['id']}, 'type 篩選結果錯誤')
+
+    # 同一員工的請假重疊檢查（首尾當天相接也算重疊）
+    ids = {r['id'] for r in mine(store.find_conflicts('甲', '2024-03-05', '2024-04-01'))}
+    check(ids == {a['id'], c['id']}, f'find_conflicts 結果錯誤: {sorted(ids)}')
+    check(not mine(store.find_conflicts('甲', '2024-03-01', '2024-03-05', exclude_id=a['id'])),
+          'find_conflicts 未排除指定的 ID')
+    v_before = store.version()
+    try:
+        store.upsert_checked(dict(b, id=f'{prefix}_d', startDate='2024-03-09', endDate='2024-03-11'))
+        check(False, 'upsert_checked 未拒絕重疊的記錄')
+    except ConflictError as e:
+        check([d['id'] for d in e.conflicts] == [b['id']], 'ConflictError 衝突內容錯誤')
+    check(store.get(f'{prefix}_d') is None and store.version() == v_before, '被拒絕的記錄不應寫入')
+    check(store.upsert_checked(dict(b, reason='checked')) != v_before, 'upsert_checked 應允許更新自己')
+    v_before = store.version()
+    try:
+        store.insert_checked(dict(b, reason='duplicate', startDate='2030-01-01', endDate='2030-01-01'))
+        check(False, 'insert_checked 未拒絕已存在的 ID')
+    except DuplicateIdError as e:
+        check(e.record_id == b['id'], 'DuplicateIdError 的 ID 錯誤')
+    check(store.get(b['id'])['reason'] == 'checked' and store.version() == v_before,
+          'insert_checked 不應取代既有記錄')
+    store.insert_checked(dict(b, id=f'{prefix}_e', startDate='2030-01-01', endDate='2030-01-01'))
+    check(store.get(f'{prefix}_e') is not None, 'insert_checked 未寫入新記錄')
+    store.delete([f'{prefix}_e'])
+
+    # 鍵集分頁：由新到舊、不重複、不遺漏
+    ordered = [r['id'] for r in mine(store.query(date_from='2024-03-01', date_to='2024-04-30'))]
+    check(ordered == [c['id'], b['id'], a['id']], f'排序應依 (createTime, id) 由新到舊: {ordered}')
+    first = mine(store.query(date_from='2024-03-01', date_to='2024-04-30', name='甲', limit=1))
+    rest = mine(store.query(date_from='2024-03-01', date_to='2024-04-30', name='甲',
+                            after=(first[0]['createTime'], str(first[0]['id'])) if first else None))
+    check([r['id'] for r in first + rest] == [c['id'], a['id']], '鍵集分頁結果錯誤')
+
+    # 差異同步
+    result = store.changes_since(v1)
+    check(result is not None, 'changes_since 對有效游標回傳 None')
+    if result:
+        cursor, changes, deleted = result
+        check(cursor == store.version(), 'changes_since 回傳的游標不是目前版本')
+        check({r['id'] for r in mine(changes)} == {a['id'], b['id'], c['id']}, 'changes_since 缺少變更')
+    check(store.changes_since('not-a-cursor') is None, '無法解析的游標應回傳 None')
+
+    v3 = store.version()
+    deleted = store.delete([b['id'], f'{prefix}_missing'])
+    check([str(i) for i in deleted] == [b['id']], f'delete 應只回傳實際刪除的 ID: {deleted}')
+    check(store.get(b['id']) is None, 'delete 後仍可取得記錄')
+    check(store.delete([f'{prefix}_missing']) == [], '刪除不存在的 ID 應回傳空清單')
+    result = store.changes_since(v3)
+    if result:
+        _, changes, deleted = result
+        check([str(i) for i in deleted] == [b['id']], 'changes_since 缺少刪除墓碑')
+        check(not mine(changes), '只有刪除時 changes 應為空')
+    else:
+        check(False, 'delete 後 changes_since 回傳 None')
+    result = store.changes_since(store.version())
+    check(result is not None and not result[1] and not result[2], '最新游標應回傳空差異')
+
+    store.delete([a['id'], c['id']])
+    check(not mine(store.load()), '清除測試記錄失敗')
+
+    # 墓碑清除後，早於清除點的游標必須改為整份重新載入，最新游標仍可使用
+    if store.purge_tombstones(retention_days=-1):
+        check(store.changes_since(v3) is None, '墓碑清除後舊游標應回傳 None')
+    result = store.changes_since(store.version())
+    check(result is not None and not result[1] and not result[2], '墓碑清除後最新游標應回傳空差異')
+    return failures
+
+
+# ---------------------------------------------------------------- 效能比較
+
+def timed(results, label, count, func):
+    start = time.perf_counter()
+    value = func()
+    elapsed = time.perf_counter() - start
+    results[label] = {
+        'ops': count,
+        'seconds': round(elapsed, 4),
+        'ops_per_sec': round(count / elapsed, 1) if elapsed > 0 else None
+    }
+    return value
+
+
+def run_benchmark(store, records, seed=42):
+    """相同工作負載：逐筆寫入、批次寫入、全量讀取、單筆讀取、月份範圍查詢、分頁、差異同步、刪除"""
+    rng = random.Random(seed)
+    results = {}
+    single = records[:max(1, len(records) // 10)]
+    bulk = records[len(single):]
+
+    def upsert_single():
+        for record in single:
+            store.upsert(record)
+
+    def upsert_bulk():
+        for i in range(0, len(bulk), 1000):
+            store.upsert_many(bulk[i:i + 1000])
+
+    timed(results, 'upsert', len(single), upsert_single)
+    timed(results, 'upsert_many', len(bulk), upsert_bulk)
+    cursor = store.version()
+    timed(results, 'load', 1, lambda: len(store.load()))
+
+    sample = [rng.choice(records)['id'] for _ in range(200)]
+    timed(results, 'get', len(sample), lambda: [store.get(record_id) for record_id in sample])
+
+    months = [(2022 + rng.randrange(3), 1 + rng.randrange(12)) for _ in range(50)]
+
+    def month_queries():
+        for year, month in months:
+            last = (date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)).day
+            list(store.query(date_from=f'{year}-{month:02d}-01', date_to=f'{year}-{month:02d}-{last}'))
+
+    timed(results, 'query_month', len(months), month_queries)
+
+    def paginate():
+        pages, after = 0, None
+        while True:
+            page = list(store.query(after=after, limit=500))
+            if not page:
+                return pages
+            pages += 1
+            after = (page[-1]['createTime'], str(page[-1]['id']))
+
+    timed(results, 'paginate_500', 1, paginate)
+
+    changed = [dict(record, reason='changed') for record in rng.sample(records, min(20, len(records)))]
+    for record in changed:
+        store.upsert(record)
+    timed(results, 'changes_since', 1, lambda: store.changes_since(cursor))
+
+    doomed = [record['id'] for record in records[:max(1, len(records) // 10)]]
+    timed(results, 'delete', len(doomed), lambda: [store.delete([record_id]) for record_id in doomed])
+    store.delete([record['id'] for record in records])
+    return results
+
+
+def open_store(engine, workdir, dsn=None):
+    if engine == 'json':
+        return create_store('json', path=os.path.join(workdir, 'data.json'))
+    if engine == 'sqlite':
+        store = create_store('sqlite', path=os.path.join(workdir, 'leave_records.db'))
+        store.init()
+        return store
+    if engine == 'postgresql':
+        store = create_store('postgresql', dsn=dsn)
+        store.init()
+        return store
+    return create_store(engine)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='儲存引擎一致性檢查與效能比較')
+    parser.add_argument('--engines', default='memory,json,sqlite',
+                        help=f"以逗號分隔（可用: {', '.join(STORAGE_ENGINES)}）")
+    parser.add_argument('--records', type=int, default=5000, help='合成記錄筆數')
+    parser.add_argument('--dsn', default=None, help='PostgreSQL 連線字串（測試 postgresql 時必填）')
+    parser.add_argument('--check-only', action='store_true', help='只做一致性檢查')
+    parser.add_argument('--output', default=None, help='將結果寫入 JSON 文件')
+    args = parser.parse_args(argv)
+
+    engines = [engine.strip() for engine in args.engines.split(',') if engine.strip()]
+    report = {'records': args.records, 'engines': {}}
+    ok = True
+    for engine in engines:
+        if engine == 'postgresql' and not args.dsn:
+            print('⚠️ 略過 postgresql：未指定 --dsn', file=sys.stderr)
+            continue
+        workdir = tempfile.mkdtemp(prefix=f'bench_{engine}_')
+        try:
+            store = open_store(engine, workdir, args.dsn)
+            failures = check_conformance(store)
+            entry = {'conformance': 'pass' if not failures else 'fail', 'failures': failures}
+            ok = ok and not failures
+            if not args.check_only:
+                rng = random.Random(7)
+                prefix = f'bench_{uuid.uuid4().hex[:8]}'
+                records = [make_record(prefix, i, rng) for i in range(args.records)]
+                entry['results'] = run_benchmark(store, records)
+            report['engines'][engine] = entry
+            status = '✅' if not failures else '❌'
+            print(f"{status} {engine}: 一致性檢查 {'通過' if not failures else '失敗'}", file=sys.stderr)
+            for failure in failures:
+                print(f"   - {failure}", file=sys.stderr)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    print(output)
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -11,21 +11,198 @@ import os
 import json
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from http.server import HTTPServer, SimpleHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
 import re
 
+from json_journal import JsonJournalStore, atomic_write_json
+from leave_compress import COMPRESS_MIN_SIZE, CompressedVariants, StaticAssets, choose_encoding, compress, weak_etag
+
 # 環境變數
 PORT = int(os.environ.get('PORT', 8080))
 HOST = os.environ.get('HOST', '0.0.0.0')
 
+# 連線處理設定（可用環境變數調整）
+CLOUD_MAX_WORKERS = int(os.environ.get('CLOUD_MAX_WORKERS', 128))                 # 同時處理的連線數
+CLOUD_MAX_PENDING = int(os.environ.get('CLOUD_MAX_PENDING', 512))                 # 處理中 + 等待中的連線上限，超過回應 503
+CLOUD_KEEPALIVE_TIMEOUT = float(os.environ.get('CLOUD_KEEPALIVE_TIMEOUT', 5))     # 閒置連線保留秒數（佔用一個處理執行緒）
+
+# 數據上限：單筆異動走 /api/records，整份保存 (/save) 才需要傳送全部記錄
+CLOUD_MAX_RECORDS = int(os.environ.get('CLOUD_MAX_RECORDS', 20000))
+CLOUD_MAX_SAVE_BYTES = int(os.environ.get('CLOUD_MAX_SAVE_BYTES', 16 * 1024 * 1024))
+CLOUD_MAX_RECORD_BYTES = 16 * 1024
+
+# 數據儲存：data.json 快照 + 追加式日誌（與 app_origin.py 相同的 JsonJournalStore）
+CLOUD_DATA_FILE = os.environ.get('CLOUD_DATA_FILE', 'data.json')
+
+# 伺服器端刪除墓碑（不提供給客戶端下載）
+CLOUD_TOMBSTONE_FILE = os.environ.get('CLOUD_TOMBSTONE_FILE', 'data.tombstones.json')
+CLOUD_TOMBSTONE_RETENTION_DAYS = float(os.environ.get('CLOUD_TOMBSTONE_RETENTION_DAYS', 30))
+
+# 記錄驗證
+REQUIRED_FIELDS = ['id', 'name', 'type', 'startDate', 'endDate', 'submitDate']
+INVALID_NAME_PATTERN = re.compile(r'[<>&"\'\\]')
+DATE_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+def strip_weak(etag):
+    """去除弱 ETag 的 W/ 前綴"""
+    return etag[2:] if etag.startswith('W/') else etag
+
+def validate_record(record, label='Record'):
+    """驗證單筆記錄；回傳錯誤訊息，通過時回傳 None"""
+    if not isinstance(record, dict):
+        return f'{label} is not an object'
+    
+    for field in REQUIRED_FIELDS:
+        if field not in record:
+            return f'{label} missing field: {field}'
+    
+    if not isinstance(record['name'], str) or not record['name'].strip():
+        return f'{label}: name must be non-empty string'
+    
+    name = record['name'].strip()
+    if len(name) > 50:
+        return f'{label}: name too long (max 50 chars)'
+    
+    if INVALID_NAME_PATTERN.search(name):
+        return f'{label}: name contains invalid characters'
+    
+    for date_field in ['startDate', 'endDate', 'submitDate']:
+        if not isinstance(record[date_field], str) or not DATE_PATTERN.match(record[date_field]):
+            return f'{label}: {date_field} invalid format'
+    return None
+
+# 寫入 data.json 的鎖：版本比對與替換文件之間不能有其他寫入
+write_lock = threading.Lock()
+
+class TombstoneSet:
+    """伺服器端的刪除墓碑 {記錄 ID: 刪除時間}：保存時過濾已刪除的記錄，舊資料不會讓記錄復活
+
+    呼叫者須持有 write_lock；超過保留期限的墓碑在下次寫入時清除
+    """
+    
+    def __init__(self, path=CLOUD_TOMBSTONE_FILE, retention_days=CLOUD_TOMBSTONE_RETENTION_DAYS):
+        self.path = path
+        self.retention_days = retention_days
+        self._deleted = None
+    
+    def _load(self):
+        if self._deleted is None:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self._deleted = json.load(f)
+            except FileNotFoundError:
+                self._deleted = {}
+            except ValueError as e:
+                print(f"⚠️ 刪除墓碑文件損壞，重新建立: {e}")
+                self._deleted = {}
+        return self._deleted
+    
+    def __contains__(self, record_id):
+        return str(record_id) in self._load()
+    
+    def add(self, record_ids):
+        """記錄刪除，同時清除過期的墓碑"""
+        now = int(time.time())
+        cutoff = now - self.retention_days * 86400
+        deleted = {record_id: deleted_at for record_id, deleted_at in self._load().items()
+                   if deleted_at >= cutoff}
+        for record_id in record_ids:
+            deleted[str(record_id)] = now
+        atomic_write_json(self.path, deleted)
+        self._deleted = deleted
+    
+    def filter(self, records):
+        """移除已刪除的記錄；回傳 (保留的記錄, 移除筆數)"""
+        deleted = self._load()
+        if not deleted:
+            return records, 0
+        kept = [record for record in records if str(record.get('id')) not in deleted]
+        return kept, len(records) - len(kept)
+
+tombstones = TombstoneSet()
+
+store = JsonJournalStore(CLOUD_DATA_FILE)
+
+def version_etag(version):
+    """數據版本轉為 ETag，同時作為 If-Match 比對的版本"""
+    return f'"{version}"'
+
+class DataSnapshot:
+    """/data.json 回應內容的快取：數據版本改變後才重新序列化一次，其他請求直接回傳快取"""
+    
+    def __init__(self, store):
+        self.store = store
+        self._entry = (None, None, None)  # (數據版本, ETag, 內容)
+        self._lock = threading.Lock()
+    
+    def get(self):
+        """回傳 (etag, 內容 bytes)"""
+        version = self.store.version()
+        entry = self._entry
+        if entry[0] == version:
+            return entry[1], entry[2]
+        with self._lock:
+            entry = self._entry
+            if entry[0] != version:
+                version, records = self.store.snapshot()
+                body = json.dumps(records, ensure_ascii=False).encode('utf-8')
+                entry = self._entry = (version, version_etag(version), body)
+            return entry[1], entry[2]
+
+data_cache = DataSnapshot(store)
+# data.json 各版本的壓縮結果；靜態文件啟動時預先壓縮
+data_variants = CompressedVariants()
+static_assets = StaticAssets('.')
+
+class PooledHTTPServer(HTTPServer):
+    """以固定大小的執行緒池處理連線：慢速的客戶端不會阻塞其他請求，執行緒數量也有上限"""
+    
+    request_queue_size = 128
+    
+    def __init__(self, server_address, handler_class,
+                 max_workers=CLOUD_MAX_WORKERS, max_pending=CLOUD_MAX_PENDING):
+        super().__init__(server_address, handler_class)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='cloud-worker')
+        self.slots = threading.BoundedSemaphore(max(max_pending, max_workers))
+    
+    def process_request(self, request, client_address):
+        """交給執行緒池處理；積壓過多時直接回應 503，不讓等待佇列無限增長"""
+        if not self.slots.acquire(blocking=False):
+            self.reject_request(request)
+            return
+        self.executor.submit(self.process_request_thread, request, client_address)
+    
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.slots.release()
+    
+    def reject_request(self, request):
+        try:
+            request.sendall(b'HTTP/1.1 503 Service Unavailable\r\n'
+                            b'Content-Length: 0\r\nRetry-After: 1\r\nConnection: close\r\n\r\n')
+        except OSError:
+            pass
+        self.shutdown_request(request)
+    
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False)
+
 class CloudLeaveSystemHandler(SimpleHTTPRequestHandler):
     """雲端版本的請假系統處理器"""
     
-    def __init__(self, *args, **kwargs):
-        self.data_file = 'data.json'
-        super().__init__(*args, **kwargs)
+    # HTTP/1.1：同一連線可連續送出多個請求（keep-alive），每個回應都必須有 Content-Length
+    protocol_version = 'HTTP/1.1'
+    # 閒置連線逾時後關閉，釋放執行緒池的名額
+    timeout = CLOUD_KEEPALIVE_TIMEOUT
     
     def do_GET(self):
         """處理 GET 請求"""
@@ -37,49 +214,139 @@ class CloudLeaveSystemHandler(SimpleHTTPRequestHandler):
         elif self.path.startswith('/data.json?'):
             self.serve_data()
             return
+        elif self.is_private_file(urlparse(self.path).path):
+            self.send_error(404, "Not Found")
+            return
         
-        # 設定安全標頭
-        self.add_security_headers()
+        asset = static_assets.get(urlparse(self.path).path.lstrip('/'))
+        if asset is not None:
+            self.serve_static_asset(asset)
+            return
+        
+        # 其他靜態文件：安全標頭在 end_headers 時加入（必須在狀態列之後送出）
+        self.static_request = True
         super().do_GET()
     
+    @staticmethod
+    def is_private_file(path):
+        """伺服器內部文件（刪除墓碑、數據日誌與文件鎖、寫入中的暫存檔）不提供下載"""
+        name = os.path.basename(path)
+        private = {os.path.basename(CLOUD_TOMBSTONE_FILE), os.path.basename(store.journal_path),
+                   os.path.basename(store.lock_path)}
+        return name in private or '.tmp.' in name
+    
+    def end_headers(self):
+        if getattr(self, 'static_request', False):
+            self.static_request = False
+            self.add_security_headers()
+        super().end_headers()
+    
     def do_POST(self):
         """處理 POST 請求"""
-        if self.path == '/save':
+        # /save_data 為前端 saveData() 使用的路徑
+        if self.path in ('/save', '/save_data'):
             self.handle_save_data()
+        elif self.path == '/api/records':
+            self.handle_record_change('POST')
         else:
             self.send_error(404, "Not Found")
     
+    def do_PUT(self):
+        """取代單筆記錄"""
+        self.handle_record_change('PUT')
+    
+    def do_PATCH(self):
+        """修改單筆記錄的部分欄位"""
+        self.handle_record_change('PATCH')
+    
+    def do_DELETE(self):
+        """刪除單筆記錄"""
+        self.handle_record_change('DELETE')
+    
     def do_OPTIONS(self):
         """處理 OPTIONS 請求（CORS 預檢）"""
         self.send_response(200)
+        self.send_header('Content-Length', '0')
         self.add_security_headers()
         self.end_headers()
     
     def serve_data(self):
-        """提供資料文件"""
+        """提供資料（支援 ETag / If-None-Match）；內容為快照加上日誌的目前數據"""
         try:
-            if os.path.exists(self.data_file):
-                with open(self.data_file, 'r', encoding='utf-8') as f:
-                    data = f.read()
+            # ETag 為數據版本，版本改變後才重新序列化；未改變時直接使用快取
+            etag, data = data_cache.get()
+            if self.etag_matches(etag):
+                self.send_not_modified(etag)
+                return
+            
+            # 同一版本只壓縮一次，之後的輪詢直接回傳快取的壓縮結果
+            encoding = choose_encoding(self.headers.get('Accept-Encoding'))
+            if etag and encoding and len(data) >= COMPRESS_MIN_SIZE:
+                data = data_variants.get(etag, encoding, data)
+                etag = weak_etag(etag)
             else:
-                data = '[]'
+                encoding = None
             
             self.send_response(200)
             self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.send_header('Vary', 'Accept-Encoding')
+            if encoding:
+                self.send_header('Content-Encoding', encoding)
+            if etag:
+                self.send_header('ETag', etag)
             self.add_security_headers()
             self.end_headers()
-            self.wfile.write(data.encode('utf-8'))
+            self.wfile.write(data)
             
         except Exception as e:
             print(f"❌ 讀取資料失敗: {e}")
             self.send_error(500, f"Read failed: {e}")
     
+    def etag_matches(self, etag, header='If-None-Match'):
+        """檢查 If-None-Match / If-Match 是否與目前的 ETag 相符
+
+        以弱比較進行：壓縮回應的 ETag 為 W/ 開頭，但代表同一個數據版本
+        """
+        value = self.headers.get(header)
+        if not value or etag is None:
+            return False
+        if value.strip() == '*':
+            return True
+        return strip_weak(etag) in [strip_weak(tag.strip()) for tag in value.split(',')]
+    
+    def serve_static_asset(self, asset):
+        """回傳預先壓縮的靜態文件（記憶體快取，支援 If-None-Match）"""
+        encoding, body, etag = asset.negotiate(self.headers.get('Accept-Encoding'))
+        if self.etag_matches(etag):
+            self.send_not_modified(etag)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', asset.content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Vary', 'Accept-Encoding')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('ETag', etag)
+        self.add_security_headers()
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def send_not_modified(self, etag):
+        """回應 304，不傳送內容"""
+        self.send_response(304)
+        self.send_header('ETag', etag)
+        self.send_header('Vary', 'Accept-Encoding')
+        self.add_security_headers()
+        self.end_headers()
+    
     def handle_save_data(self):
         """處理保存資料"""
         try:
             # 檢查內容長度
             content_length = int(self.headers.get('Content-Length', 0))
-            if content_length > 1024 * 1024:  # 1MB 限制
+            if content_length > CLOUD_MAX_SAVE_BYTES:
                 self.send_error(413, "Request too large")
                 return
             
@@ -94,16 +361,33 @@ class CloudLeaveSystemHandler(SimpleHTTPRequestHandler):
                 self.send_error(400, validation_result['error'])
                 return
             
-            # 保存資料
-            with open(self.data_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            # 保存資料：比對版本後只把有改變的記錄追加到日誌
+            with write_lock:
+                current_version, current = store.snapshot()
+                current_etag = version_etag(current_version)
+                if self.headers.get('If-Match') and not self.etag_matches(current_etag, 'If-Match'):
+                    # 客戶端的數據已過期：不覆蓋其他人的修改，由客戶端重新載入合併後再送出
+                    self.send_json(412, {
+                        'status': 'error',
+                        'message': 'Data has been modified by another user',
+                        'version': current_etag
+                    }, current_etag)
+                    print(f"[{datetime.now().strftime('%H:%M:%S')}] ⚠️ 版本不符，拒絕覆蓋 ({len(data)} 筆記錄)")
+                    return
+                if self.headers.get('If-Match'):
+                    # 版本相符：客戶端看過目前所有記錄，少掉的記錄就是它刪除的
+                    saved_ids = {str(record.get('id')) for record in data}
+                    removed = [record.get('id') for record in current if str(record.get('id')) not in saved_ids]
+                    if removed:
+                        tombstones.add(removed)
+                # 舊版本的客戶端可能仍帶著已刪除的記錄，在伺服器端過濾
+                data, filtered = tombstones.filter(data)
+                if filtered:
+                    print(f"[{datetime.now().strftime('%H:%M:%S')}] 🗑️ 已過濾 {filtered} 筆已刪除的記錄")
+                new_etag = version_etag(store.replace(data))
             
-            # 回應成功
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            self.add_security_headers()
-            self.end_headers()
-            self.wfile.write(b'{"status": "success"}')
+            # 回應成功（附上新版本，客戶端下次保存時以 If-Match 帶回）
+            self.send_json(200, {'status': 'success', 'version': new_etag}, new_etag)
             
             print(f"[{datetime.now().strftime('%H:%M:%S')}] 💾 資料已保存 ({len(data)} 筆記錄)")
             
@@ -114,12 +398,119 @@ class CloudLeaveSystemHandler(SimpleHTTPRequestHandler):
             except:
                 pass
     
+    def handle_record_change(self, method):
+        """單筆記錄的新增 / 取代 / 修改 / 刪除：只傳送與驗證一筆記錄，不必上傳整份數據"""
+        path = urlparse(self.path).path
+        record_id = None
+        if path.startswith('/api/records/'):
+            record_id = path[len('/api/records/'):]
+        elif path != '/api/records' or method != 'POST':
+            self.send_error(404, "Not Found")
+            return
+        if not record_id and method != 'POST':
+            self.send_error(404, "Not Found")
+            return
+        
+        try:
+            payload = None
+            if method != 'DELETE':
+                content_length = int(self.headers.get('Content-Length', 0))
+                if content_length > CLOUD_MAX_RECORD_BYTES:
+                    self.send_error(413, "Request too large")
+                    return
+                payload = json.loads(self.rfile.read(content_length).decode('utf-8'))
+                if not isinstance(payload, dict):
+                    self.send_error(400, "Record must be an object")
+                    return
+            
+            with write_lock:
+                # 以 ID 直接查詢（儲存以 ID 為鍵），寫入只追加一行日誌，不必掃描或重寫整份數據
+                current = store.get(record_id) if record_id is not None else None
+                if method == 'POST':
+                    record = dict(payload)
+                    if 'id' not in record:
+                        # 與前端相同的 Date.now() 格式；同一毫秒內的新增依序遞增
+                        record['id'] = int(time.time() * 1000)
+                        while store.get(record['id']) is not None:
+                            record['id'] += 1
+                    record_id = str(record['id'])
+                    if store.get(record_id) is not None:
+                        self.send_json(409, {'status': 'error', 'message': f'Record {record_id} already exists'})
+                        return
+                    if record_id in tombstones:
+                        self.send_json(409, {'status': 'error', 'message': f'Record {record_id} was deleted'})
+                        return
+                elif current is None:
+                    self.send_json(404, {'status': 'error', 'message': f'Record {record_id} not found'})
+                    return
+                elif method == 'PATCH':
+                    record = dict(current, **payload)
+                elif method == 'PUT':
+                    record = dict(payload)
+                
+                if method == 'DELETE':
+                    # 先寫入墓碑：其他客戶端帶著舊資料保存時也不會讓記錄復活
+                    tombstones.add([record_id])
+                    store.delete([record_id])
+                    new_version = store.version()
+                else:
+                    # ID 由網址決定，不可在修改時變更
+                    if method != 'POST':
+                        record['id'] = current['id']
+                    error = validate_record(record)
+                    if error:
+                        self.send_error(400, error)
+                        return
+                    if method == 'POST' and store.count() >= CLOUD_MAX_RECORDS:
+                        self.send_error(413, f'Too many records (max {CLOUD_MAX_RECORDS})')
+                        return
+                    new_version = store.upsert(record)
+                total = store.count()
+                new_etag = version_etag(new_version)
+            
+            response = {'status': 'success', 'id': record_id, 'version': new_etag}
+            if method != 'DELETE':
+                response['record'] = record
+            self.send_json(201 if method == 'POST' else 200, response, new_etag)
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] 💾 {method} 記錄 {record_id}（共 {total} 筆）")
+        
+        except ValueError as e:
+            self.send_error(400, f"Invalid JSON: {e}")
+        except Exception as e:
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] ❌ 記錄異動失敗: {e}")
+            try:
+                self.send_error(500, f"Save failed: {e}")
+            except:
+                pass
+    
+    def send_json(self, status, payload, etag=None):
+        """回應 JSON 內容"""
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        encoding = None
+        if len(body) >= COMPRESS_MIN_SIZE:
+            encoding = choose_encoding(self.headers.get('Accept-Encoding'))
+            if encoding:
+                body = compress(body, encoding)
+                etag = weak_etag(etag)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Vary', 'Accept-Encoding')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        if etag:
+            self.send_header('ETag', etag)
+        self.add_security_headers()
+        self.end_headers()
+        self.wfile.write(body)
+    
     def add_security_headers(self):
         """添加安全標頭"""
         # CORS 設定 - 雲端版本允許所有來源
         self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, PUT, PATCH, DELETE, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, If-None-Match, If-Match')
+        self.send_header('Access-Control-Expose-Headers', 'ETag')
         
         # 安全標頭
         self.send_header('X-Content-Type-Options', 'nosniff')
@@ -148,32 +539,13 @@ class CloudLeaveSystemHandler(SimpleHTTPRequestHandler):
             if not isinstance(data, list):
                 return {'valid': False, 'error': 'Data must be an array'}
             
-            if len(data) > 1000:
-                return {'valid': False, 'error': 'Too many records (max 1000)'}
+            if len(data) > CLOUD_MAX_RECORDS:
+                return {'valid': False, 'error': f'Too many records (max {CLOUD_MAX_RECORDS})'}
             
             for i, record in enumerate(data):
-                if not isinstance(record, dict):
-                    return {'valid': False, 'error': f'Record {i} is not an object'}
-                
-                required_fields = ['id', 'name', 'type', 'startDate', 'endDate', 'submitDate']
-                for field in required_fields:
-                    if field not in record:
-                        return {'valid': False, 'error': f'Record {i} missing field: {field}'}
-                
-                if not isinstance(record['name'], str) or not record['name'].strip():
-                    return {'valid': False, 'error': f'Record {i}: name must be non-empty string'}
-                
-                name = record['name'].strip()
-                if len(name) > 50:
-                    return {'valid': False, 'error': f'Record {i}: name too long (max 50 chars)'}
-                
-                if re.search(r'[<>&"\'\\]', name):
-                    return {'valid': False, 'error': f'Record {i}: name contains invalid characters'}
-                
-                date_pattern = r'^\d{4}-\d{2}-\d{2}$'
-                for date_field in ['startDate', 'endDate', 'submitDate']:
-                    if not re.match(date_pattern, record[date_field]):
-                        return {'valid': False, 'error': f'Record {i}: {date_field} invalid format'}
+                error = validate_record(record, f'Record {i}')
+                if error:
+                    return {'valid': False, 'error': error}
             
             return {'valid': True, 'error': None}
             
@@ -188,15 +560,19 @@ def run_server():
     print(f"⏰ 時間: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     print(f"🌍 這是雲端部署版本，支援外部存取")
     
+    httpd = None
     try:
-        httpd = HTTPServer((HOST, PORT), CloudLeaveSystemHandler)
-        print(f"✅ 伺服器已啟動")
+        httpd = PooledHTTPServer((HOST, PORT), CloudLeaveSystemHandler)
+        print(f"✅ 伺服器已啟動（{CLOUD_MAX_WORKERS} 個處理執行緒，支援 keep-alive）")
         print(f"🔧 按 Ctrl+C 停止伺服器")
         httpd.serve_forever()
     except KeyboardInterrupt:
         print(f"\n🛑 伺服器已停止")
     except Exception as e:
         print(f"❌ 伺服器啟動失敗: {e}")
+    finally:
+        if httpd is not None:
+            httpd.server_close()
 
 if __name__ == "__main__":
     run_server()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+請假管理系統 - 數據變更通知 (Leave Management System - Change Notifications)
+MIT License - LeaveSystem Project 2024
+
+每個 worker 以一條專用連線 LISTEN 數據變更頻道（本地文件模式則定期檢查
+文件狀態），讓多個 gunicorn worker 不必輪詢數據庫就能得知其他 worker
+寫入了新數據，並轉發給本 worker 的 SSE 訂閱者
+"""
+
+import os
+import json
+import queue
+import select
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 數據變更通知頻道（payload 為新的數據版本號）
+CHANGE_CHANNEL = 'leave_records_changed'
+
+
+class ChangeFeed:
+    """保存最新數據版本，並把變更事件轉發給所有訂閱者"""
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.version = None
+        self.connected = False
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    def current_version(self):
+        """已連線時回傳最新版本，否則回傳 None（呼叫者須自行查詢）"""
+        if self.connected:
+            return self.version
+        return None
+
+    def note_version(self, version):
+        """本程序寫入後立即更新版本，不必等待通知送達"""
+        with self._lock:
+            if self.version is None or version > self.version:
+                self.version = version
+
+    def subscribe(self, maxsize=100):
+        """訂閱變更事件，回傳接收事件的佇列"""
+        q = queue.Queue(maxsize=maxsize)
+        with self._lock:
+            self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def publish(self, event):
+        """將事件放入每個訂閱者的佇列；佇列已滿的慢速客戶端直接略過"""
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                pass
+
+
+class ChangeListener(ChangeFeed):
+    """在背景執行緒 LISTEN 指定頻道，保存最新的數據版本"""
+
+    def __init__(self, dsn, channel=CHANGE_CHANNEL, fetch_version=None,
+                 reconnect_delay=5, **connect_kwargs):
+        super().__init__()
+        self.dsn = dsn
+        self.channel = channel
+        self.fetch_version = fetch_version    # 連線後讀取目前版本的函式 (conn) -> int
+        self.reconnect_delay = reconnect_delay
+        self.connect_kwargs = connect_kwargs
+        self._thread = threading.Thread(target=self._run, name=f'listen-{channel}', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _handle_notify(self, payload):
+        """通知內容為 JSON（version / upserted / deleted），舊格式則只有版本號"""
+        try:
+            if payload.startswith('{'):
+                event = json.loads(payload)
+            else:
+                event = {'version': int(payload)}
+            version = int(event['version'])
+        except (ValueError, KeyError, TypeError):
+            logger.warning(f"⚠️ 無法解析變更通知: {payload}")
+            return
+        self.note_version(version)
+        self.publish(event)
+
+    def _run(self):
+        while not self._stop.is_set():
+            conn = None
+            try:
+                import psycopg2
+                conn = psycopg2.connect(self.dsn, **self.connect_kwargs)
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f'LISTEN {self.channel}')
+                # 先 LISTEN 再讀版本，避免兩者之間的變更被漏掉
+                if self.fetch_version:
+                    previous = self.version
+                    version = self.fetch_version(conn)
+                    self.note_version(version)
+                    if previous is not None and version > previous:
+                        # 斷線期間錯過的變更：通知訂閱者重新同步
+                        self.publish({'version': version})
+                self.connected = True
+                logger.info(f"👂 開始監聽數據變更通知: {self.channel}")
+
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 30) == ([], [], []):
+                        # 閒置時送出查詢確認連線仍存活
+                        with conn.cursor() as cur:
+                            cur.execute('SELECT 1')
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self._handle_notify(conn.notifies.pop(0).payload)
+            except Exception as e:
+                logger.error(f"❌ 變更通知連線中斷: {e}")
+            finally:
+                self.connected = False
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            self._stop.wait(self.reconnect_delay)
+
+
+class FileWatcher(ChangeFeed):
+    """本地文件模式：定期讀取數據版本，版本改變時發布變更事件"""
+
+    def __init__(self, fetch_version, interval=2):
+        super().__init__()
+        self.fetch_version = fetch_version    # 讀取目前版本的函式 () -> 版本或 None
+        self.interval = interval
+        self.connected = True
+        self._thread = threading.Thread(target=self._run, name='watch-data-file', daemon=True)
+
+    def start(self):
+        self.version = self.fetch_version()
+        self._thread.start()
+        return self
+
+    def note_version(self, version):
+        # 文件版本不是遞增數字，直接取代
+        with self._lock:
+            self.version = version
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                version = self.fetch_version()
+            except Exception as e:
+                logger.error(f"❌ 讀取數據版本失敗: {e}")
+                continue
+            if version != self.version:
+                self.note_version(version)
+                self.publish({'version': version})
+
+
+_feeds = {}
+_feeds_lock = threading.Lock()
+
+
+def _get_feed(key, factory):
+    """取得（必要時啟動）本程序的變更來源；fork 後在子程序重新啟動"""
+    feed = _feeds.get(key)
+    if feed is not None and feed.pid == os.getpid():
+        return feed
+    with _feeds_lock:
+        feed = _feeds.get(key)
+        if feed is None or feed.pid != os.getpid():
+            feed = factory().start()
+            _feeds[key] = feed
+        return feed
+
+
+def get_listener(dsn, channel=CHANGE_CHANNEL, **kwargs):
+    """本程序的 PostgreSQL 監聽器"""
+    return _get_feed(('listen', channel), lambda: ChangeListener(dsn, channel, **kwargs))
+
+
+def get_file_watcher(path, fetch_version, interval=2):
+    """本程序的本地文件監看器"""
+    return _get_feed(('watch', path), lambda: FileWatcher(fetch_version, interval))
+
+
+def _reset_after_fork():
+    """背景執行緒不會跟著 fork，子程序需重新建立監聽"""
+    global _feeds_lock
+    _feeds.clear()
+    _feeds_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
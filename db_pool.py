@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+請假管理系統 - PostgreSQL 連接池 (Leave Management System - Database Connection Pool)
+MIT License - LeaveSystem Project 2024
+
+讓每個 gunicorn worker 重複使用少量長連線，避免每個請求都重新做 TLS 握手
+"""
+
+import os
+import time
+import threading
+import logging
+from collections import deque
+
+from leave_metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 連接池設定（可用環境變數調整）
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', 1))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', 5))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))          # 等待可用連接的秒數
+DB_POOL_RECYCLE = float(os.environ.get('DB_POOL_RECYCLE', 1800))        # 連接最長存活秒數
+DB_POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', 30))    # 閒置超過此秒數先 ping 再借出
+
+
+class PoolTimeout(Exception):
+    """等待可用連接逾時"""
+
+
+class ConnectionPool:
+    """執行緒安全、有上限的 PostgreSQL 連接池"""
+
+    def __init__(self, dsn, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX,
+                 timeout=DB_POOL_TIMEOUT, recycle=DB_POOL_RECYCLE,
+                 ping_after=DB_POOL_PING_AFTER, **connect_kwargs):
+        self.dsn = dsn
+        self.minconn = max(0, minconn)
+        self.maxconn = max(1, maxconn)
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_after = ping_after
+        self.connect_kwargs = connect_kwargs
+        self.pid = os.getpid()
+
+        self._cond = threading.Condition()
+        self._idle = deque()     # (conn, created_at, last_used)
+        self._created = {}       # id(conn) -> created_at
+        self._size = 0           # 已建立（含借出中）的連接數
+        self._closed = False
+
+        for _ in range(min(self.minconn, self.maxconn)):
+            try:
+                conn = self._connect()
+            except Exception as e:
+                logger.warning(f"⚠️ 預先建立數據庫連接失敗: {e}")
+                break
+            with self._cond:
+                self._size += 1
+                self._idle.append((conn, self._created[id(conn)], time.monotonic()))
+
+    def _connect(self):
+        import psycopg2
+        started = time.perf_counter()
+        conn = psycopg2.connect(self.dsn, **self.connect_kwargs)
+        metrics.observe('leave_db_connect_seconds', time.perf_counter() - started, (('engine', 'postgresql'),))
+        self._created[id(conn)] = time.monotonic()
+        return conn
+
+    def _discard(self, conn):
+        """關閉連接並釋出名額（呼叫者須持有 _cond）"""
+        self._created.pop(id(conn), None)
+        self._size -= 1
+        self._cond.notify()
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_usable(self, conn, created_at, last_used):
+        """檢查閒置連接是否仍可用（過期或斷線則回傳 False）"""
+        now = time.monotonic()
+        if conn.closed:
+            return False
+        if self.recycle and now - created_at > self.recycle:
+            return False
+        if self.ping_after is not None and now - last_used > self.ping_after:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute('SELECT 1')
+                conn.rollback()
+            except Exception:
+                return False
+        return True
+
+    def getconn(self):
+        """借出一個連接，池滿時最多等待 timeout 秒"""
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise PoolTimeout("連接池已關閉")
+                    if self._idle:
+                        item = self._idle.pop()
+                        break
+                    if self._size < self.maxconn:
+                        self._size += 1
+                        item = None
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout(f"等待數據庫連接逾時（{self.timeout} 秒）")
+                    self._cond.wait(remaining)
+
+            if item is None:
+                break
+
+            # 健康檢查在鎖外進行，避免 ping 期間阻塞其他執行緒
+            conn, created_at, last_used = item
+            if self._is_usable(conn, created_at, last_used):
+                return conn
+            logger.info("♻️ 回收過期或失效的數據庫連接")
+            with self._cond:
+                self._discard(conn)
+
+        # 在鎖外建立新連接，避免 TLS 握手期間阻塞其他執行緒
+        try:
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def putconn(self, conn, discard=False):
+        """歸還連接；出錯的連接以 discard=True 直接丟棄"""
+        if os.getpid() != self.pid:
+            # fork 之後不屬於本程序的連接，不可關閉也不可重用
+            return
+        if not discard and not conn.closed:
+            try:
+                # 確保不會把進行中的交易借給下一個請求
+                conn.rollback()
+            except Exception:
+                discard = True
+        with self._cond:
+            if discard or conn.closed or self._closed:
+                self._discard(conn)
+                return
+            created_at = self._created.get(id(conn), time.monotonic())
+            self._idle.append((conn, created_at, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self):
+        """關閉所有閒置連接，之後不再借出"""
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _, _ = self._idle.pop()
+                self._discard(conn)
+
+    def stats(self):
+        """連接池狀態（供 /health 使用）"""
+        with self._cond:
+            return {
+                'size': self._size,
+                'idle': len(self._idle),
+                'max': self.maxconn
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(dsn, **connect_kwargs):
+    """取得本程序的連接池；fork 後（gunicorn --preload）會在子程序重新建立"""
+    global _pool
+    pool = _pool
+    if pool is not None and pool.pid == os.getpid():
+        return pool
+    with _pool_lock:
+        if _pool is None or _pool.pid != os.getpid():
+            _pool = ConnectionPool(dsn, **connect_kwargs)
+            logger.info(f"🔌 已建立數據庫連接池 (pid={_pool.pid}, max={_pool.maxconn})")
+        return _pool
+
+
+def _reset_after_fork():
+    """子程序不可沿用父程序的 socket，直接丟棄舊連接池（不呼叫 close）"""
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
@@ -0,0 +1,528 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+請假管理系統 - PostgreSQL 儲存 (Leave Management System - PostgreSQL Storage)
+MIT License - LeaveSystem Project 2024
+
+多 worker / 多實例共享的正式儲存：連線取自連接池，每次寫入遞增數據版本並
+以 NOTIFY 通知其他 worker
+"""
+
+import os
+import json
+import threading
+import logging
+from contextlib import contextmanager
+
+from db_pool import get_pool
+from db_notify import CHANGE_CHANNEL, get_listener
+from leave_store import TOMBSTONE_RETENTION_DAYS, ConflictError, DuplicateIdError, LeaveStore, batch_overlaps
+from leave_stats import format_group
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_PAYLOAD_LIMIT = 7000                                              # PostgreSQL NOTIFY 上限約 8000 bytes
+STREAM_BATCH_SIZE = int(os.environ.get('STREAM_BATCH_SIZE', 500))        # 具名游標每次讀取筆數
+BULK_PAGE_SIZE = int(os.environ.get('BULK_PAGE_SIZE', 1000))              # 批次寫入每個 INSERT 的筆數
+
+# 有獨立欄位的前端欄位，其餘欄位存入 data (JSONB)
+RECORD_COLUMNS = ['id', 'name', 'startDate', 'endDate', 'reason', 'type', 'createTime']
+
+SCHEMA = [
+    # 請假記錄表
+    '''
+    CREATE TABLE IF NOT EXISTS leave_records (
+        id VARCHAR(50) PRIMARY KEY,
+        name VARCHAR(100) NOT NULL,
+        start_date DATE NOT NULL,
+        end_date DATE NOT NULL,
+        reason TEXT NOT NULL,
+        type VARCHAR(50) NOT NULL,
+        create_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        data JSONB
+    )
+    ''',
+    # 索引提升查詢效能
+    '''
+    CREATE INDEX IF NOT EXISTS idx_leave_records_date
+    ON leave_records(start_date, end_date)
+    ''',
+    # 查詢近期範圍時 end_date >= 起始日 的條件選擇性較高
+    '''
+    CREATE INDEX IF NOT EXISTS idx_leave_records_end_date
+    ON leave_records(end_date)
+    ''',
+    # 鍵集分頁依 (create_time, id) 由新到舊讀取
+    '''
+    CREATE INDEX IF NOT EXISTS idx_leave_records_create_time
+    ON leave_records(create_time DESC, id DESC)
+    ''',
+    # 數據版本計數器：每次寫入遞增，供各 worker 判斷快取是否過期
+    '''
+    CREATE TABLE IF NOT EXISTS leave_data_version (
+        id INTEGER PRIMARY KEY,
+        version BIGINT NOT NULL DEFAULT 0
+    )
+    ''',
+    '''
+    INSERT INTO leave_data_version (id, version)
+    VALUES (1, 0)
+    ON CONFLICT (id) DO NOTHING
+    ''',
+    # 變更序號：記錄最後一次寫入時的數據版本，供差異同步使用
+    '''
+    ALTER TABLE leave_records
+    ADD COLUMN IF NOT EXISTS change_seq BIGINT NOT NULL DEFAULT 0
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS idx_leave_records_change_seq
+    ON leave_records(change_seq)
+    ''',
+    # 刪除墓碑：讓差異同步的客戶端得知哪些記錄已被刪除
+    '''
+    CREATE TABLE IF NOT EXISTS leave_deletions (
+        id VARCHAR(50) PRIMARY KEY,
+        change_seq BIGINT NOT NULL,
+        deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS idx_leave_deletions_change_seq
+    ON leave_deletions(change_seq)
+    ''',
+    # 已清除墓碑的最大變更序號：早於它的游標無法取得完整的刪除清單
+    '''
+    CREATE TABLE IF NOT EXISTS leave_tombstone_floor (
+        id INTEGER PRIMARY KEY,
+        change_seq BIGINT NOT NULL DEFAULT 0
+    )
+    ''',
+    '''
+    INSERT INTO leave_tombstone_floor (id, change_seq) VALUES (1, 0)
+    ON CONFLICT (id) DO NOTHING
+    ''',
+    # 同一員工的區間索引：檢查請假重疊
+    '''
+    CREATE INDEX IF NOT EXISTS idx_leave_records_name_dates
+    ON leave_records(name, start_date, end_date)
+    ''',
+]
+
+# 排除約束：數據庫層保證同一員工的請假區間不重疊（daterange GiST 索引）
+OVERLAP_CONSTRAINT = [
+    'CREATE EXTENSION IF NOT EXISTS btree_gist',
+    '''
+    DO $$
+    BEGIN
+        IF NOT EXISTS (
+            SELECT 1 FROM pg_constraint WHERE conname = 'leave_records_no_overlap'
+        ) THEN
+            ALTER TABLE leave_records ADD CONSTRAINT leave_records_no_overlap
+            EXCLUDE USING gist (name WITH =, daterange(start_date, end_date, '[]') WITH &&);
+        END IF;
+    END
+    $$
+    ''',
+]
+
+SELECT_COLUMNS = '''
+    SELECT id, name, start_date, end_date, reason, type,
+           create_time, data
+    FROM leave_records
+'''
+
+
+def row_to_record(row):
+    """將數據庫記錄轉換為前端格式"""
+    record = {
+        'id': row['id'],
+        'name': row['name'],
+        'startDate': row['start_date'].strftime('%Y-%m-%d'),
+        'endDate': row['end_date'].strftime('%Y-%m-%d'),
+        'reason': row['reason'],
+        'type': row['type'],
+        'createTime': row['create_time'].isoformat() if row['create_time'] else None
+    }
+    # 合併額外數據
+    if row['data']:
+        record.update(row['data'])
+    return record
+
+
+def fetch_db_version(conn):
+    """讀取數據庫中的數據版本"""
+    with conn.cursor() as cur:
+        cur.execute('SELECT version FROM leave_data_version WHERE id = 1')
+        row = cur.fetchone()
+    return row[0] if row else 0
+
+
+def bump_data_version(cur, upserted=(), deleted=()):
+    """在寫入交易中遞增數據版本，並在提交時通知其他 worker（附上異動的記錄 ID）"""
+    cur.execute('''
+        UPDATE leave_data_version SET version = version + 1
+        WHERE id = 1
+        RETURNING version
+    ''')
+    version = cur.fetchone()[0]
+    payload = json.dumps({'version': version, 'upserted': list(upserted), 'deleted': list(deleted)})
+    if len(payload) > NOTIFY_PAYLOAD_LIMIT:
+        # NOTIFY 內容有長度上限，大量異動時只通知版本，由客戶端差異同步取得明細
+        payload = json.dumps({'version': version})
+    cur.execute('SELECT pg_notify(%s, %s)', (CHANGE_CHANNEL, payload))
+    return version
+
+
+def build_record_query(date_from=None, date_to=None, name=None, leave_type=None,
+                       after=None, limit=None):
+    """組合篩選與分頁條件，依 (create_time, id) 由新到舊排序；回傳 (sql, params)"""
+    conditions = []
+    params = []
+    # 區間重疊：開始日不晚於範圍結束、結束日不早於範圍開始
+    if date_to:
+        conditions.append('start_date <= %s')
+        params.append(date_to)
+    if date_from:
+        conditions.append('end_date >= %s')
+        params.append(date_from)
+    if name:
+        conditions.append('name = %s')
+        params.append(name)
+    if leave_type:
+        conditions.append('type = %s')
+        params.append(leave_type)
+    if after:
+        # 鍵集分頁：從上一頁最後一筆之後繼續，不需 OFFSET 掃過前面的資料
+        conditions.append('(create_time, id) < (%s, %s)')
+        params.extend(after)
+    where = ('WHERE ' + ' AND '.join(conditions)) if conditions else ''
+
+    sql = f'''
+        {SELECT_COLUMNS}
+        {where}
+        ORDER BY create_time DESC, id DESC
+    '''
+    if limit:
+        sql += ' LIMIT %s'
+        params.append(limit)
+    return sql, params
+
+
+class PostgresStore(LeaveStore):
+    """PostgreSQL 儲存；版本號由 leave_data_version 遞增，LISTEN 監聽器負責即時通知"""
+
+    name = 'postgresql'
+
+    def __init__(self, dsn, stream_batch_size=STREAM_BATCH_SIZE, **connect_kwargs):
+        self.dsn = dsn
+        self.stream_batch_size = stream_batch_size
+        self.connect_kwargs = connect_kwargs
+
+    def pool(self):
+        return get_pool(self.dsn, **self.connect_kwargs)
+
+    @contextmanager
+    def connection(self):
+        """借出連線，區塊結束時歸還（包含產生器提前關閉）；連線已中斷時丟棄"""
+        pool = self.pool()
+        conn = pool.getconn()
+        try:
+            yield conn
+        finally:
+            pool.putconn(conn, discard=conn.closed != 0)
+
+    def listener(self):
+        """本 worker 的數據變更監聽器"""
+        return get_listener(self.dsn, fetch_version=fetch_db_version, **self.connect_kwargs)
+
+    def change_feed(self, interval=2):
+        return self.listener()
+
+    def init(self):
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                for statement in SCHEMA:
+                    cur.execute(statement)
+            conn.commit()
+            try:
+                with conn.cursor() as cur:
+                    for statement in OVERLAP_CONSTRAINT:
+                        cur.execute(statement)
+                conn.commit()
+            except Exception as e:
+                # 既有數據已有重疊或沒有建立擴充的權限：仍由寫入交易內的檢查把關
+                conn.rollback()
+                logger.warning(f"⚠️ 無法建立請假重疊排除約束: {e}")
+        logger.info("✅ 數據庫表初始化完成")
+
+    # ------------------------------------------------------------------ 讀取
+
+    def version(self):
+        # 一律讀取數據庫：其他 worker 剛寫入時通知可能尚未送達，監聽器的版本會落後
+        with self.connection() as conn:
+            return fetch_db_version(conn)
+
+    def load(self):
+        return list(self.query())
+
+    def snapshot(self):
+        import psycopg2.extras
+        with self.connection() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                # 版本與記錄在同一個 REPEATABLE READ 交易內讀取，看到的是同一個快照
+                cur.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY')
+                version = fetch_db_version(conn)
+                sql, params = build_record_query()
+                cur.execute(sql, params)
+                records = [row_to_record(row) for row in cur.fetchall()]
+        return version, records
+
+    def get(self, record_id):
+        import psycopg2.extras
+        with self.connection() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                cur.execute(f'{SELECT_COLUMNS} WHERE id = %s', (str(record_id),))
+                row = cur.fetchone()
+        return row_to_record(row) if row else None
+
+    def query(self, date_from=None, date_to=None, name=None, leave_type=None,
+              after=None, limit=None, server_side=False):
+        import psycopg2.extras
+        with self.connection() as conn:
+            sql, params = build_record_query(date_from, date_to, name, leave_type, after, limit)
+            if server_side:
+                # 具名（伺服器端）游標：每次只取 itersize 筆，記憶體用量與總筆數無關
+                cur = conn.cursor(name=f'leave_records_{threading.get_ident()}',
+                                  cursor_factory=psycopg2.extras.RealDictCursor)
+                cur.itersize = self.stream_batch_size
+            else:
+                cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            with cur:
+                cur.execute(sql, params)
+                for row in cur:
+                    yield row_to_record(row)
+
+    def changes_since(self, cursor):
+        try:
+            since = int(cursor)
+        except (TypeError, ValueError):
+            return None
+
+        import psycopg2.extras
+        with self.connection() as conn:
+            # 先讀取游標並以它為上限，確保回應內容與游標一致
+            current = fetch_db_version(conn)
+            if since > current:
+                return None
+            if since == current:
+                return current, [], []
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                cur.execute('SELECT change_seq FROM leave_tombstone_floor WHERE id = 1')
+                if since < cur.fetchone()['change_seq']:
+                    return None
+                cur.execute(f'''
+                    {SELECT_COLUMNS}
+                    WHERE change_seq > %s AND change_seq <= %s
+                    ORDER BY change_seq
+                ''', (since, current))
+                changes = [row_to_record(row) for row in cur.fetchall()]
+                cur.execute('''
+                    SELECT id FROM leave_deletions
+                    WHERE change_seq > %s AND change_seq <= %s
+                ''', (since, current))
+                deleted = [row['id'] for row in cur.fetchall()]
+        return current, changes, deleted
+
+    def aggregate_stats(self):
+        """以 GROUP BY 計算統計，不必把記錄傳回應用程式"""
+        days = 'SUM(end_date - start_date + 1)'
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f'SELECT COUNT(*), {days} FROM leave_records')
+                total_records, total_days = cur.fetchone()
+                result = {'total_records': total_records, 'total_days': int(total_days or 0)}
+                for group, key in (('by_type', 'type'), ('by_employee', 'name'),
+                                   ('by_month', "to_char(start_date, 'YYYY-MM')")):
+                    cur.execute(f'SELECT {key}, COUNT(*), {days} FROM leave_records GROUP BY {key}')
+                    result[group] = format_group(cur.fetchall())
+        return result
+
+    @staticmethod
+    def _conflicts(conn, name, start_date, end_date, exclude_id=None):
+        import psycopg2.extras
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+            cur.execute(f'''
+                {SELECT_COLUMNS}
+                WHERE name = %s AND start_date <= %s AND end_date >= %s AND id <> %s
+                ORDER BY start_date
+            ''', (name, end_date, start_date, '' if exclude_id is None else str(exclude_id)))
+            return [row_to_record(row) for row in cur.fetchall()]
+
+    def find_conflicts(self, name, start_date, end_date, exclude_id=None):
+        with self.connection() as conn:
+            return self._conflicts(conn, name, start_date, end_date, exclude_id)
+
+    # ------------------------------------------------------------------ 寫入
+
+    def upsert_many(self, records):
+        """有排除約束時，與既有記錄或同批次記錄重疊會拋出 ConflictError，整批不寫入"""
+        return self._upsert(records)
+
+    def upsert_checked(self, record):
+        """遞增版本時已鎖定版本列，檢查與寫入之間不會有其他寫入；排除約束再做最後把關"""
+        return self._upsert([record], check_conflicts=True)
+
+    def insert_checked(self, record):
+        return self._upsert([record], check_conflicts=True, insert_only=True)
+
+    @staticmethod
+    def _existing_conflicts(conn, records):
+        """一次查詢比對整個批次：{記錄 ID: [重疊的既有記錄]}；同一批次中的 ID 會被取代，不列入"""
+        import psycopg2.extras
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+            cur.execute('''
+                SELECT b.id AS batch_id, r.id, r.name, r.start_date, r.end_date, r.reason, r.type,
+                       r.create_time, r.data
+                FROM unnest(%s::text[], %s::text[], %s::date[], %s::date[])
+                     AS b(id, name, start_date, end_date)
+                JOIN leave_records r
+                  ON r.name = b.name AND r.start_date <= b.end_date AND r.end_date >= b.start_date
+                WHERE r.id <> ALL(%s::text[])
+                ORDER BY r.start_date
+            ''', ([str(record['id']) for record in records],
+                  [record['name'] for record in records],
+                  [record['startDate'] for record in records],
+                  [record['endDate'] for record in records],
+                  [str(record['id']) for record in records]))
+            found = {}
+            for row in cur.fetchall():
+                found.setdefault(row['batch_id'], []).append(row_to_record(row))
+            return found
+
+    def find_batch_conflicts(self, records):
+        if not records:
+            return {}
+        with self.connection() as conn:
+            return self._existing_conflicts(conn, records)
+
+    def _batch_conflicts(self, conn, records):
+        """排除約束拒絕寫入時，找出與批次中記錄重疊的既有記錄及批次內彼此重疊的記錄"""
+        conflicts = {}
+        for existing in self._existing_conflicts(conn, records).values():
+            for record in existing:
+                conflicts[str(record['id'])] = record
+        for record, other in batch_overlaps(records):
+            conflicts[str(record['id'])] = record
+            conflicts[str(other['id'])] = other
+        return list(conflicts.values())
+
+    def _upsert(self, records, check_conflicts=False, insert_only=False):
+        import psycopg2.errors
+        import psycopg2.extras
+        # 同一批次中重複的 ID 只保留最後一筆（ON CONFLICT 不能在同一語句中更新同一列兩次）
+        records = list({str(record['id']): record for record in records}.values())
+        record_ids = [str(record['id']) for record in records]
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                # 先遞增版本（取得版本列的鎖），確保變更序號與提交順序一致
+                version = bump_data_version(cur, upserted=record_ids)
+                if insert_only:
+                    cur.execute('SELECT id FROM leave_records WHERE id = ANY(%s) LIMIT 1', (record_ids,))
+                    row = cur.fetchone()
+                    if row:
+                        conn.rollback()
+                        raise DuplicateIdError(row[0])
+                if check_conflicts:
+                    for record in records:
+                        conflicts = self._conflicts(conn, record['name'], record['startDate'],
+                                                    record['endDate'], record.get('id'))
+                        if conflicts:
+                            conn.rollback()
+                            raise ConflictError(conflicts)
+                rows = []
+                for record in records:
+                    # 準備額外數據
+                    extra_data = {k: v for k, v in record.items() if k not in RECORD_COLUMNS}
+                    rows.append((
+                        str(record['id']),
+                        record['name'],
+                        record['startDate'],
+                        record['endDate'],
+                        record['reason'],
+                        record['type'],
+                        record.get('createTime'),
+                        json.dumps(extra_data) if extra_data else None,
+                        version
+                    ))
+                # 多列 VALUES：每 BULK_PAGE_SIZE 筆一次往返，而不是每筆一次
+                try:
+                    psycopg2.extras.execute_values(cur, '''
+                        INSERT INTO leave_records
+                        (id, name, start_date, end_date, reason, type, create_time, data, change_seq)
+                        VALUES %s
+                        ON CONFLICT (id) DO UPDATE SET
+                        name = EXCLUDED.name,
+                        start_date = EXCLUDED.start_date,
+                        end_date = EXCLUDED.end_date,
+                        reason = EXCLUDED.reason,
+                        type = EXCLUDED.type,
+                        data = EXCLUDED.data,
+                        change_seq = EXCLUDED.change_seq
+                    ''', rows, page_size=BULK_PAGE_SIZE,
+                       template='(%s, %s, %s, %s, %s, %s, COALESCE(%s::timestamp, CURRENT_TIMESTAMP), %s, %s)')
+                except psycopg2.errors.ExclusionViolation:
+                    # 任何寫入路徑（單筆、批次、修改）都與其他引擎一樣回報衝突，而不是 500
+                    conn.rollback()
+                    raise ConflictError(self._batch_conflicts(conn, records))
+                # 同一 ID 重新寫入時移除舊的刪除墓碑
+                cur.execute('DELETE FROM leave_deletions WHERE id = ANY(%s)', (record_ids,))
+            conn.commit()
+        self.listener().note_version(version)
+        return version
+
+    def purge_tombstones(self, retention_days=TOMBSTONE_RETENTION_DAYS):
+        """清除超過保留期限的墓碑，並提高游標下限"""
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('''
+                    SELECT MAX(change_seq) FROM leave_deletions
+                    WHERE deleted_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 day'
+                ''', (retention_days,))
+                newest = cur.fetchone()[0]
+                if newest is None:
+                    conn.rollback()
+                    return 0
+                cur.execute('DELETE FROM leave_deletions WHERE change_seq <= %s', (newest,))
+                purged = cur.rowcount
+                cur.execute('''
+                    UPDATE leave_tombstone_floor SET change_seq = GREATEST(change_seq, %s)
+                    WHERE id = 1
+                ''', (newest,))
+            conn.commit()
+        logger.info(f"🧹 已清除 {purged} 筆過期的刪除墓碑")
+        return purged
+
+    def delete(self, record_ids):
+        record_ids = [str(record_id) for record_id in record_ids]
+        if not record_ids:
+            return []
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                # 先鎖定版本列，與其他寫入序列化
+                cur.execute('SELECT version FROM leave_data_version WHERE id = 1 FOR UPDATE')
+                cur.execute('DELETE FROM leave_records WHERE id = ANY(%s) RETURNING id', (record_ids,))
+                deleted = [row[0] for row in cur.fetchall()]
+                if not deleted:
+                    conn.rollback()
+                    return []
+                version = bump_data_version(cur, deleted=deleted)
+                cur.execute('''
+                    INSERT INTO leave_deletions (id, change_seq)
+                    SELECT unnest(%s::varchar[]), %s
+                    ON CONFLICT (id) DO UPDATE SET
+                    change_seq = EXCLUDED.change_seq,
+                    deleted_at = CURRENT_TIMESTAMP
+                ''', (deleted, version))
+            conn.commit()
+        self.listener().note_version(version)
+        return deleted
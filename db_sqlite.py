@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+請假管理系統 - SQLite 儲存 (Leave Management System - SQLite Storage)
+MIT License - LeaveSystem Project 2024
+
+單機部署用的嵌入式數據庫：與 PostgreSQL 相同的 leave_records 表結構與索引，
+WAL 模式讓多個 worker 同時讀取、寫入時互不阻塞，不需另外運行數據庫服務
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+
+from leave_store import TOMBSTONE_RETENTION_DAYS, ConflictError, DuplicateIdError, LeaveStore
+from leave_stats import format_group
+from leave_metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# SQLite 設定（可用環境變數調整）
+SQLITE_PATH = os.environ.get('SQLITE_PATH', 'leave_records.db')
+SQLITE_BUSY_TIMEOUT = float(os.environ.get('SQLITE_BUSY_TIMEOUT', 10))     # 等待寫入鎖的秒數
+SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'FULL')          # FULL：每次提交都 fsync
+# 單一語句最多的參數數量（SQLite 3.32 之前的上限為 999）
+SQLITE_MAX_PARAMS = 999
+
+# 有獨立欄位的前端欄位，其餘欄位存入 data (JSON)
+RECORD_COLUMNS = ['id', 'name', 'startDate', 'endDate', 'reason', 'type', 'createTime']
+
+SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS leave_records (
+        id VARCHAR(50) PRIMARY KEY,
+        name VARCHAR(100) NOT NULL,
+        start_date DATE NOT NULL,
+        end_date DATE NOT NULL,
+        reason TEXT NOT NULL,
+        type VARCHAR(50) NOT NULL,
+        create_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        data TEXT,
+        change_seq INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_leave_records_date ON leave_records(start_date, end_date)',
+    'CREATE INDEX IF NOT EXISTS idx_leave_records_end_date ON leave_records(end_date)',
+    'CREATE INDEX IF NOT EXISTS idx_leave_records_create_time ON leave_records(create_time DESC, id DESC)',
+    'CREATE INDEX IF NOT EXISTS idx_leave_records_change_seq ON leave_records(change_seq)',
+    # 同一員工的區間索引：檢查請假重疊
+    'CREATE INDEX IF NOT EXISTS idx_leave_records_name_dates ON leave_records(name, start_date, end_date)',
+    '''
+    CREATE TABLE IF NOT EXISTS leave_data_version (
+        id INTEGER PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    'INSERT OR IGNORE INTO leave_data_version (id, version) VALUES (1, 0)',
+    '''
+    CREATE TABLE IF NOT EXISTS leave_deletions (
+        id VARCHAR(50) PRIMARY KEY,
+        change_seq INTEGER NOT NULL,
+        deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_leave_deletions_change_seq ON leave_deletions(change_seq)',
+    # 已清除墓碑的最大變更序號：早於它的游標無法取得完整的刪除清單
+    '''
+    CREATE TABLE IF NOT EXISTS leave_tombstone_floor (
+        id INTEGER PRIMARY KEY,
+        change_seq INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    'INSERT OR IGNORE INTO leave_tombstone_floor (id, change_seq) VALUES (1, 0)',
+]
+
+SELECT_COLUMNS = 'SELECT id, name, start_date, end_date, reason, type, create_time, data FROM leave_records'
+
+
+def row_to_record(row):
+    """將 SQLite 記錄轉換為前端格式（日期本身即為 YYYY-MM-DD 字串）"""
+    record = {
+        'id': row['id'],
+        'name': row['name'],
+        'startDate': row['start_date'],
+        'endDate': row['end_date'],
+        'reason': row['reason'],
+        'type': row['type'],
+        'createTime': row['create_time']
+    }
+    # 合併額外數據
+    if row['data']:
+        record.update(json.loads(row['data']))
+    return record
+
+
+class SqliteStore(LeaveStore):
+    """SQLite (WAL) 儲存；每個執行緒使用自己的連線，寫入以 BEGIN IMMEDIATE 序列化"""
+
+    name = 'sqlite'
+
+    def __init__(self, path=SQLITE_PATH, timeout=SQLITE_BUSY_TIMEOUT, synchronous=SQLITE_SYNCHRONOUS):
+        self.path = path
+        self.timeout = timeout
+        self.synchronous = synchronous
+        self._local = threading.local()
+
+    # ------------------------------------------------------------------ 連線
+
+    def _connection(self):
+        """本執行緒的連線；fork 後不可沿用父程序的連線"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        # isolation_level=None：由本類別自行控制交易範圍
+        started = time.perf_counter()
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute(f'PRAGMA synchronous = {self.synchronous}')
+        metrics.observe('leave_db_connect_seconds', time.perf_counter() - started, (('engine', 'sqlite'),))
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _transaction(self, mode=''):
+        """交易範圍；讀取使用一般交易取得一致的快照，寫入使用 IMMEDIATE 先取得寫入鎖"""
+        conn = self._connection()
+        conn.execute(f'BEGIN {mode}')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def init(self):
+        """建立表結構並切換到 WAL 模式（設定會保存在數據庫文件中）"""
+        conn = self._connection()
+        mode = conn.execute('PRAGMA journal_mode = WAL').fetchone()[0]
+        with self._transaction('IMMEDIATE') as conn:
+            for statement in SCHEMA:
+                conn.execute(statement)
+        logger.info(f"✅ SQLite 數據庫初始化完成: {self.path} (journal_mode={mode})")
+
+    # ------------------------------------------------------------------ 讀取
+
+    def version(self):
+        """數據版本：每次寫入遞增"""
+        row = self._connection().execute('SELECT version FROM leave_data_version WHERE id = 1').fetchone()
+        return row[0] if row else 0
+
+    def load(self):
+        """回傳所有記錄（由新到舊）"""
+        rows = self._connection().execute(f'{SELECT_COLUMNS} ORDER BY create_time DESC').fetchall()
+        return [row_to_record(row) for row in rows]
+
+    def snapshot(self):
+        # 同一個讀取交易內的查詢看到同一個快照，其他連線此時提交的寫入不會混入
+        with self._transaction() as conn:
+            row = conn.execute('SELECT version FROM leave_data_version WHERE id = 1').fetchone()
+            rows = conn.execute(f'{SELECT_COLUMNS} ORDER BY create_time DESC').fetchall()
+        return (row[0] if row else 0), [row_to_record(row) for row in rows]
+
+    def get(self, record_id):
+        row = self._connection().execute(f'{SELECT_COLUMNS} WHERE id = ?', (str(record_id),)).fetchone()
+        return row_to_record(row) if row else None
+
+    def query(self, date_from=None, date_to=None, name=None, leave_type=None,
+              after=None, limit=None, server_side=False):
+        """依區間重疊與鍵集分頁條件逐筆產生記錄，依 (create_time, id) 由新到舊排序"""
+        conditions = []
+        params = []
+        if date_to:
+            conditions.append('start_date <= ?')
+            params.append(date_to)
+        if date_from:
+            conditions.append('end_date >= ?')
+            params.append(date_from)
+        if name:
+            conditions.append('name = ?')
+            params.append(name)
+        if leave_type:
+            conditions.append('type = ?')
+            params.append(leave_type)
+        if after:
+            conditions.append('(create_time, id) < (?, ?)')
+            params.extend(after)
+        where = ('WHERE ' + ' AND '.join(conditions)) if conditions else ''
+        sql = f'{SELECT_COLUMNS} {where} ORDER BY create_time DESC, id DESC'
+        if limit:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        # 游標逐筆讀取，不一次載入所有結果
+        for row in self._connection().execute(sql, params):
+            yield row_to_record(row)
+
+    def changes_since(self, cursor):
+        """回傳 (cursor, 更新的記錄, 刪除的 ID)；游標無法解析或超前時回傳 None"""
+        try:
+            since = int(cursor)
+        except (TypeError, ValueError):
+            return None
+        with self._transaction() as conn:
+            current = conn.execute('SELECT version FROM leave_data_version WHERE id = 1').fetchone()[0]
+            if since > current:
+                return None
+            if since == current:
+                return current, [], []
+            floor = conn.execute('SELECT change_seq FROM leave_tombstone_floor WHERE id = 1').fetchone()[0]
+            if since < floor:
+                return None
+            rows = conn.execute(f'{SELECT_COLUMNS} WHERE change_seq > ? AND change_seq <= ? ORDER BY change_seq',
+                                (since, current)).fetchall()
+            deleted = [row['id'] for row in conn.execute(
+                'SELECT id FROM leave_deletions WHERE change_seq > ? AND change_seq <= ?', (since, current))]
+        return current, [row_to_record(row) for row in rows], deleted
+
+    def aggregate_stats(self):
+        """以 GROUP BY 計算統計，不必把記錄載入 Python"""
+        days = 'SUM(julianday(end_date) - julianday(start_date) + 1)'
+        with self._transaction() as conn:
+            total_records, total_days = conn.execute(f'SELECT COUNT(*), {days} FROM leave_records').fetchone()
+            result = {'total_records': total_records, 'total_days': int(total_days or 0)}
+            for group, key in (('by_type', 'type'), ('by_employee', 'name'),
+                               ('by_month', 'substr(start_date, 1, 7)')):
+                result[group] = format_group(conn.execute(
+                    f'SELECT {key}, COUNT(*), {days} FROM leave_records GROUP BY {key}'))
+        return result
+
+    # ------------------------------------------------------------------ 寫入
+
+    @staticmethod
+    def _bump_version(conn):
+        conn.execute('UPDATE leave_data_version SET version = version + 1 WHERE id = 1')
+        return conn.execute('SELECT version FROM leave_data_version WHERE id = 1').fetchone()[0]
+
+    @staticmethod
+    def _conflicts(conn, name, start_date, end_date, exclude_id=None):
+        rows = conn.execute(f'''
+            {SELECT_COLUMNS}
+            WHERE name = ? AND start_date <= ? AND end_date >= ? AND id != ?
+            ORDER BY start_date
+        ''', (name, end_date, start_date, '' if exclude_id is None else str(exclude_id))).fetchall()
+        return [row_to_record(row) for row in rows]
+
+    def find_conflicts(self, name, start_date, end_date, exclude_id=None):
+        return self._conflicts(self._connection(), name, start_date, end_date, exclude_id)
+
+    def upsert_checked(self, record, insert_only=False):
+        """檢查與寫入在同一個 IMMEDIATE 交易中，其他寫入者無法插入重疊的記錄"""
+        with self._transaction('IMMEDIATE') as conn:
+            if insert_only and conn.execute('SELECT 1 FROM leave_records WHERE id = ?',
+                                            (str(record['id']),)).fetchone():
+                raise DuplicateIdError(str(record['id']))
+            conflicts = self._conflicts(conn, record['name'], record['startDate'],
+                                        record['endDate'], record.get('id'))
+            if conflicts:
+                raise ConflictError(conflicts)
+            return self._upsert_rows(conn, [record])
+
+    def insert_checked(self, record):
+        return self.upsert_checked(record, insert_only=True)
+
+    def upsert_many(self, records):
+        """在同一個交易中寫入多筆記錄（單次 fsync）；回傳新的數據版本"""
+        with self._transaction('IMMEDIATE') as conn:
+            return self._upsert_rows(conn, records)
+
+    def _upsert_rows(self, conn, records):
+        """在呼叫者的交易中寫入記錄；回傳新的數據版本"""
+        version = self._bump_version(conn)
+        rows = []
+        for record in records:
+            extra_data = {k: v for k, v in record.items() if k not in RECORD_COLUMNS}
+            rows.append((
+                str(record['id']),
+                record['name'],
+                record['startDate'],
+                record['endDate'],
+                record['reason'],
+                record['type'],
+                record.get('createTime') or datetime.now().isoformat(),
+                json.dumps(extra_data, ensure_ascii=False) if extra_data else None,
+                version
+            ))
+        conn.executemany('''
+            INSERT INTO leave_records
+            (id, name, start_date, end_date, reason, type, create_time, data, change_seq)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET
+            name = excluded.name,
+            start_date = excluded.start_date,
+            end_date = excluded.end_date,
+            reason = excluded.reason,
+            type = excluded.type,
+            data = excluded.data,
+            change_seq = excluded.change_seq
+        ''', rows)
+        # 同一 ID 重新寫入時移除舊的刪除墓碑
+        conn.executemany('DELETE FROM leave_deletions WHERE id = ?', [(row[0],) for row in rows])
+        return version
+
+    def purge_tombstones(self, retention_days=TOMBSTONE_RETENTION_DAYS):
+        """清除超過保留期限的墓碑，並提高游標下限"""
+        with self._transaction('IMMEDIATE') as conn:
+            newest = conn.execute(
+                "SELECT MAX(change_seq) FROM leave_deletions WHERE deleted_at < datetime('now', ?)",
+                (f'{-retention_days:+} days',)).fetchone()[0]
+            if newest is None:
+                return 0
+            purged = conn.execute('DELETE FROM leave_deletions WHERE change_seq <= ?', (newest,)).rowcount
+            conn.execute('UPDATE leave_tombstone_floor SET change_seq = MAX(change_seq, ?) WHERE id = 1', (newest,))
+        logger.info(f"🧹 已清除 {purged} 筆過期的刪除墓碑")
+        return purged
+
+    def delete(self, record_ids):
+        """依主鍵刪除記錄並留下墓碑；回傳實際刪除的 ID"""
+        record_ids = list(dict.fromkeys(str(record_id) for record_id in record_ids))
+        if not record_ids:
+            return []
+        with self._transaction('IMMEDIATE') as conn:
+            existing = []
+            for i in range(0, len(record_ids), SQLITE_MAX_PARAMS):
+                chunk = record_ids[i:i + SQLITE_MAX_PARAMS]
+                placeholders = ','.join('?' * len(chunk))
+                existing.extend(row['id'] for row in conn.execute(
+                    f'SELECT id FROM leave_records WHERE id IN ({placeholders})', chunk))
+            if not existing:
+                return []
+            version = self._bump_version(conn)
+            # 同一個交易內分段刪除，對其他連線仍是一次完整的變更
+            for i in range(0, len(existing), SQLITE_MAX_PARAMS):
+                chunk = existing[i:i + SQLITE_MAX_PARAMS]
+                placeholders = ','.join('?' * len(chunk))
+                conn.execute(f'DELETE FROM leave_records WHERE id IN ({placeholders})', chunk)
+            conn.executemany('''
+                INSERT INTO leave_deletions (id, change_seq) VALUES (?, ?)
+                ON CONFLICT (id) DO UPDATE SET change_seq = excluded.change_seq,
+                deleted_at = CURRENT_TIMESTAMP
+            ''', [(record_id, version) for record_id in existing])
+        return existing
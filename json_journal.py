@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+請假管理系統 - JSON 日誌儲存 (Leave Management System - JSON Journal Storage)
+MIT License - LeaveSystem Project 2024
+
+本地文件模式的儲存方式：每次寫入只在日誌文件 (JSON-lines) 追加一行並 fsync，
+累積一定筆數後才壓縮成 data.json 快照（暫存檔 + fsync + 原子替換），
+寫入成本與單筆記錄大小相關，而非整份數據；寫入途中當機也不會截斷 data.json
+"""
+
+import os
+import json
+import threading
+import logging
+from contextlib import contextmanager
+
+from leave_store import ConflictError, DuplicateIdError, LeaveStore, is_conflict
+
+try:
+    import fcntl
+except ImportError:  # Windows 開發環境：只有單一程序，執行緒鎖即可
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# 日誌累積筆數達到此值時壓縮成快照
+JOURNAL_COMPACT_ENTRIES = int(os.environ.get('JOURNAL_COMPACT_ENTRIES', 500))
+
+
+def fsync_directory(path):
+    """確保目錄項目（重新命名）已寫入磁碟"""
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_write_json(path, data):
+    """寫入暫存檔並 fsync 後原子替換，讀取者永遠不會看到寫到一半的文件"""
+    tmp_path = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        fsync_directory(path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class JsonJournalStore(LeaveStore):
+    """data.json 快照 + 追加式日誌；各程序以文件鎖協調寫入，並增量讀取他人寫入的日誌"""
+
+    name = 'json'
+
+    def __init__(self, snapshot_path='data.json', journal_path=None, lock_path=None,
+                 compact_entries=JOURNAL_COMPACT_ENTRIES):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path or f"{os.path.splitext(snapshot_path)[0]}.journal.jsonl"
+        self.lock_path = lock_path or f"{snapshot_path}.lock"
+        self.compact_entries = compact_entries
+
+        self._lock = threading.RLock()
+        self._records = {}          # str(id) -> record，保持文件中的順序
+        self._by_name = {}          # 員工 -> 該員工記錄的 ID（檢查請假重疊用）
+        self._snapshot_key = None   # 已載入快照的 (inode, mtime_ns, size)
+        self._journal_key = None    # 已讀取日誌的 inode
+        self._journal_offset = 0    # 已讀取的日誌位元組數
+        self._seq = 0               # 目前日誌中最後一筆的序號
+        self._log = []              # 本日誌的異動 (seq, op, id)，供差異同步使用
+
+    # ------------------------------------------------------------------ 讀取
+
+    @staticmethod
+    def _stat_key(path):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _refresh(self):
+        """與磁碟同步：快照被替換時重新載入，否則只讀取日誌新增的部分"""
+        snapshot_key = self._stat_key(self.snapshot_path)
+        journal_key = self._stat_key(self.journal_path)
+
+        # 快照被替換、日誌被替換/清空時，已載入的狀態失效
+        if (snapshot_key != self._snapshot_key
+                or (journal_key and self._journal_key is not None and journal_key[0] != self._journal_key)
+                or (journal_key is None and self._journal_offset)
+                or (journal_key and journal_key[2] < self._journal_offset)):
+            self._reload(snapshot_key)
+            journal_key = self._stat_key(self.journal_path)
+
+        if journal_key and journal_key[2] > self._journal_offset:
+            self._read_journal()
+
+    def _reload(self, snapshot_key):
+        records = {}
+        by_name = {}
+        if snapshot_key is not None:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                for record in json.load(f):
+                    records[str(record.get('id'))] = record
+        for record_id, record in records.items():
+            by_name.setdefault(record.get('name'), set()).add(record_id)
+        self._records = records
+        self._by_name = by_name
+        self._snapshot_key = snapshot_key
+        self._journal_key = None
+        self._journal_offset = 0
+        self._seq = 0
+        self._log = []
+
+    def _read_journal(self):
+        with open(self.journal_path, 'rb') as f:
+            self._journal_key = os.fstat(f.fileno()).st_ino
+            f.seek(self._journal_offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # 寫到一半的最後一行（例如當機）：忽略，下次寫入前會截斷
+                    break
+                self._journal_offset += len(line)
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    logger.warning(f"⚠️ 略過無法解析的日誌行: {line[:80]!r}")
+                    continue
+                self._apply(entry)
+
+    def _apply(self, entry):
+        seq = entry.get('seq', self._seq + 1)
+        if entry.get('op') == 'upsert':
+            record = entry['record']
+            record_id = str(record.get('id'))
+            # 與舊版行為一致：更新的記錄移到最後
+            self._unindex(record_id)
+            self._records[record_id] = record
+            self._by_name.setdefault(record.get('name'), set()).add(record_id)
+            self._log.append((seq, 'upsert', record_id))
+        elif entry.get('op') == 'delete':
+            record_id = str(entry['id'])
+            self._unindex(record_id)
+            self._log.append((seq, 'delete', record_id))
+        self._seq = max(self._seq, seq)
+
+    def _unindex(self, record_id):
+        previous = self._records.pop(record_id, None)
+        if previous is not None:
+            ids = self._by_name.get(previous.get('name'))
+            if ids is not None:
+                ids.discard(record_id)
+                if not ids:
+                    del self._by_name[previous.get('name')]
+
+    def exists(self):
+        """是否已有任何數據文件"""
+        return os.path.exists(self.snapshot_path) or os.path.exists(self.journal_path)
+
+    def load(self):
+        """回傳所有記錄（依寫入順序）"""
+        with self._lock:
+            self._refresh()
+            return list(self._records.values())
+
+    def get(self, record_id):
+        with self._lock:
+            self._refresh()
+            return self._records.get(str(record_id))
+
+    def count(self):
+        with self._lock:
+            self._refresh()
+            return len(self._records)
+
+    def snapshot(self):
+        """回傳 (數據版本, 所有記錄)；兩者在同一個鎖內取得，內容一定屬於該版本"""
+        with self._lock:
+            self._refresh()
+            return self._format_version(), list(self._records.values())
+
+    def _conflicts(self, name, start_date, end_date, exclude_id=None):
+        records = (self._records[record_id] for record_id in self._by_name.get(name, ()))
+        return [record for record in records if is_conflict(record, name, start_date, end_date, exclude_id)]
+
+    def find_conflicts(self, name, start_date, end_date, exclude_id=None):
+        """只檢查同一員工的記錄，不掃描全部"""
+        with self._lock:
+            self._refresh()
+            return self._conflicts(name, start_date, end_date, exclude_id)
+
+    def version(self):
+        """數據版本：快照識別 + 日誌序號；快照被替換（壓縮）後前綴即改變"""
+        with self._lock:
+            self._refresh()
+            return self._format_version()
+
+    def _format_version(self):
+        snapshot = self._snapshot_key or (0, 0, 0)
+        return f"{snapshot[0]:x}-{snapshot[1]:x}.{self._seq}"
+
+    def changes_since(self, cursor):
+        """回傳 (cursor, 更新的記錄, 刪除的 ID)；游標屬於舊快照或無法解析時回傳 None"""
+        with self._lock:
+            current = self.version()
+            prefix, _, seq = str(cursor).rpartition('.')
+            if prefix != current.rpartition('.')[0]:
+                return None
+            try:
+                seq = int(seq)
+            except ValueError:
+                return None
+            if seq > self._seq:
+                return None
+
+            latest = {}
+            for entry_seq, op, record_id in self._log:
+                if entry_seq > seq:
+                    latest[record_id] = op
+            changes = [self._records[record_id] for record_id, op in latest.items()
+                       if op == 'upsert' and record_id in self._records]
+            deleted = [record_id for record_id, op in latest.items() if op == 'delete']
+            return current, changes, deleted
+
+    # ------------------------------------------------------------------ 寫入
+
+    @contextmanager
+    def _file_lock(self):
+        """跨程序寫入鎖（gunicorn 多個 worker）"""
+        if fcntl is None:
+            yield
+            return
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _append(self, entries):
+        """追加日誌行並 fsync；回傳新的數據版本"""
+        # 截斷當機留下的不完整行，避免與新寫入的內容黏在一起
+        if os.path.exists(self.journal_path) and os.path.getsize(self.journal_path) > self._journal_offset:
+            with open(self.journal_path, 'r+b') as f:
+                f.truncate(self._journal_offset)
+
+        lines = []
+        for entry in entries:
+            self._seq += 1
+            entry['seq'] = self._seq
+            lines.append(json.dumps(entry, ensure_ascii=False) + '\n')
+        data = ''.join(lines).encode('utf-8')
+
+        created = not os.path.exists(self.journal_path)
+        with open(self.journal_path, 'ab') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+            self._journal_key = os.fstat(f.fileno()).st_ino
+        if created:
+            fsync_directory(self.journal_path)
+        self._journal_offset += len(data)
+
+        for entry in entries:
+            self._apply(entry)
+        if len(self._log) >= self.compact_entries:
+            self._compact()
+        return self._format_version()
+
+    def upsert_many(self, records):
+        """一次追加多筆記錄（單次 fsync）"""
+        with self._lock, self._file_lock():
+            self._refresh()
+            return self._append([{'op': 'upsert', 'record': record} for record in records])
+
+    def upsert_checked(self, record, insert_only=False):
+        """在寫入鎖內檢查重疊，其他 worker 無法在檢查與寫入之間插入記錄"""
+        with self._lock, self._file_lock():
+            self._refresh()
+            if insert_only and str(record['id']) in self._records:
+                raise DuplicateIdError(str(record['id']))
+            conflicts = self._conflicts(record.get('name'), record.get('startDate', ''),
+                                        record.get('endDate', ''), record.get('id'))
+            if conflicts:
+                raise ConflictError(conflicts)
+            return self._append([{'op': 'upsert', 'record': record}])
+
+    def insert_checked(self, record):
+        return self.upsert_checked(record, insert_only=True)
+
+    def replace(self, records):
+        """以整份記錄取代目前數據；只追加有改變的記錄與刪除，整份保存也不必重寫快照"""
+        with self._lock, self._file_lock():
+            self._refresh()
+            keep = {str(record.get('id')) for record in records}
+            entries = [{'op': 'delete', 'id': record_id} for record_id in self._records if record_id not in keep]
+            entries.extend({'op': 'upsert', 'record': record} for record in records
+                           if self._records.get(str(record.get('id'))) != record)
+            if not entries:
+                return self._format_version()
+            return self._append(entries)
+
+    def delete(self, record_ids):
+        """刪除記錄（追加墓碑）；回傳實際刪除的 ID"""
+        with self._lock, self._file_lock():
+            self._refresh()
+            existing = [str(record_id) for record_id in record_ids if str(record_id) in self._records]
+            if existing:
+                self._append([{'op': 'delete', 'id': record_id} for record_id in existing])
+            return existing
+
+    def compact(self):
+        """立即把日誌壓縮成快照"""
+        with self._lock, self._file_lock():
+            self._refresh()
+            self._compact()
+
+    def _compact(self):
+        """寫入新快照後清空日誌；兩步之間當機時舊日誌重播也是冪等的"""
+        atomic_write_json(self.snapshot_path, list(self._records.values()))
+        tmp_path = f"{self.journal_path}.tmp.{os.getpid()}"
+        with open(tmp_path, 'wb') as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.journal_path)
+        fsync_directory(self.journal_path)
+
+        self._snapshot_key = self._stat_key(self.snapshot_path)
+        self._journal_key = os.stat(self.journal_path).st_ino
+        self._journal_offset = 0
+        self._seq = 0
+        self._log = []
+        logger.info(f"🗜️ 日誌已壓縮為快照: {len(self._records)} 筆記錄")
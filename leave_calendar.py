@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+請假管理系統 - 每日請假人數索引 (Leave Management System - Daily Headcount Calendar)
+MIT License - LeaveSystem Project 2024
+
+預先展開每筆請假涵蓋的日期：日期 → 當天請假的記錄，新增 / 刪除時只更新受影響的日期，
+查詢一個月份只需走訪該範圍內的日期，不必篩選全部記錄；同時累計請假統計
+"""
+
+import os
+import threading
+import logging
+from collections import Counter
+from datetime import date, timedelta
+
+from leave_stats import LeaveAggregates
+
+logger = logging.getLogger(__name__)
+
+# 單次查詢最多可涵蓋的天數（日曆 6 週為 42 天）
+CALENDAR_MAX_DAYS = int(os.environ.get('CALENDAR_MAX_DAYS', 366))
+# 單筆請假最多可涵蓋的天數（新增 / 匯入時驗證）
+LEAVE_MAX_DAYS = int(os.environ.get('LEAVE_MAX_DAYS', 366))
+# 超過此天數的請假不逐日展開（例如驗證加入前的舊數據），查詢時另外比對區間
+CALENDAR_EXPAND_MAX_DAYS = int(os.environ.get('CALENDAR_EXPAND_MAX_DAYS', LEAVE_MAX_DAYS))
+
+
+def parse_date(value):
+    """YYYY-MM-DD 轉為 date；格式錯誤時回傳 None"""
+    try:
+        return date.fromisoformat(str(value)[:10])
+    except (TypeError, ValueError):
+        return None
+
+
+def iter_days(start, end):
+    """逐日產生 start 到 end（含）的日期字串"""
+    day = start
+    while day <= end:
+        yield day.isoformat()
+        day += timedelta(days=1)
+
+
+class DailyCalendar:
+    """日期 → {記錄 ID: 請假類型} 的索引，以數據版本游標增量同步"""
+
+    def __init__(self):
+        self.cursor = None
+        self._days = {}       # 'YYYY-MM-DD' -> {id: type}
+        self._records = {}    # id -> 記錄
+        self._long = {}       # id -> ('YYYY-MM-DD', 'YYYY-MM-DD')：未展開的長假
+        self.aggregates = LeaveAggregates()
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._records)
+
+    # ------------------------------------------------------------------ 維護
+
+    def _add(self, record):
+        record_id = str(record.get('id'))
+        self._records[record_id] = record
+        self.aggregates.add(record)
+        start, end = parse_date(record.get('startDate')), parse_date(record.get('endDate'))
+        if start is None or end is None:
+            return
+        if (end - start).days + 1 > CALENDAR_EXPAND_MAX_DAYS:
+            self._long[record_id] = (start.isoformat(), end.isoformat())
+            return
+        for day in iter_days(start, end):
+            self._days.setdefault(day, {})[record_id] = record.get('type')
+
+    def _remove(self, record_id):
+        record = self._records.pop(str(record_id), None)
+        if record is None:
+            return
+        self.aggregates.remove(record)
+        if self._long.pop(str(record_id), None) is not None:
+            return
+        start, end = parse_date(record.get('startDate')), parse_date(record.get('endDate'))
+        if start is None or end is None:
+            return
+        for day in iter_days(start, end):
+            entries = self._days.get(day)
+            if entries is not None:
+                entries.pop(str(record_id), None)
+                if not entries:
+                    del self._days[day]
+
+    def reset(self, records, cursor):
+        """以完整的記錄清單重建索引"""
+        with self._lock:
+            self._days = {}
+            self._records = {}
+            self._long = {}
+            self.aggregates.clear()
+            for record in records:
+                self._add(record)
+            self.cursor = cursor
+
+    def apply(self, cursor, changes, deleted):
+        """套用差異同步的結果：只更新變更記錄涵蓋的日期"""
+        with self._lock:
+            for record_id in deleted:
+                self._remove(record_id)
+            for record in changes:
+                # 修改日期時舊區間必須先移除
+                self._remove(record.get('id'))
+                self._add(record)
+            self.cursor = cursor
+
+    def sync(self, version, load_changes, load_all):
+        """與儲存引擎同步到指定版本；差異無法取得時才整份重建
+
+        load_all 回傳 (數據版本, 所有記錄)，重建後的游標使用它讀到的版本，
+        而不是呼叫者先前取得、可能較舊的版本
+        回傳 'current'（已是最新）、'delta'（套用差異）或 'rebuild'（整份重建）
+        """
+        if version is not None and version == self.cursor:
+            return 'current'
+        # 同時只有一個執行緒向儲存引擎查詢差異，其他執行緒等待後直接使用結果
+        with self._sync_lock:
+            if version is not None and version == self.cursor:
+                return 'current'
+            result = load_changes(self.cursor) if self.cursor is not None else None
+            if result is None:
+                cursor, records = load_all()
+                self.reset(records, cursor)
+                logger.info(f"📅 日曆索引已重建: {len(records)} 筆記錄")
+                return 'rebuild'
+            self.apply(*result)
+            return 'delta'
+
+    # ------------------------------------------------------------------ 查詢
+
+    def window(self, date_from, date_to):
+        """回傳 (每日摘要, 範圍內的記錄)；只走訪範圍內的日期"""
+        start, end = parse_date(date_from), parse_date(date_to)
+        days = {}
+        records = {}
+        with self._lock:
+            spanning = [(record_id, first, last, self._records[record_id].get('type'))
+                        for record_id, (first, last) in self._long.items()
+                        if first <= end.isoformat() and last >= start.isoformat()]
+            for day in iter_days(start, end):
+                entries = self._days.get(day)
+                if spanning:
+                    entries = dict(entries or {})
+                    entries.update((record_id, leave_type) for record_id, first, last, leave_type in spanning
+                                   if first <= day <= last)
+                if not entries:
+                    continue
+                days[day] = {
+                    'count': len(entries),
+                    'types': dict(Counter(entries.values())),
+                    'ids': sorted(entries)
+                }
+                for record_id in entries:
+                    if record_id not in records:
+                        records[record_id] = self._records[record_id]
+        return days, list(records.values())
+
+    def stats(self, today=None):
+        """累計的請假統計與指定日期（預設今天）的請假人數"""
+        today = (today or date.today()).isoformat()
+        with self._lock:
+            result = self.aggregates.to_dict()
+            result['on_leave_today'] = len(self._days.get(today, ())) + sum(
+                1 for first, last in self._long.values() if first <= today <= last)
+        result['date'] = today
+        return result
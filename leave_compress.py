@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+請假管理系統 - 回應壓縮 (Leave Management System - Response Compression)
+MIT License - LeaveSystem Project 2024
+
+依 Accept-Encoding 選擇 brotli（有安裝 brotli 套件時）或 gzip。
+靜態文件在啟動時以最高等級預先壓縮並保存在記憶體，之後每個請求直接回傳；
+數據快照依版本快取壓縮結果，只有數據改變後才重新壓縮一次
+"""
+
+import os
+import gzip
+import hashlib
+import mimetypes
+import threading
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:  # 選用套件：未安裝時只提供 gzip
+    brotli = None
+
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))        # 小於此大小不壓縮
+COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', 5))                # 動態回應的 gzip 等級
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', 5))                # 動態回應的 brotli 品質
+STATIC_EXTENSIONS = ('.html', '.js', '.css', '.svg', '.txt', '.md')
+STATIC_MAX_SIZE = int(os.environ.get('STATIC_MAX_SIZE', 4 * 1024 * 1024))
+
+# 偏好順序：brotli 壓縮率較好
+ENCODINGS = ('br', 'gzip') if brotli else ('gzip',)
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'application/javascript',
+                      'image/svg+xml', 'text/')
+
+
+def parse_accept_encoding(header):
+    """Accept-Encoding 轉為 {編碼: q 值}"""
+    accepted = {}
+    for part in (header or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def choose_encoding(header, available=ENCODINGS):
+    """依客戶端的 Accept-Encoding 選擇壓縮方式；不接受任何壓縮時回傳 None"""
+    accepted = parse_accept_encoding(header)
+    best, best_q = None, 0.0
+    for coding in available:
+        q = accepted.get(coding, accepted.get('*', 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def is_compressible(content_type):
+    content_type = (content_type or '').lower()
+    return any(content_type.startswith(prefix) for prefix in COMPRESSIBLE_TYPES)
+
+
+def compress(data, encoding, static=False):
+    """壓縮 bytes；static=True 使用最高等級（只在啟動時執行一次）"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=11 if static else BROTLI_QUALITY)
+    # mtime=0：相同內容永遠得到相同的壓縮結果
+    return gzip.compress(data, compresslevel=9 if static else COMPRESS_LEVEL, mtime=0)
+
+
+def weak_etag(etag):
+    """壓縮後的內容與原始內容位元組不同，強 ETag 改為弱 ETag"""
+    if not etag or etag.startswith('W/'):
+        return etag
+    return f'W/{etag}'
+
+
+class CompressedVariants:
+    """依 (鍵, 編碼) 快取壓縮結果；鍵為數據版本，版本改變後舊結果依 LRU 淘汰"""
+
+    def __init__(self, maxsize=8):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, encoding, data):
+        cache_key = (key, encoding)
+        with self._lock:
+            body = self._entries.get(cache_key)
+            if body is not None:
+                self._entries.move_to_end(cache_key)
+                return body
+        # 壓縮在鎖外進行；同時有兩個執行緒壓縮同一版本時結果相同，後者覆蓋即可
+        body = compress(data, encoding)
+        with self._lock:
+            self._entries[cache_key] = body
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return body
+
+
+class StaticAsset:
+    """一個靜態文件的原始內容與各壓縮版本"""
+
+    def __init__(self, path, stat_key, body):
+        self.stat_key = stat_key
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        if content_type.startswith('text/') or content_type == 'application/javascript':
+            content_type += '; charset=utf-8'
+        self.content_type = content_type
+        self.etag = f'"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+        self.variants = {None: body}
+        if len(body) >= COMPRESS_MIN_SIZE:
+            for encoding in ENCODINGS:
+                compressed = compress(body, encoding, static=True)
+                if len(compressed) < len(body):
+                    self.variants[encoding] = compressed
+
+    def negotiate(self, accept_encoding):
+        """回傳 (編碼, 內容, ETag)"""
+        encoding = choose_encoding(accept_encoding, [e for e in ENCODINGS if e in self.variants])
+        return encoding, self.variants[encoding], weak_etag(self.etag) if encoding else self.etag
+
+
+class StaticAssets:
+    """啟動時預先讀取並壓縮目錄下的靜態文件（不含子目錄）；文件改變時才重新壓縮"""
+
+    def __init__(self, root='.', extensions=STATIC_EXTENSIONS, exclude=()):
+        self.root = os.path.abspath(root)
+        self.extensions = extensions
+        self.exclude = set(exclude)
+        self._assets = {}
+        self._lock = threading.Lock()
+        for name in sorted(os.listdir(self.root)):
+            if self._eligible(name):
+                self.get(name)
+
+    def _eligible(self, name):
+        return (name not in self.exclude and not name.startswith('.') and '.tmp.' not in name
+                and os.path.splitext(name)[1].lower() in self.extensions)
+
+    def get(self, name):
+        """回傳 StaticAsset；不是可快取的靜態文件時回傳 None（由呼叫者照原方式處理）"""
+        if '/' in name or '\\' in name or not self._eligible(name):
+            return None
+        path = os.path.join(self.root, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        stat_key = (st.st_ino, st.st_mtime_ns, st.st_size)
+        asset = self._assets.get(name)
+        if asset is not None and asset.stat_key == stat_key:
+            return asset
+        if st.st_size > STATIC_MAX_SIZE or not os.path.isfile(path):
+            return None
+        with self._lock:
+            asset = self._assets.get(name)
+            if asset is not None and asset.stat_key == stat_key:
+                return asset
+            try:
+                with open(path, 'rb') as f:
+                    st = os.fstat(f.fileno())
+                    body = f.read()
+            except OSError:
+                return None
+            asset = StaticAsset(path, (st.st_ino, st.st_mtime_ns, st.st_size), body)
+            self._assets[name] = asset
+            return asset
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+請假管理系統 - 非同步日誌 (Leave Management System - Non-blocking Logging)
+MIT License - LeaveSystem Project 2024
+
+請求執行緒只把日誌記錄放進有上限的佇列（佇列已滿時丟棄並計數，不會等待），
+由背景執行緒格式化並寫入 stderr；高頻路由（定期同步、月曆）低於 HOT_PATH_LOG_LEVEL
+的日誌依 LOG_SAMPLE_RATES 抽樣，同一個請求的日誌一起保留或一起略過
+"""
+
+import os
+import sys
+import json
+import queue
+import random
+import atexit
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+
+from leave_metrics import metrics
+
+try:
+    from flask import g, has_request_context, request
+except ImportError:  # 非 Flask 程序（例如 cloud_server.py）不做路由抽樣
+    has_request_context = None
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text').lower()               # text / json
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+# 高頻路由：低於此等級的日誌只抽樣保留（警告與錯誤一律保留）
+HOT_PATH_LOG_LEVEL = os.environ.get('HOT_PATH_LOG_LEVEL', 'WARNING').upper()
+HOT_PATH_SAMPLE_RATE = float(os.environ.get('HOT_PATH_SAMPLE_RATE', 0.01))
+# 各路由的抽樣比例，例如 "GET /api/data=0.01,/api/data/changes=0"（可省略方法）；未列出的路由全部保留
+LOG_SAMPLE_RATES = os.environ.get(
+    'LOG_SAMPLE_RATES',
+    ','.join(f'GET {route}={HOT_PATH_SAMPLE_RATE}' for route in (
+        '/api/data', '/api/data/changes', '/data.json', '/api/calendar', '/api/stats', '/api/events')))
+
+metrics.counter('leave_log_records_dropped_total', '佇列已滿而丟棄的日誌筆數')
+metrics.counter('leave_log_records_sampled_out_total', '高頻路由抽樣略過的日誌筆數')
+
+# LogRecord 本身的屬性，JSON 格式只輸出其他（extra=）欄位
+RESERVED_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+def parse_sample_rates(text):
+    """"[方法 ]路由=比例,..." 轉為 {[方法 ]路由: 比例}"""
+    rates = {}
+    for part in text.split(','):
+        route, _, rate = part.strip().partition('=')
+        if route and rate:
+            rates[route] = min(max(float(rate), 0.0), 1.0)
+    return rates
+
+
+class JsonFormatter(logging.Formatter):
+    """每筆日誌一行 JSON，方便日誌平台依欄位查詢"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'pid': record.process,
+            'thread': record.threadName
+        }
+        for key, value in vars(record).items():
+            if key not in RESERVED_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class RouteSampler(logging.Filter):
+    """在請求執行緒上標記路由，並依路由抽樣低等級的日誌（每個請求只抽一次）"""
+
+    def __init__(self, rates, hot_level):
+        super().__init__()
+        self.rates = rates
+        self.hot_level = logging.getLevelName(hot_level) if isinstance(hot_level, str) else hot_level
+
+    def filter(self, record):
+        if has_request_context is None or not has_request_context():
+            return True
+        route = request.url_rule.rule if request.url_rule else None
+        record.route = route
+        record.method = request.method
+        rate = self.rates.get(f'{request.method} {route}', self.rates.get(route))
+        if rate is None or rate >= 1 or record.levelno >= self.hot_level:
+            return True
+        sampled = g.get('log_sampled')
+        if sampled is None:
+            sampled = g.log_sampled = random.random() < rate
+        if not sampled:
+            metrics.inc('leave_log_records_sampled_out_total')
+        return sampled
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """佇列已滿時丟棄日誌而不是阻塞請求"""
+
+    def prepare(self, record):
+        # 只在請求執行緒上組出訊息（參數之後可能被修改），格式化留給背景執行緒
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.inc('leave_log_records_dropped_total')
+
+
+_listener = None
+_handlers = None          # (佇列 handler, 輸出 handler)
+
+
+def _start_listener():
+    global _listener
+    handler, output = _handlers
+    handler.queue = queue.Queue(LOG_QUEUE_SIZE)
+    _listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=True)
+    _listener.start()
+
+
+def _restart_after_fork():
+    # 背景執行緒不會跟著 fork，佇列的鎖也可能停在被持有的狀態：gunicorn worker 各自重建
+    if _handlers is not None:
+        _start_listener()
+
+
+def stop_logging():
+    """寫出佇列中剩餘的日誌（程序結束時自動呼叫）"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def setup_logging(level=LOG_LEVEL, log_format=LOG_FORMAT, sample_rates=LOG_SAMPLE_RATES,
+                  hot_level=HOT_PATH_LOG_LEVEL):
+    """以佇列 handler 取代 root logger 的 handler；可重複呼叫"""
+    global _handlers
+    output = logging.StreamHandler(sys.stderr)
+    if log_format == 'json':
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter('%(levelname)s:%(name)s:%(message)s'))
+
+    handler = NonBlockingQueueHandler(None)
+    handler.addFilter(RouteSampler(parse_sample_rates(sample_rates), hot_level))
+
+    stop_logging()
+    if _handlers is None:
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=_restart_after_fork)
+        atexit.register(stop_logging)
+    _handlers = (handler, output)
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+    _start_listener()
+    return handler
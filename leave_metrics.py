@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+請假管理系統 - 效能指標 (Leave Management System - Prometheus Metrics)
+MIT License - LeaveSystem Project 2024
+
+以 Prometheus 文字格式輸出計數器、量表與直方圖，不需要額外套件。
+每個執行緒只更新自己的計數表（不加鎖），輸出時才合併；設定 METRICS_DIR 時，
+各 gunicorn worker 定期把快照寫入該目錄，任何一個 worker 回應 /metrics 都會彙總全部 worker
+（其他 worker 的數值最多延遲 METRICS_FLUSH_INTERVAL 秒）。部署前應清空該目錄
+"""
+
+import os
+import json
+import time
+import inspect
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+METRICS_DIR = os.environ.get('METRICS_DIR')
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+
+# 直方圖的預設分組
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+ROW_BUCKETS = (0, 10, 100, 1000, 10000, 100000)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{escape_label(value)}"' for key, value in labels) + '}'
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class MetricsRegistry:
+    """指標定義與各執行緒的計數表
+
+    計數表：{(名稱, 標籤): 數值}；直方圖的數值為 [各分組筆數..., 總和, 筆數]
+    """
+
+    def __init__(self, directory=METRICS_DIR, flush_interval=METRICS_FLUSH_INTERVAL):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._definitions = {}     # 名稱 -> (類型, 說明, 分組)
+        self._local = threading.local()
+        self._shards = []          # (執行緒, 計數表)
+        self._retired = {}         # 已結束執行緒的累計數值
+        self._shards_lock = threading.Lock()
+        self._flusher_pid = None
+        if hasattr(os, 'register_at_fork'):
+            # gunicorn --preload：worker 不沿用主程序啟動期間的數值與執行緒
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+        self._shards_lock = threading.Lock()
+        self._flusher_pid = None
+
+    # ------------------------------------------------------------------ 定義
+
+    def counter(self, name, help_text):
+        self._definitions[name] = ('counter', help_text, None)
+
+    def gauge(self, name, help_text):
+        self._definitions[name] = ('gauge', help_text, None)
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self._definitions[name] = ('histogram', help_text, tuple(buckets))
+
+    # ------------------------------------------------------------------ 更新
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                self._shards.append((threading.current_thread(), shard))
+            if self.directory and self._flusher_pid != os.getpid():
+                self._start_flusher()
+        return shard
+
+    def inc(self, name, labels=(), amount=1):
+        """計數器 / 量表加上 amount（量表以負數減少）"""
+        shard = self._shard()
+        key = (name, labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def observe(self, name, value, labels=()):
+        """直方圖記錄一筆數值"""
+        shard = self._shard()
+        key = (name, labels)
+        entry = shard.get(key)
+        buckets = self._definitions[name][2]
+        if entry is None:
+            entry = shard[key] = [0] * (len(buckets) + 2)
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                entry[i] += 1
+                break
+        entry[-2] += value
+        entry[-1] += 1
+
+    def time(self, name, labels=()):
+        """with registry.time(...) 記錄區塊耗時"""
+        return _Timer(self, name, labels)
+
+    # ------------------------------------------------------------------ 彙總
+
+    @staticmethod
+    def _merge(target, source):
+        for key, value in source.items():
+            if isinstance(value, list):
+                entry = target.get(key)
+                if entry is None:
+                    target[key] = list(value)
+                else:
+                    for i, count in enumerate(value):
+                        entry[i] += count
+            else:
+                target[key] = target.get(key, 0) + value
+
+    def snapshot(self):
+        """合併本程序所有執行緒的數值；已結束執行緒的數值併入累計後移除"""
+        merged = {}
+        with self._shards_lock:
+            alive = []
+            for thread, shard in self._shards:
+                # dict() 在 GIL 下一次複製，不會與擁有者的更新衝突
+                copied = dict(shard)
+                if thread.is_alive():
+                    alive.append((thread, shard))
+                    self._merge(merged, copied)
+                else:
+                    self._merge(self._retired, copied)
+            self._shards = alive
+            self._merge(merged, self._retired)
+        return merged
+
+    # ------------------------------------------------------------------ 多 worker
+
+    def _path(self, pid=None):
+        return os.path.join(self.directory, f'metrics_{pid or os.getpid()}.json')
+
+    def flush(self):
+        """把本 worker 的快照寫入 METRICS_DIR"""
+        if not self.directory:
+            return
+        rows = [[name, [list(pair) for pair in labels], value]
+                for (name, labels), value in self.snapshot().items()]
+        path = self._path()
+        tmp_path = f'{path}.tmp'
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(rows, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"⚠️ 寫入指標快照失敗: {e}")
+
+    def _start_flusher(self):
+        """每個 worker（fork 之後）啟動一個背景執行緒定期寫入快照"""
+        with self._shards_lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+
+        def loop():
+            while True:
+                time.sleep(self.flush_interval)
+                self.flush()
+
+        threading.Thread(target=loop, name='metrics-flush', daemon=True).start()
+
+    def collect(self):
+        """本程序的即時數值加上其他 worker 最近一次的快照；已結束 worker 的量表不列入"""
+        merged = self.snapshot()
+        workers = 1
+        if self.directory and os.path.isdir(self.directory):
+            own = os.path.basename(self._path())
+            for filename in os.listdir(self.directory):
+                if not (filename.startswith('metrics_') and filename.endswith('.json')) or filename == own:
+                    continue
+                try:
+                    pid = int(filename[len('metrics_'):-len('.json')])
+                    with open(os.path.join(self.directory, filename), 'r', encoding='utf-8') as f:
+                        rows = json.load(f)
+                except (ValueError, OSError):
+                    continue
+                alive = pid_alive(pid)
+                workers += alive
+                other = {}
+                for name, labels, value in rows:
+                    definition = self._definitions.get(name)
+                    if definition is None or (definition[0] == 'gauge' and not alive):
+                        continue
+                    other[(name, tuple(tuple(pair) for pair in labels))] = value
+                self._merge(merged, other)
+        merged[('leave_metrics_workers', ())] = workers
+        return merged
+
+    def render(self):
+        """Prometheus 文字格式"""
+        values = self.collect()
+        by_name = {}
+        for (name, labels), value in values.items():
+            by_name.setdefault(name, []).append((labels, value))
+
+        lines = []
+        for name, (kind, help_text, buckets) in self._definitions.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in sorted(by_name.get(name, ()), key=lambda item: item[0]):
+                if kind != 'histogram':
+                    lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + (float('inf'),), value[:-2] + [0]):
+                    cumulative += count
+                    if bound == float('inf'):
+                        cumulative = value[-1]
+                    lines.append(f'{name}_bucket{format_labels(labels + (("le", format_value(bound)),))} '
+                                 f'{cumulative}')
+                lines.append(f'{name}_sum{format_labels(labels)} {format_value(float(value[-2]))}')
+                lines.append(f'{name}_count{format_labels(labels)} {value[-1]}')
+        return '\n'.join(lines) + '\n'
+
+
+class _Timer:
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.registry.observe(self.name, time.perf_counter() - self.started, self.labels)
+        return False
+
+
+class TimedStore:
+    """包裝儲存引擎：記錄每個方法的耗時；產生器只計算取得下一筆的時間（不含呼叫者處理的時間）"""
+
+    def __init__(self, store, registry, metric='leave_store_operation_seconds'):
+        self._store = store
+        self._registry = registry
+        self._metric = metric
+
+    def __getattr__(self, attr):
+        value = getattr(self._store, attr)
+        if attr.startswith('_') or not callable(value):
+            return value
+        labels = (('engine', self._store.name), ('operation', attr))
+
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = value(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+            if inspect.isgenerator(result):
+                return self._timed_iter(result, labels, elapsed)
+            self._registry.observe(self._metric, elapsed, labels)
+            return result
+
+        return timed
+
+    def _timed_iter(self, generator, labels, elapsed):
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    break
+                finally:
+                    elapsed += time.perf_counter() - started
+                yield item
+        finally:
+            generator.close()
+            self._registry.observe(self._metric, elapsed, labels)
+
+
+# 本程序共用的指標
+metrics = MetricsRegistry()
+
+metrics.counter('leave_http_requests_total', '依路由、方法與狀態碼的請求數')
+metrics.histogram('leave_http_request_duration_seconds', '依路由、方法與狀態碼的請求處理時間')
+metrics.gauge('leave_http_requests_in_flight', '處理中的請求數')
+metrics.histogram('leave_http_request_size_bytes', '請求內容大小', SIZE_BUCKETS)
+metrics.histogram('leave_http_response_size_bytes', '回應內容大小（不含串流回應）', SIZE_BUCKETS)
+metrics.histogram('leave_store_operation_seconds', '儲存引擎各操作的耗時（含借用連線）')
+metrics.histogram('leave_db_connect_seconds', '建立數據庫連線的耗時')
+metrics.histogram('leave_load_data_rows', 'load_data() 回傳的筆數', ROW_BUCKETS)
+metrics.counter('leave_cache_requests_total', '快取查詢結果（hit / miss / delta / rebuild）')
+metrics.gauge('leave_metrics_workers', '彙總的 worker 數')
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+請假管理系統 - 請假統計 (Leave Management System - Leave Statistics)
+MIT License - LeaveSystem Project 2024
+
+依類型、員工、月份累計的筆數與請假天數；新增 / 刪除時只加減該筆記錄的貢獻，
+讀取統計不必重新走訪所有歷史記錄
+"""
+
+from datetime import date
+
+# 統計的分組維度
+STAT_GROUPS = ('by_type', 'by_employee', 'by_month')
+
+
+def leave_days(record):
+    """請假天數（含首尾當天）；日期格式錯誤時回傳 0"""
+    try:
+        start = date.fromisoformat(str(record.get('startDate'))[:10])
+        end = date.fromisoformat(str(record.get('endDate'))[:10])
+    except ValueError:
+        return 0
+    return max((end - start).days + 1, 0)
+
+
+def record_groups(record):
+    """記錄所屬的各分組鍵；月份以開始日期所在月份計算（與數據庫 GROUP BY 一致）"""
+    return (
+        ('by_type', record.get('type') or '未知'),
+        ('by_employee', record.get('name') or '未知'),
+        ('by_month', str(record.get('startDate') or '')[:7] or '未知'),
+    )
+
+
+def format_group(rows):
+    """(鍵, 筆數, 天數) 轉為 {鍵: {'count', 'days'}}"""
+    return {key: {'count': int(count), 'days': int(days or 0)} for key, count, days in rows}
+
+
+class LeaveAggregates:
+    """增量維護的統計；呼叫者負責加鎖"""
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.total_records = 0
+        self.total_days = 0
+        self._groups = {group: {} for group in STAT_GROUPS}
+
+    def add(self, record, sign=1):
+        days = leave_days(record)
+        self.total_records += sign
+        self.total_days += sign * days
+        for group, key in record_groups(record):
+            entry = self._groups[group].setdefault(key, [0, 0])
+            entry[0] += sign
+            entry[1] += sign * days
+            if entry[0] <= 0:
+                del self._groups[group][key]
+
+    def remove(self, record):
+        self.add(record, sign=-1)
+
+    def to_dict(self):
+        result = {'total_records': self.total_records, 'total_days': self.total_days}
+        for group in STAT_GROUPS:
+            result[group] = format_group((key, count, days)
+                                         for key, (count, days) in self._groups[group].items())
+        return result
+
+    @classmethod
+    def from_records(cls, records):
+        aggregates = cls()
+        for record in records:
+            aggregates.add(record)
+        return aggregates
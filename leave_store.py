@@ -0,0 +1,492 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+請假管理系統 - 儲存引擎介面 (Leave Management System - Storage Engine Interface)
+MIT License - LeaveSystem Project 2024
+
+所有儲存方式（記憶體、JSON 日誌、SQLite、PostgreSQL）實作同一組操作，
+各個伺服器版本只需選擇引擎，不必各自重寫讀寫邏輯
+"""
+
+import os
+import uuid
+import calendar
+import threading
+import logging
+from bisect import bisect_left, bisect_right, insort
+from datetime import date, datetime
+
+from db_notify import ChangeFeed, get_file_watcher
+from leave_stats import LeaveAggregates
+
+logger = logging.getLogger(__name__)
+
+# 可選的儲存引擎（STORAGE_BACKEND 環境變數）
+STORAGE_ENGINES = ('memory', 'json', 'sqlite', 'postgresql')
+
+# 大於任何記錄 ID 的字串，用於區間索引的二分搜尋上界
+MAX_ID = '\U0010ffff'
+
+# 刪除墓碑保留天數：超過後清除，游標早於清除點的客戶端改為整份重新載入
+TOMBSTONE_RETENTION_DAYS = float(os.environ.get('TOMBSTONE_RETENTION_DAYS', 30))
+
+
+def record_sort_key(record):
+    """記錄的排序鍵，與數據庫的 (create_time, id) 排序一致"""
+    return (str(record.get('createTime') or ''), str(record.get('id')))
+
+
+def match_record(record, date_from=None, date_to=None, name=None, leave_type=None, after=None):
+    """記錄是否符合篩選條件；日期為 YYYY-MM-DD 字串，可直接比較"""
+    # 區間重疊：開始日不晚於範圍結束、結束日不早於範圍開始
+    return ((not date_to or record.get('startDate', '') <= date_to)
+            and (not date_from or record.get('endDate', '') >= date_from)
+            and (not name or record.get('name') == name)
+            and (not leave_type or record.get('type') == leave_type)
+            and (not after or record_sort_key(record) < tuple(after)))
+
+
+def new_record_id(now=None):
+    """新記錄 ID：建立時間（方便閱讀）加上隨機後綴；多個執行緒 / worker 在同一毫秒建立也不會重複"""
+    now = now or datetime.now()
+    return f"{now.strftime('%Y%m%d_%H%M%S_%f')[:-3]}_{uuid.uuid4().hex[:12]}"
+
+
+def date_ordinal(value):
+    """YYYY-MM-DD 字串轉為日序數；格式錯誤時回傳 None"""
+    try:
+        return date.fromisoformat(value).toordinal()
+    except (TypeError, ValueError):
+        return None
+
+
+def is_conflict(record, name, start_date, end_date, exclude_id=None):
+    """同一員工、日期區間重疊（含首尾當天）的其他記錄"""
+    return (record.get('name') == name
+            and record.get('startDate', '') <= end_date
+            and record.get('endDate', '') >= start_date
+            and (exclude_id is None or str(record.get('id')) != str(exclude_id)))
+
+
+def batch_overlaps(records):
+    """同一批次內同一員工日期重疊的記錄：回傳 [(記錄, 與其重疊的較早記錄)]
+
+    依員工分組後依開始日排序，只需與目前結束日最晚的記錄比較，不必兩兩比對
+    """
+    by_name = {}
+    for record in records:
+        by_name.setdefault(record.get('name'), []).append(record)
+    overlaps = []
+    for group in by_name.values():
+        group.sort(key=lambda r: r.get('startDate', ''))
+        latest = None
+        for record in group:
+            if latest is not None and record.get('startDate', '') <= latest.get('endDate', ''):
+                overlaps.append((record, latest))
+            if latest is None or record.get('endDate', '') > latest.get('endDate', ''):
+                latest = record
+    return overlaps
+
+
+def conflict_details(records):
+    """衝突記錄的摘要（409 回應內容）"""
+    details = []
+    for record in sorted(records, key=lambda r: (r.get('startDate', ''), str(r.get('id')))):
+        start, end = date_ordinal(record.get('startDate')), date_ordinal(record.get('endDate'))
+        details.append({
+            'id': record.get('id'),
+            'name': record.get('name'),
+            'startDate': record.get('startDate'),
+            'endDate': record.get('endDate'),
+            'type': record.get('type'),
+            'submitDate': record.get('submitDate') or (str(record.get('createTime') or '')[:10] or None),
+            'days': end - start + 1 if start is not None and end is not None else None
+        })
+    return details
+
+
+class ConflictError(Exception):
+    """新記錄與同一員工的既有請假區間重疊"""
+
+    def __init__(self, conflicts):
+        super().__init__(f"與 {len(conflicts)} 筆既有請假記錄重疊")
+        self.conflicts = conflict_details(conflicts)
+
+
+class DuplicateIdError(Exception):
+    """新增的記錄 ID 已存在（新增不會取代既有記錄）"""
+
+    def __init__(self, record_id):
+        super().__init__(f"記錄 ID 已存在: {record_id}")
+        self.record_id = record_id
+
+
+class LeaveStore:
+    """儲存引擎基底類別
+
+    版本號 (version) 在每次寫入後改變，changes_since 以它作為差異同步的游標；
+    子類別至少需實作 load / upsert_many / delete / version / changes_since
+    """
+
+    name = None
+
+    def init(self):
+        """建立表結構等初始化工作（預設不需要）"""
+
+    def load(self):
+        """回傳所有記錄"""
+        raise NotImplementedError
+
+    def get(self, record_id):
+        """依 ID 取得單筆記錄，不存在時回傳 None"""
+        record_id = str(record_id)
+        for record in self.load():
+            if str(record.get('id')) == record_id:
+                return record
+        return None
+
+    def query(self, date_from=None, date_to=None, name=None, leave_type=None,
+              after=None, limit=None, server_side=False):
+        """依區間重疊與鍵集分頁條件產生記錄，依 (createTime, id) 由新到舊排序"""
+        records = [record for record in self.load()
+                   if match_record(record, date_from, date_to, name, leave_type, after)]
+        records.sort(key=record_sort_key, reverse=True)
+        yield from records[:limit] if limit else records
+
+    def upsert(self, record):
+        """新增或更新一筆記錄；回傳新的數據版本"""
+        return self.upsert_many([record])
+
+    def find_conflicts(self, name, start_date, end_date, exclude_id=None):
+        """同一員工與指定區間重疊的記錄（不含 exclude_id 本身）"""
+        return [record for record in self.query(name=name, date_from=start_date, date_to=end_date)
+                if is_conflict(record, name, start_date, end_date, exclude_id)]
+
+    def find_batch_conflicts(self, records):
+        """批次中每筆記錄與既有記錄的重疊：{記錄 ID: [既有記錄]}；同一批次中的 ID 會被取代，不列入"""
+        batch_ids = {str(record['id']) for record in records}
+        found = {}
+        for record in records:
+            conflicts = [conflict for conflict in self.find_conflicts(record['name'], record['startDate'],
+                                                                      record['endDate'], record['id'])
+                         if str(conflict.get('id')) not in batch_ids]
+            if conflicts:
+                found[str(record['id'])] = conflicts
+        return found
+
+    def upsert_checked(self, record):
+        """確認沒有重疊後寫入；有衝突時拋出 ConflictError
+
+        子類別須在與其他寫入相同的鎖 / 交易內檢查，確保多個 worker 同時送出
+        重疊的申請時只有一筆成功
+        """
+        raise NotImplementedError
+
+    def insert_checked(self, record):
+        """新增一筆記錄：ID 已存在時拋出 DuplicateIdError，與既有請假重疊時拋出 ConflictError
+
+        與 upsert_checked 相同，檢查與寫入必須在同一個鎖 / 交易內
+        """
+        raise NotImplementedError
+
+    def upsert_many(self, records):
+        """在一次寫入中新增或更新多筆記錄；回傳新的數據版本"""
+        raise NotImplementedError
+
+    def delete(self, record_ids):
+        """刪除記錄；回傳實際刪除的 ID"""
+        raise NotImplementedError
+
+    def version(self):
+        """目前的數據版本"""
+        raise NotImplementedError
+
+    def snapshot(self):
+        """回傳 (數據版本, 所有記錄)；兩者須在同一個鎖 / 交易內讀取，記錄一定屬於該版本
+
+        分別呼叫 version() 與 load() 時，兩次讀取之間的寫入會讓快取以舊版本標示新數據
+        """
+        raise NotImplementedError
+
+    def changes_since(self, cursor):
+        """回傳 (cursor, 更新的記錄, 刪除的 ID)；游標失效時回傳 None（需整份重送）"""
+        raise NotImplementedError
+
+    def purge_tombstones(self, retention_days=TOMBSTONE_RETENTION_DAYS):
+        """清除超過保留期限的刪除墓碑；回傳清除筆數
+
+        預設不需處理：記憶體引擎的異動記錄有筆數上限，JSON 日誌壓縮時即捨棄墓碑
+        """
+        return 0
+
+    def aggregate_stats(self):
+        """依類型 / 員工 / 月份重新計算統計（數據庫引擎以 GROUP BY 計算）"""
+        return LeaveAggregates.from_records(self.load()).to_dict()
+
+    def change_feed(self, interval=2):
+        """本程序的變更來源；預設定期讀取版本，版本改變時通知訂閱者"""
+        return get_file_watcher((self.name, id(self)), self.version, interval=interval)
+
+
+class _MemorySnapshot:
+    """記憶體儲存的不可變快照；寫入時建立新快照後一次替換，讀取者不需加鎖"""
+
+    __slots__ = ('version', 'records', 'starts', 'max_span', 'loose', 'by_name')
+
+    def __init__(self, version=0, records=None, starts=None, max_span=0, loose=frozenset(), by_name=None):
+        self.version = version
+        self.records = records if records is not None else {}   # str(id) -> record，保持寫入順序
+        self.starts = starts if starts is not None else []      # 依 (開始日序數, id) 排序
+        self.max_span = max_span                                # 最長假期天數（區間查詢的回溯範圍）
+        self.loose = loose                                      # 日期格式錯誤、無法索引的 ID
+        self.by_name = by_name if by_name is not None else {}   # 員工 -> 依開始日排序的 ((開始日, id), ...)
+
+
+class MemoryStore(LeaveStore):
+    """記憶體儲存：重啟後清空，只在單一程序內共享
+
+    以 ID 為鍵的 dict 加上依開始日排序的區間索引：「某天 / 某月誰請假」只需
+    二分搜尋 [範圍開始 - 最長假期, 範圍結束] 的候選記錄，不必掃描全部；
+    另以員工分組的區間索引檢查同一人的請假重疊。
+    寫入在鎖內複製容器建立新快照：每次寫入為 O(n) 的整塊複製（C 層級，實際很快），
+    只有定位是 O(log n)；讀取直接使用目前的快照，完全不需要鎖
+    """
+
+    name = 'memory'
+
+    # 差異同步保留的異動筆數；更舊的游標需整份重送
+    LOG_LIMIT = 10000
+
+    def __init__(self, records=()):
+        self._lock = threading.Lock()       # 只序列化寫入
+        self._snapshot = _MemorySnapshot()
+        self._log = []                      # (version, op, id)，供差異同步使用
+        self._log_floor = 0                 # 早於此版本的異動已捨棄
+        self._feed = ChangeFeed()
+        self._feed.connected = True
+        self._feed.version = 0
+        if records:
+            self.upsert_many(records)
+
+    # ------------------------------------------------------------------ 讀取
+
+    def load(self):
+        return list(self._snapshot.records.values())
+
+    def get(self, record_id):
+        return self._snapshot.records.get(str(record_id))
+
+    def count(self):
+        return len(self._snapshot.records)
+
+    def version(self):
+        return self._snapshot.version
+
+    def snapshot(self):
+        snapshot = self._snapshot
+        return snapshot.version, list(snapshot.records.values())
+
+    def query(self, date_from=None, date_to=None, name=None, leave_type=None,
+              after=None, limit=None, server_side=False):
+        snapshot = self._snapshot
+        from_ord = date_ordinal(date_from) if date_from else None
+        to_ord = date_ordinal(date_to) if date_to else None
+        if from_ord is None and to_ord is None:
+            candidates = snapshot.records.values()
+        else:
+            # 區間重疊的記錄，開始日必定落在 [範圍開始 - 最長假期, 範圍結束]
+            starts = snapshot.starts
+            lo = bisect_left(starts, (from_ord - snapshot.max_span,)) if from_ord is not None else 0
+            hi = bisect_right(starts, (to_ord, MAX_ID)) if to_ord is not None else len(starts)
+            ids = [record_id for _, record_id in starts[lo:hi]]
+            ids.extend(snapshot.loose)
+            candidates = [snapshot.records[record_id] for record_id in ids]
+        records = [record for record in candidates
+                   if match_record(record, date_from, date_to, name, leave_type, after)]
+        records.sort(key=record_sort_key, reverse=True)
+        yield from records[:limit] if limit else records
+
+    def on_date(self, day):
+        """某天請假的記錄"""
+        return list(self.query(date_from=day, date_to=day))
+
+    def in_month(self, year, month):
+        """某月有請假的記錄（區間與該月重疊）"""
+        last_day = calendar.monthrange(year, month)[1]
+        return list(self.query(date_from=f'{year:04d}-{month:02d}-01',
+                               date_to=f'{year:04d}-{month:02d}-{last_day:02d}'))
+
+    @staticmethod
+    def _conflicts_in(snapshot, name, start_date, end_date, exclude_id=None):
+        conflicts = []
+        for start, record_id in snapshot.by_name.get(name, ()):
+            if start > end_date:
+                break
+            record = snapshot.records[record_id]
+            if is_conflict(record, name, start_date, end_date, exclude_id):
+                conflicts.append(record)
+        return conflicts
+
+    def find_conflicts(self, name, start_date, end_date, exclude_id=None):
+        return self._conflicts_in(self._snapshot, name, start_date, end_date, exclude_id)
+
+    def changes_since(self, cursor):
+        try:
+            since = int(cursor)
+        except (TypeError, ValueError):
+            return None
+        snapshot = self._snapshot
+        log = self._log
+        if since > snapshot.version or since < self._log_floor:
+            return None
+        latest = {}
+        for version, op, record_id in log:
+            if since < version <= snapshot.version:
+                latest[record_id] = op
+        changes = [snapshot.records[record_id] for record_id, op in latest.items()
+                   if op == 'upsert' and record_id in snapshot.records]
+        deleted = [record_id for record_id, op in latest.items() if op == 'delete']
+        return snapshot.version, changes, deleted
+
+    # ------------------------------------------------------------------ 寫入
+
+    def _write(self, upserts=(), deletes=(), check_conflicts=False, insert_only=False):
+        """在鎖內由目前快照建立新快照並替換；回傳 (新版本, 實際刪除的 ID)"""
+        with self._lock:
+            old = self._snapshot
+            if insert_only:
+                for record in upserts:
+                    if str(record['id']) in old.records:
+                        raise DuplicateIdError(str(record['id']))
+            if check_conflicts:
+                for record in upserts:
+                    conflicts = self._conflicts_in(old, record.get('name'), record.get('startDate', ''),
+                                                   record.get('endDate', ''), record.get('id'))
+                    if conflicts:
+                        raise ConflictError(conflicts)
+
+            records = dict(old.records)
+            starts = list(old.starts)
+            loose = set(old.loose)
+            by_name = dict(old.by_name)     # 只複製異動員工的區間清單
+            max_span = old.max_span
+            version = old.version + 1
+            entries = []
+
+            def unindex(record_id):
+                previous = records.pop(record_id, None)
+                if previous is None:
+                    return False
+                start = date_ordinal(previous.get('startDate'))
+                if record_id in loose:
+                    loose.discard(record_id)
+                else:
+                    i = bisect_left(starts, (start, record_id))
+                    if i < len(starts) and starts[i] == (start, record_id):
+                        del starts[i]
+                name = previous.get('name')
+                intervals = [item for item in by_name.get(name, ()) if item[1] != record_id]
+                if intervals:
+                    by_name[name] = tuple(intervals)
+                else:
+                    by_name.pop(name, None)
+                return True
+
+            for record in upserts:
+                record_id = str(record['id'])
+                # 與其他引擎一致：更新的記錄移到最後
+                unindex(record_id)
+                records[record_id] = record
+                intervals = list(by_name.get(record.get('name'), ()))
+                insort(intervals, (str(record.get('startDate', '')), record_id))
+                by_name[record.get('name')] = tuple(intervals)
+                start = date_ordinal(record.get('startDate'))
+                end = date_ordinal(record.get('endDate'))
+                if start is None or end is None:
+                    loose.add(record_id)
+                else:
+                    insort(starts, (start, record_id))
+                    max_span = max(max_span, end - start)
+                entries.append((version, 'upsert', record_id))
+
+            deleted = []
+            for record_id in deletes:
+                record_id = str(record_id)
+                if unindex(record_id):
+                    deleted.append(record_id)
+                    entries.append((version, 'delete', record_id))
+
+            if not entries:
+                return None, []
+            self._log.extend(entries)
+            if len(self._log) > self.LOG_LIMIT:
+                # 以新串列取代，正在讀取舊串列的執行緒不受影響
+                cut = len(self._log) - self.LOG_LIMIT
+                first = self._log[cut][0]
+                # 保留的第一個版本若被截掉一部分（單次寫入超過 LOG_LIMIT 筆），
+                # 該版本之前的游標也必須整份重送
+                self._log_floor = first if self._log[cut - 1][0] == first else first - 1
+                self._log = self._log[cut:]
+            self._snapshot = _MemorySnapshot(version, records, starts, max_span, frozenset(loose), by_name)
+        return version, deleted
+
+    def upsert_many(self, records):
+        records = list(records)
+        version, _ = self._write(upserts=records)
+        if version is None:
+            return self.version()
+        self._publish(version, upserted=[str(record['id']) for record in records])
+        return version
+
+    def upsert_checked(self, record):
+        version, _ = self._write(upserts=[record], check_conflicts=True)
+        self._publish(version, upserted=[str(record['id'])])
+        return version
+
+    def insert_checked(self, record):
+        version, _ = self._write(upserts=[record], check_conflicts=True, insert_only=True)
+        self._publish(version, upserted=[str(record['id'])])
+        return version
+
+    def delete(self, record_ids):
+        version, deleted = self._write(deletes=record_ids)
+        if deleted:
+            self._publish(version, deleted=deleted)
+        return deleted
+
+    def _publish(self, version, upserted=(), deleted=()):
+        """寫入後直接通知本程序的訂閱者（不需輪詢）"""
+        self._feed.note_version(version)
+        self._feed.publish({'version': version, 'upserted': list(upserted), 'deleted': list(deleted)})
+
+    def change_feed(self, interval=2):
+        return self._feed
+
+
+def create_store(engine=None, **options):
+    """依名稱建立儲存引擎；未指定時依環境變數 DATABASE_URL / STORAGE_BACKEND 決定
+
+    options:
+        memory      records
+        json        path（預設 data.json）
+        sqlite      path（預設 SQLITE_PATH）
+        postgresql  dsn（預設 DATABASE_URL）及其他連線參數
+    """
+    if engine is None:
+        if os.environ.get('DATABASE_URL'):
+            engine = 'postgresql'
+        else:
+            engine = os.environ.get('STORAGE_BACKEND', '').lower() or 'json'
+    if engine == 'memory':
+        return MemoryStore(**options)
+    if engine == 'json':
+        from json_journal import JsonJournalStore
+        return JsonJournalStore(options.pop('path', 'data.json'), **options)
+    if engine == 'sqlite':
+        from db_sqlite import SqliteStore
+        return SqliteStore(**options)
+    if engine == 'postgresql':
+        from db_postgres import PostgresStore
+        options.setdefault('dsn', os.environ.get('DATABASE_URL'))
+        return PostgresStore(**options)
+    raise ValueError(f"未知的儲存引擎: {engine}（可用: {', '.join(STORAGE_ENGINES)}）")
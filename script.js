@@ -12,7 +12,14 @@ let leaveData = [];
 let isFirstTime = true;
 let deleteTargetId = null;
 let autoRefreshInterval = null; // 用來追蹤自動刷新間隔
-let lastDataHash = null; // 用來檢查資料是否真的有變化
+let eventSource = null; // 伺服器推送（SSE）連線，可用時取代輪詢
+let eventStreamFailed = false; // 伺服器拒絕推送連線後改用輪詢
+let lastDataHash = null; // 用來檢查資料是否真的有變化（伺服器未提供 ETag 時使用）
+let lastDataETag = null; // 伺服器回傳的 ETag，輪詢時以 If-None-Match 帶回，保存時以 If-Match 帶回
+let serverBaseIds = null; // 最後一次與伺服器同步時的記錄 ID，保存衝突時用來判斷本地新增 / 刪除
+let changeCursor = null; // 差異同步游標（伺服器提供 /api/data/changes 時使用）
+let deltaSyncSupported = null; // null: 尚未偵測；false: 伺服器不支援，改用整份 data.json
+let calendarWindow = { key: null, cursor: null, days: null }; // 伺服器回傳的日曆可見範圍（6週）每日請假索引
 let requestInProgress = false; // 避免重複請求
 
 // 初始化應用程式
@@ -30,22 +37,19 @@ document.addEventListener('DOMContentLoaded', async function() {
 
 // 頁面關閉時清理資源
 window.addEventListener('beforeunload', function() {
-    if (autoRefreshInterval) {
-        clearInterval(autoRefreshInterval);
-        console.log('🧹 頁面關閉，清理自動刷新機制');
-    }
+    stopAutoRefresh();
+    console.log('🧹 頁面關閉，清理自動刷新機制');
 });
 
 // 頁面可見性變化時的處理
 document.addEventListener('visibilitychange', function() {
     if (document.hidden) {
         // 頁面隱藏時暫停自動刷新
-        if (autoRefreshInterval) {
-            clearInterval(autoRefreshInterval);
-            console.log('⏸️ 頁面隱藏，暫停自動刷新');
-        }
+        stopAutoRefresh();
+        console.log('⏸️ 頁面隱藏，暫停自動刷新');
     } else {
-        // 頁面重新可見時恢復自動刷新
+        // 頁面重新可見時先同步一次，再恢復自動刷新
+        refreshData();
         startAutoRefresh();
         console.log('▶️ 頁面可見，恢復自動刷新');
     }
@@ -239,47 +243,61 @@ async function loadSampleData() {
         const controller = new AbortController();
         const timeoutId = setTimeout(() => controller.abort(), 8000); // 8秒超時，給50用戶更多時間
         
+        // 優先使用差異同步：只下載游標之後的變更
+        if (deltaSyncSupported !== false) {
+            const hasUpdate = await syncChanges(controller.signal);
+            if (hasUpdate !== null) {
+                clearTimeout(timeoutId);
+                return hasUpdate;
+            }
+        }
+        
+        const headers = {
+            'Cache-Control': 'no-cache',
+            'Pragma': 'no-cache'
+        };
+        if (lastDataETag) {
+            // 資料未變化時伺服器回應 304，不傳送內容也不需解析 JSON
+            headers['If-None-Match'] = lastDataETag;
+        }
+        
         const response = await fetch('./data.json?t=' + Date.now(), {
             signal: controller.signal,
-            headers: {
-                'Cache-Control': 'no-cache',
-                'Pragma': 'no-cache'
-            }
+            headers: headers
         });
         
         clearTimeout(timeoutId);
         
+        if (response.status === 304) {
+            console.log('📊 資料無變化 (304)，跳過更新');
+            return false;
+        }
+        
         if (response.ok) {
             const serverData = await response.json();
+            const etag = response.headers.get('ETag');
             
-            // 載入已刪除記錄列表並過濾
-            const filteredData = await filterDeletedRecords(serverData);
+            // 已刪除的記錄由伺服器端的墓碑過濾，不必另外下載刪除清單
+            const filteredData = serverData;
             
-            // 計算資料雜湊值，只有真正變化時才更新
-            const newDataHash = JSON.stringify(filteredData).length + '_' + 
-                               (filteredData.length > 0 ? filteredData[filteredData.length - 1].id : '0');
+            // 有 ETag 時直接以它判斷版本；否則計算資料雜湊值，只有真正變化時才更新
+            const newDataHash = etag || (JSON.stringify(filteredData).length + '_' + 
+                               (filteredData.length > 0 ? filteredData[filteredData.length - 1].id : '0'));
+            lastDataETag = etag;
+            serverBaseIds = new Set(serverData.map(leave => String(leave.id)));
             
             if (lastDataHash !== newDataHash) {
                 leaveData = filteredData;
                 lastDataHash = newDataHash;
                 
-                // 自動清理重複記錄
-                const cleanedCount = cleanupDuplicateRecords();
-                
-                // ✅ 新增：資料完整性檢查
+                // 載入時只讀取、不寫回：重複記錄由管理頁標示，使用者按「清理重複記錄」時才逐筆刪除
                 const invalidRecords = validateDataIntegrity(leaveData);
                 if (invalidRecords.length > 0) {
                     console.warn('⚠️ 發現資料完整性問題:', invalidRecords);
                     showDataIntegrityWarning(invalidRecords);
                 }
                 
-                if (cleanedCount > 0) {
-                    // 如果清理了重複記錄，需要保存更新的資料
-                    await saveData();
-                    console.log(`📥 已從共享檔案載入資料並清理重複記錄: ${leaveData.length} 筆記錄 (清理了 ${cleanedCount} 筆重複)`);
-                } else {
-                    console.log('📥 已從共享檔案載入資料:', leaveData.length, '筆記錄');
-                }
+                console.log('📥 已從共享檔案載入資料:', leaveData.length, '筆記錄');
                 return true; // 表示有更新
             }
             console.log('📊 資料無變化，跳過更新');
@@ -297,6 +315,11 @@ async function loadSampleData() {
         requestInProgress = false;
     }
     
+    // 已經透過差異同步取得伺服器資料時，保留目前資料等待下次同步
+    if (changeCursor !== null) {
+        return false;
+    }
+    
     // 如果無法載入共享資料，使用本地 localStorage
     const savedData = localStorage.getItem('leaveData');
     if (savedData) {
@@ -349,71 +372,65 @@ async function loadSampleData() {
     return false;
 }
 
-// 過濾已刪除的記錄
-async function filterDeletedRecords(data) {
-    try {
-        const response = await fetch('./deleted_records.json?t=' + Date.now());
-        if (response.ok) {
-            const deletedInfo = await response.json();
-            const deletedIds = deletedInfo.deletedRecords || [];
-            
-            // 過濾掉已刪除的記錄
-            const filteredData = data.filter(record => !deletedIds.includes(record.id));
-            
-            if (filteredData.length !== data.length) {
-                console.log('🗑️ 已過濾', data.length - filteredData.length, '筆已刪除的記錄');
-            }
-            
-            return filteredData;
+// 差異同步：取得游標之後的變更並合併到 leaveData
+// 回傳 true/false 表示資料是否有變化；伺服器不支援時回傳 null
+async function syncChanges(signal) {
+    let url = './api/data/changes';
+    if (changeCursor !== null) {
+        url += '?since=' + encodeURIComponent(changeCursor);
+    }
+    
+    const response = await fetch(url, {
+        signal: signal,
+        headers: {
+            'Cache-Control': 'no-cache',
+            'Pragma': 'no-cache'
         }
-    } catch (error) {
-        console.log('⚠️ 無法載入刪除記錄檔，使用原始資料');
+    });
+    
+    if (response.status === 404) {
+        console.log('ℹ️ 伺服器不支援差異同步，改用完整資料載入');
+        deltaSyncSupported = false;
+        return null;
+    }
+    if (!response.ok) {
+        throw new Error(`HTTP ${response.status}: ${response.statusText}`);
+    }
+    
+    const result = await response.json();
+    deltaSyncSupported = true;
+    changeCursor = result.cursor;
+    
+    if (result.reset) {
+        // 首次載入或游標失效：以伺服器的完整資料取代本地資料
+        leaveData = result.changes;
+        console.log('📥 已從伺服器載入完整資料:', leaveData.length, '筆記錄');
+    } else if (!mergeChanges(result.changes, result.deleted)) {
+        console.log('📊 資料無變化，跳過更新');
+        return false;
     }
     
-    return data;
+    const invalidRecords = validateDataIntegrity(leaveData);
+    if (invalidRecords.length > 0) {
+        console.warn('⚠️ 發現資料完整性問題:', invalidRecords);
+        showDataIntegrityWarning(invalidRecords);
+    }
+    return true;
 }
 
-// 記錄刪除操作
-async function recordDeletion(recordId) {
-    try {
-        // 載入現有的刪除記錄
-        let deletedInfo = { deletedRecords: [], lastCleanupTime: '', version: 1 };
-        
-        try {
-            const response = await fetch('./deleted_records.json?t=' + Date.now());
-            if (response.ok) {
-                deletedInfo = await response.json();
-            }
-        } catch (e) {
-            console.log('📝 創建新的刪除記錄檔');
-        }
-        
-        // 添加新的刪除記錄
-        if (!deletedInfo.deletedRecords.includes(recordId)) {
-            deletedInfo.deletedRecords.push(recordId);
-            deletedInfo.lastCleanupTime = new Date().toISOString();
-            
-            // 保存刪除記錄
-            const saveResponse = await fetch('./save_deleted_records', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify(deletedInfo)
-            });
-            
-            if (saveResponse.ok) {
-                console.log('✅ 已記錄刪除操作:', recordId);
-                return true;
-            } else {
-                console.log('⚠️ 無法保存刪除記錄');
-            }
-        }
-    } catch (error) {
-        console.log('❌ 記錄刪除操作失敗:', error);
+// 將新增/修改的記錄與刪除的 ID 合併到 leaveData
+function mergeChanges(changes, deleted) {
+    if (changes.length === 0 && deleted.length === 0) {
+        return false;
     }
     
-    return false;
+    const recordsById = new Map(leaveData.map(leave => [String(leave.id), leave]));
+    changes.forEach(record => recordsById.set(String(record.id), record));
+    deleted.forEach(id => recordsById.delete(String(id)));
+    leaveData = Array.from(recordsById.values());
+    
+    console.log(`🔄 已合併差異: ${changes.length} 筆更新, ${deleted.length} 筆刪除`);
+    return true;
 }
 
 // 檢查日期重疊的函數
@@ -427,11 +444,11 @@ function checkDateOverlap(start1, end1, start2, end2) {
     return startDate1 <= endDate2 && startDate2 <= endDate1;
 }
 
-// 檢查重複請假記錄
-function checkDuplicateLeave(name, startDate, endDate, excludeId = null) {
+// 檢查重複請假記錄（candidates 可傳入同一員工的記錄，避免掃描全部數據）
+function checkDuplicateLeave(name, startDate, endDate, excludeId = null, candidates = leaveData) {
     const conflicts = [];
     
-    leaveData.forEach(leave => {
+    candidates.forEach(leave => {
         // 排除指定的記錄ID（用於編輯時排除自己）
         if (excludeId && leave.id === excludeId) {
             return;
@@ -455,7 +472,38 @@ function checkDuplicateLeave(name, startDate, endDate, excludeId = null) {
     return conflicts;
 }
 
-// 清理現有的重複記錄
+// 依員工姓名分組，讓每筆記錄只需和同一員工的記錄比較
+function groupLeavesByName(leaves) {
+    const groups = new Map();
+    leaves.forEach(leave => {
+        if (!groups.has(leave.name)) {
+            groups.set(leave.name, []);
+        }
+        groups.get(leave.name).push(leave);
+    });
+    return groups;
+}
+
+// 由伺服器的員工區間索引查詢重疊記錄；伺服器不支援或連線失敗時回傳 null
+async function fetchServerConflicts(name, startDate, endDate) {
+    if (!deltaSyncSupported) {
+        return null;
+    }
+    try {
+        const params = new URLSearchParams({ name: name, from: startDate, to: endDate });
+        const response = await fetch(`./api/data/conflicts?${params}`, { cache: 'no-store' });
+        if (!response.ok) {
+            return null;
+        }
+        const result = await response.json();
+        return result.status === 'success' ? result.conflicts : null;
+    } catch (error) {
+        console.log('⚠️ 伺服器衝突檢查失敗，改用本地檢查:', error.message);
+        return null;
+    }
+}
+
+// 清理現有的重複記錄；回傳被移除的記錄
 function cleanupDuplicateRecords() {
     console.log('🧹 開始清理重複記錄...');
     const duplicateGroups = new Map();
@@ -469,7 +517,7 @@ function cleanupDuplicateRecords() {
         duplicateGroups.get(key).push(leave);
     });
     
-    let removedCount = 0;
+    const removed = [];
     
     // 處理每個群組，保留最早申請的記錄
     duplicateGroups.forEach((group, key) => {
@@ -483,15 +531,15 @@ function cleanupDuplicateRecords() {
                 const index = leaveData.findIndex(leave => leave.id === duplicate.id);
                 if (index !== -1) {
                     leaveData.splice(index, 1);
-                    removedCount++;
+                    removed.push(duplicate);
                     console.log(`🗑️ 移除重複記錄: ${duplicate.name} ${duplicate.startDate}-${duplicate.endDate} (ID: ${duplicate.id})`);
                 }
             });
         }
     });
     
-    console.log(`✅ 清理完成，共移除 ${removedCount} 筆重複記錄`);
-    return removedCount;
+    console.log(`✅ 清理完成，共移除 ${removed.length} 筆重複記錄`);
+    return removed;
 }
 
 // ✅ 新增：資料完整性驗證函數
@@ -613,11 +661,23 @@ async function handleCleanupDuplicates() {
     
     console.log('✅ 用戶確認清理操作');
     const originalCount = leaveData.length;
-    const removedCount = cleanupDuplicateRecords();
+    const removed = cleanupDuplicateRecords();
+    const removedCount = removed.length;
     
     if (removedCount > 0) {
-        // 保存清理後的資料
-        await saveData();
+        // 伺服器支援單筆刪除時逐筆刪除，不必上傳整份資料
+        let saveSuccess = true;
+        for (const duplicate of removed) {
+            const result = await saveRecordChange('DELETE', null, duplicate.id);
+            if (result === null) {
+                saveSuccess = await saveData();
+                break;
+            }
+            saveSuccess = saveSuccess && result === true;
+        }
+        if (!saveSuccess) {
+            console.log('⚠️ 部分重複記錄無法在伺服器上刪除');
+        }
         
         // 更新所有檢視
         updateManageList();
@@ -673,6 +733,111 @@ function formatConflictMessage(name, newStart, newEnd, conflicts) {
     return message;
 }
 
+// 合併伺服器上的最新資料與本地修改（以上次同步時的記錄 ID 判斷哪一方新增 / 刪除）
+function mergeWithServerData(serverData) {
+    const baseIds = serverBaseIds || new Set();
+    const localById = new Map(leaveData.map(leave => [String(leave.id), leave]));
+    const serverIds = new Set(serverData.map(leave => String(leave.id)));
+    const merged = [];
+    
+    serverData.forEach(leave => {
+        const id = String(leave.id);
+        if (localById.has(id)) {
+            merged.push(localById.get(id)); // 雙方都有：保留本地版本（本地的修改）
+        } else if (!baseIds.has(id)) {
+            merged.push(leave); // 其他使用者新增的記錄
+        }
+        // 上次同步時存在、本地已刪除：維持刪除
+    });
+    leaveData.forEach(leave => {
+        const id = String(leave.id);
+        if (!serverIds.has(id) && !baseIds.has(id)) {
+            merged.push(leave); // 本地新增、尚未保存的記錄
+        }
+        // 上次同步時存在、伺服器已刪除：由其他使用者刪除，不再加回
+    });
+    return merged;
+}
+
+// 保存時版本衝突（412）：重新載入伺服器資料並合併，回傳是否成功
+async function reloadAndMergeServerData() {
+    try {
+        const response = await fetch('./data.json?t=' + Date.now(), { cache: 'no-store' });
+        if (!response.ok) {
+            return false;
+        }
+        const serverData = await response.json();
+        leaveData = mergeWithServerData(serverData);
+        lastDataETag = response.headers.get('ETag');
+        serverBaseIds = new Set(serverData.map(leave => String(leave.id)));
+        localStorage.setItem('leaveData', JSON.stringify(leaveData));
+        console.log('🔀 已合併其他使用者的修改，重新保存');
+        return true;
+    } catch (error) {
+        console.log('⚠️ 重新載入伺服器資料失敗:', error.message);
+        return false;
+    }
+}
+
+// 單筆記錄異動：只上傳一筆記錄，不必送出整份資料
+// 支援差異同步的伺服器 (app.py) 使用 POST ./api/data、DELETE ./api/data/<id>；其他伺服器使用 ./api/records
+// 回傳 true / false；與既有請假重疊時回傳 { conflicts }；伺服器沒有此端點時回傳 null，由呼叫者改用 saveData() 整份保存
+async function saveRecordChange(method, record, recordId = record && record.id) {
+    localStorage.setItem('leaveData', JSON.stringify(leaveData));
+    const dataApi = deltaSyncSupported === true;
+    try {
+        const base = dataApi ? './api/data' : './api/records';
+        const url = method === 'POST' ? base : `${base}/${encodeURIComponent(recordId)}`;
+        const options = { method: method, headers: {} };
+        if (record) {
+            options.headers['Content-Type'] = 'application/json';
+            options.body = JSON.stringify(record);
+        }
+        const response = await fetch(url, options);
+        if (dataApi && method === 'DELETE' && response.status === 404) {
+            // 記錄已被其他使用者刪除，結果相同
+            console.log(`ℹ️ 記錄已不存在 (${recordId})`);
+            return true;
+        }
+        if ([404, 405, 501].includes(response.status)) {
+            return null;
+        }
+        if (response.status === 409) {
+            // 伺服器在寫入交易內檢查重疊，多人同時送出時只有一筆成功
+            const result = await response.json().catch(() => ({}));
+            console.log(`⚠️ 伺服器拒絕重疊的請假 (${method} ${recordId})`);
+            return { conflicts: result.conflicts || [] };
+        }
+        if (response.ok) {
+            if (dataApi && method === 'POST') {
+                // 記錄 ID 由伺服器產生，改用伺服器的 ID，下次差異同步時不會重複
+                const result = await response.json();
+                if (result.id) {
+                    record.id = result.id;
+                    recordId = result.id;
+                    localStorage.setItem('leaveData', JSON.stringify(leaveData));
+                }
+            }
+            // 伺服器已套用這筆異動；其他使用者的修改由下次輪詢取得
+            if (serverBaseIds) {
+                if (method === 'DELETE') {
+                    serverBaseIds.delete(String(recordId));
+                } else {
+                    serverBaseIds.add(String(recordId));
+                }
+            }
+            console.log(`✅ 記錄已同步 (${method} ${recordId})`);
+            showSaveSuccessNotification();
+            return true;
+        }
+        console.log(`⚠️ 記錄同步失敗 (${method} ${recordId}): ${response.status}`);
+    } catch (error) {
+        console.log('⚠️ 記錄同步時發生錯誤:', error.message);
+    }
+    showSaveErrorNotification();
+    return false;
+}
+
 // 儲存資料到本地存儲（純前端模式）
 async function saveData() {
     // 保存到 localStorage
@@ -680,23 +845,39 @@ async function saveData() {
     
     // 嘗試保存到共享的 data.json 檔案
     try {
-        // 使用 fetch API 嘗試寫入檔案
-        const response = await fetch('./save_data', {
-            method: 'POST',
-            headers: {
+        // 以 If-Match 帶上資料版本：其他人已先保存時伺服器回應 412，合併後重試，不會覆蓋對方的修改
+        for (let attempt = 0; attempt < 3; attempt++) {
+            const headers = {
                 'Content-Type': 'application/json',
-            },
-            body: JSON.stringify(leaveData)
-        });
-        
-        if (response.ok) {
-            console.log('✅ 資料已保存到共享檔案');
-            showSaveSuccessNotification();
-            return true;
-        } else {
-            console.log('⚠️ 無法保存到共享檔案');
-            showSaveErrorNotification();
+            };
+            if (lastDataETag) {
+                headers['If-Match'] = lastDataETag;
+            }
+            const response = await fetch('./save_data', {
+                method: 'POST',
+                headers: headers,
+                body: JSON.stringify(leaveData)
+            });
+            
+            if (response.status === 412 && await reloadAndMergeServerData()) {
+                continue;
+            }
+            if (response.ok) {
+                const etag = response.headers.get('ETag');
+                if (etag) {
+                    // 伺服器內容即為剛保存的資料，下次輪詢回應 304
+                    lastDataETag = etag;
+                    lastDataHash = etag;
+                    serverBaseIds = new Set(leaveData.map(leave => String(leave.id)));
+                }
+                console.log('✅ 資料已保存到共享檔案');
+                showSaveSuccessNotification();
+                return true;
+            }
+            break;
         }
+        console.log('⚠️ 無法保存到共享檔案');
+        showSaveErrorNotification();
     } catch (error) {
         console.log('⚠️ 保存共享資料時發生錯誤');
         showSaveErrorNotification();
@@ -803,6 +984,10 @@ function renderCalendar() {
     
     console.log('📅 日曆參數 - 第一天:', firstDay, '開始渲染日期:', startDate);
     
+    // 每日請假索引（日期 → 當天的請假），每格直接查表，不必再篩選資料
+    const range = getCalendarRange(currentYear, currentMonth);
+    const calendarDays = getCalendarDays(range);
+    
     // 生成日曆天數
     for (let i = 0; i < 42; i++) {
         const currentDay = new Date(startDate);
@@ -829,7 +1014,7 @@ function renderCalendar() {
         dayElement.appendChild(dayNumber);
         
         // 添加請假項目
-        const dayLeaves = getLeavesByDate(currentDay);
+        const dayLeaves = calendarDays.get(toLocalDateString(currentDay)) || [];
         dayLeaves.forEach(leave => {
             const leaveItem = document.createElement('div');
             
@@ -864,17 +1049,107 @@ function renderCalendar() {
         
         calendar.appendChild(dayElement);
     }
+    
+    // 伺服器支援範圍查詢時，向伺服器取得可見範圍的資料後重新渲染
+    loadCalendarWindow(range).then(updated => {
+        if (updated && calendarWindow.key === getCalendarRange(currentYear, currentMonth).key) {
+            renderCalendar();
+        }
+    });
 }
 
-// 根據日期獲取請假資料
-function getLeavesByDate(date) {
-    // 使用本地日期字串避免時區問題
+// 將日期轉為本地 YYYY-MM-DD 字串，避免時區問題
+function toLocalDateString(date) {
     const year = date.getFullYear();
     const month = String(date.getMonth() + 1).padStart(2, '0');
     const day = String(date.getDate()).padStart(2, '0');
-    const dateStr = `${year}-${month}-${day}`;
+    return `${year}-${month}-${day}`;
+}
+
+// 計算日曆可見的 6 週範圍（42 天）
+function getCalendarRange(year, month) {
+    const firstDay = new Date(year, month, 1);
+    const start = new Date(firstDay);
+    start.setDate(start.getDate() - firstDay.getDay());
+    const end = new Date(start);
+    end.setDate(start.getDate() + 41);
+    
+    const from = toLocalDateString(start);
+    const to = toLocalDateString(end);
+    return { from: from, to: to, key: `${from}_${to}` };
+}
+
+// 將請假展開為 日期 → 請假清單，只展開可見範圍內的日期
+function buildCalendarDays(leaves, range) {
+    const days = new Map();
+    leaves.forEach(leave => {
+        if (leave.startDate > range.to || leave.endDate < range.from) {
+            return;
+        }
+        const day = new Date(`${leave.startDate > range.from ? leave.startDate : range.from}T00:00:00`);
+        const last = leave.endDate < range.to ? leave.endDate : range.to;
+        for (let dateStr = toLocalDateString(day); dateStr <= last; dateStr = toLocalDateString(day)) {
+            if (!days.has(dateStr)) {
+                days.set(dateStr, []);
+            }
+            days.get(dateStr).push(leave);
+            day.setDate(day.getDate() + 1);
+        }
+    });
+    return days;
+}
+
+// 取得可見範圍的每日請假索引：優先使用伺服器預先計算的結果，否則在本地展開一次
+function getCalendarDays(range) {
+    if (calendarWindow.key === range.key && calendarWindow.days) {
+        return calendarWindow.days;
+    }
+    return buildCalendarDays(leaveData, range);
+}
+
+// 向伺服器查詢可見範圍的每日請假索引（GET /api/calendar?from=&to=）
+// 回傳 true 表示取得了新的資料
+async function loadCalendarWindow(range) {
+    // 只有支援差異同步的伺服器（app.py）提供範圍查詢
+    if (!deltaSyncSupported) {
+        return false;
+    }
+    // 同一範圍且本地資料版本未變時不需重新查詢
+    if (calendarWindow.key === range.key && calendarWindow.cursor === changeCursor) {
+        return false;
+    }
     
-    return leaveData.filter(leave => {
+    const cursor = changeCursor;
+    try {
+        const response = await fetch(`./api/calendar?from=${range.from}&to=${range.to}`, {
+            headers: {
+                'Cache-Control': 'no-cache',
+                'Pragma': 'no-cache'
+            }
+        });
+        if (!response.ok) {
+            return false;
+        }
+        const result = await response.json();
+        const leavesById = new Map(result.leaves.map(leave => [String(leave.id), leave]));
+        const days = new Map();
+        Object.entries(result.days).forEach(([dateStr, day]) => {
+            days.set(dateStr, day.ids.map(id => leavesById.get(id)).filter(Boolean));
+        });
+        calendarWindow = { key: range.key, cursor: cursor, days: days };
+        return true;
+    } catch (error) {
+        console.log('⚠️ 無法載入日曆範圍資料，使用本地資料:', error.message);
+        return false;
+    }
+}
+
+// 根據日期獲取請假資料
+function getLeavesByDate(date, leaves = leaveData) {
+    // 使用本地日期字串避免時區問題
+    const dateStr = toLocalDateString(date);
+    
+    return leaves.filter(leave => {
         return dateStr >= leave.startDate && dateStr <= leave.endDate;
     });
 }
@@ -944,6 +1219,7 @@ async function handleLeaveSubmission(e) {
         id: Date.now(),
         name: sanitizeInput(employeeName),
         type: 'leave',
+        reason: 'leave',
         startDate: startDate,
         endDate: endDate,
         submitDate: submitDateStr
@@ -958,8 +1234,11 @@ async function handleLeaveSubmission(e) {
         return;
     }
     
-    // 檢查重複請假記錄
-    const conflicts = checkDuplicateLeave(leaveRequest.name, leaveRequest.startDate, leaveRequest.endDate);
+    // 檢查重複請假記錄：優先使用伺服器索引（包含其他使用者剛送出、尚未同步到本地的記錄）
+    const serverConflicts = await fetchServerConflicts(leaveRequest.name, leaveRequest.startDate, leaveRequest.endDate);
+    const conflicts = serverConflicts !== null ?
+        serverConflicts :
+        checkDuplicateLeave(leaveRequest.name, leaveRequest.startDate, leaveRequest.endDate);
     if (conflicts.length > 0) {
         const conflictMessage = formatConflictMessage(
             leaveRequest.name, 
@@ -979,8 +1258,21 @@ async function handleLeaveSubmission(e) {
     // 添加到資料庫
     leaveData.push(leaveRequest);
     
-    // 嘗試保存（如果成功就是即時同步，如果失敗就提供檔案下載）
-    const saveSuccess = await saveData();
+    // 嘗試保存（如果成功就是即時同步，如果失敗就提供檔案下載）；優先只上傳這一筆記錄
+    let saveSuccess = await saveRecordChange('POST', leaveRequest);
+    if (saveSuccess === null) {
+        saveSuccess = await saveData();
+    }
+    
+    if (saveSuccess && saveSuccess.conflicts) {
+        // 其他使用者剛送出重疊的請假（本地檢查時尚未同步到）：撤回本地新增並顯示伺服器回傳的衝突
+        leaveData = leaveData.filter(leave => leave !== leaveRequest);
+        localStorage.setItem('leaveData', JSON.stringify(leaveData));
+        alert(formatConflictMessage(leaveRequest.name, leaveRequest.startDate, leaveRequest.endDate,
+                                    saveSuccess.conflicts));
+        refreshData();
+        return;
+    }
     
     if (saveSuccess) {
         alert('✅ 請假申請提交成功！已即時同步給所有使用者。');
@@ -1248,10 +1540,12 @@ function updateManageList() {
     
     // 按申請日期排序，最新的在前
     const sortedLeaves = [...leaveData].sort((a, b) => new Date(b.submitDate) - new Date(a.submitDate));
+    const leavesByName = groupLeavesByName(leaveData);
     
     sortedLeaves.forEach(leave => {
-        // 檢查是否有重複記錄（排除自己）
-        const conflicts = checkDuplicateLeave(leave.name, leave.startDate, leave.endDate, leave.id);
+        // 檢查是否有重複記錄（排除自己），只比較同一員工的記錄
+        const conflicts = checkDuplicateLeave(leave.name, leave.startDate, leave.endDate, leave.id,
+            leavesByName.get(leave.name));
         const hasConflicts = conflicts.length > 0; // 有任何衝突就標記
         
         const manageItem = document.createElement('div');
@@ -1327,61 +1621,112 @@ function showDeleteConfirm(leave) {
 
 // 刪除請假記錄
 async function deleteLeave(leaveId) {
-    // 先記錄刪除操作
-    const recordSuccess = await recordDeletion(leaveId);
-    
-    // 從本地資料中移除
+    // 從本地資料中移除（伺服器會留下刪除墓碑，其他使用者的舊資料不會讓記錄復活）
     leaveData = leaveData.filter(leave => leave.id !== leaveId);
     
-    // 保存更新後的資料
-    await saveData();
+    // 保存更新後的資料；伺服器支援單筆刪除時不必上傳整份資料
+    let saveSuccess = await saveRecordChange('DELETE', null, leaveId);
+    if (saveSuccess === null) {
+        saveSuccess = await saveData();
+    }
     
     // 更新所有檢視
     updateManageList();
     renderCalendar();
     updateLeaveDetails();
     
-    if (recordSuccess) {
-        alert('✅ 請假記錄已刪除！已記錄刪除操作，防止記錄復活。');
+    if (saveSuccess) {
+        alert('✅ 請假記錄已刪除！');
     } else {
-        alert('⚠️ 請假記錄已刪除！但無法記錄刪除操作，記錄可能會重新出現。');
+        alert('⚠️ 請假記錄已在本機刪除，但無法同步到伺服器，記錄可能會重新出現。');
     }
 }
 
+// 重新載入資料並在有變化時更新畫面
+async function refreshData() {
+    if (requestInProgress) {
+        // 上一次同步尚未完成，稍後再試，避免漏掉推送的變更
+        setTimeout(refreshData, 1000);
+        return;
+    }
+    
+    try {
+        const hasUpdate = await loadSampleData(); // 重新載入資料
+        
+        // 更新時間顯示
+        updateLastUpdateTime();
+        
+        // 如果資料有變化，更新顯示
+        if (hasUpdate) {
+            renderCalendar();
+            updateLeaveDetails();
+            if (document.getElementById('manageLeaveView').classList.contains('active')) {
+                updateManageList();
+            }
+            
+            // 在右上角顯示更新提示
+            showUpdateNotification();
+        }
+    } catch (error) {
+        console.error('❌ 自動刷新失敗:', error);
+    }
+}
+
+// 停止自動刷新與伺服器推送
+function stopAutoRefresh() {
+    if (autoRefreshInterval) {
+        clearInterval(autoRefreshInterval);
+        autoRefreshInterval = null;
+    }
+    if (eventSource) {
+        eventSource.close();
+        eventSource = null;
+    }
+}
+
+// 訂閱伺服器推送的變更通知（SSE）
+function startEventStream() {
+    eventSource = new EventSource('./api/events');
+    
+    // 其他使用者新增或刪除請假時立即同步差異
+    eventSource.addEventListener('change', () => refreshData());
+    
+    eventSource.addEventListener('open', () => {
+        console.log('📡 已連線即時通知');
+    });
+    
+    eventSource.addEventListener('error', () => {
+        if (eventSource && eventSource.readyState === EventSource.CLOSED) {
+            // 伺服器拒絕連線（不支援或名額已滿）：改回輪詢
+            console.log('⚠️ 即時通知無法使用，改用輪詢');
+            eventSource = null;
+            eventStreamFailed = true;
+            startAutoRefresh();
+        }
+        // 其他情況瀏覽器會依伺服器指定的 retry 間隔自動重連
+    });
+}
+
 // 自動重新整理功能
 function startAutoRefresh() {
     // 如果已經有自動刷新在運行，先清除它
-    if (autoRefreshInterval) {
-        clearInterval(autoRefreshInterval);
+    if (autoRefreshInterval || eventSource) {
+        stopAutoRefresh();
         console.log('🔄 清除舊的自動刷新機制');
     }
     
     // 顯示初始時間
     updateLastUpdateTime();
     
+    // 伺服器支援差異同步時優先使用推送，輪詢只作為備援
+    if (deltaSyncSupported && !eventStreamFailed && window.EventSource) {
+        startEventStream();
+        console.log('🚀 啟動即時通知機制 (SSE)');
+        return;
+    }
+    
     // 每30秒自動重新整理一次，檢查是否有新的請假資料（降低頻率減少伺服器負荷）
-    autoRefreshInterval = setInterval(async () => {
-        try {
-            const hasUpdate = await loadSampleData(); // 重新載入資料
-            
-            // 更新時間顯示
-            updateLastUpdateTime();
-            
-            // 如果資料有變化，更新顯示
-            if (hasUpdate) {
-                renderCalendar();
-                updateLeaveDetails();
-                if (document.getElementById('manageLeaveView').classList.contains('active')) {
-                    updateManageList();
-                }
-                
-                // 在右上角顯示更新提示
-                showUpdateNotification();
-            }
-        } catch (error) {
-            console.error('❌ 自動刷新失敗:', error);
-        }
-    }, 30000); // 改為30秒間隔，減少伺服器負荷
+    autoRefreshInterval = setInterval(refreshData, 30000); // 改為30秒間隔，減少伺服器負荷
     
     console.log('🚀 啟動自動刷新機制 (每30秒)');
 }
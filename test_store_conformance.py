@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+請假管理系統 - 儲存引擎一致性測試 (Leave Management System - Storage Engine Conformance Tests)
+MIT License - LeaveSystem Project 2024
+
+每個儲存引擎以相同的案例測試，確保各伺服器版本換引擎時行為不變：
+
+    python -m pytest -q test_store_conformance.py
+    LEAVE_TEST_DSN=postgresql://... python -m pytest -q test_store_conformance.py   # 另外測試 PostgreSQL
+
+PostgreSQL 只在設定 LEAVE_TEST_DSN 時測試（請使用測試用數據庫，測試會清空請假資料表）
+"""
+
+import os
+
+import pytest
+
+from leave_stats import LeaveAggregates
+from leave_store import ConflictError, DuplicateIdError, create_store
+
+TEST_DSN = os.environ.get('LEAVE_TEST_DSN')
+
+ENGINES = ['memory', 'json', 'sqlite', pytest.param('postgresql', marks=pytest.mark.skipif(
+    not TEST_DSN, reason='未設定 LEAVE_TEST_DSN'))]
+
+
+def make(record_id, name, start, end, leave_type='事假', create_time='2024-02-01T09:00:00', **extra):
+    return dict({'id': record_id, 'name': name, 'startDate': start, 'endDate': end, 'reason': 'r',
+                 'type': leave_type, 'createTime': create_time}, **extra)
+
+
+A = make('a', '甲', '2024-03-01', '2024-03-05', create_time='2024-02-01T09:00:00', note='extra')
+B = make('b', '乙', '2024-03-10', '2024-03-10', '病假', create_time='2024-02-02T09:00:00')
+C = make('c', '甲', '2024-04-01', '2024-04-02', '特休', create_time='2024-02-03T09:00:00')
+
+
+@pytest.fixture(params=ENGINES)
+def store(request, tmp_path):
+    engine = request.param
+    if engine == 'json':
+        yield create_store('json', path=str(tmp_path / 'data.json'))
+        return
+    if engine == 'sqlite':
+        store = create_store('sqlite', path=str(tmp_path / 'leave_records.db'))
+        store.init()
+        yield store
+        return
+    if engine == 'postgresql':
+        store = create_store('postgresql', dsn=TEST_DSN)
+        store.init()
+        store.delete([record['id'] for record in store.load()])
+        yield store
+        store.delete([record['id'] for record in store.load()])
+        return
+    yield create_store(engine)
+
+
+@pytest.fixture
+def seeded(store):
+    store.upsert_many([A, B, C])
+    return store
+
+
+def ids(records):
+    return [str(record['id']) for record in records]
+
+
+# ---------------------------------------------------------------- 讀寫
+
+def test_upsert_changes_version_and_get_returns_extra_fields(store):
+    v0 = store.version()
+    v1 = store.upsert(A)
+    assert v1 != v0
+    assert store.version() == v1
+    assert store.get('a')['note'] == 'extra'
+    assert store.get('missing') is None
+
+
+def test_snapshot_returns_records_of_its_version(seeded):
+    version, records = seeded.snapshot()
+    assert version == seeded.version()
+    assert sorted(ids(records)) == ['a', 'b', 'c']
+    seeded.delete(['b'])
+    later, records = seeded.snapshot()
+    assert later != version and later == seeded.version()
+    assert sorted(ids(records)) == ['a', 'c']
+
+
+def test_upsert_many_and_replace_by_id(seeded):
+    assert sorted(ids(seeded.load())) == ['a', 'b', 'c']
+    seeded.upsert(dict(A, reason='updated'))
+    assert len(seeded.load()) == 3
+    assert seeded.get('a')['reason'] == 'updated'
+
+
+def test_query_filters_by_overlap_name_and_type(seeded):
+    assert sorted(ids(seeded.query(date_from='2024-03-05', date_to='2024-03-10'))) == ['a', 'b']
+    assert sorted(ids(seeded.query(name='甲'))) == ['a', 'c']
+    assert ids(seeded.query(leave_type='病假')) == ['b']
+
+
+def test_query_orders_newest_first_with_keyset_pagination(seeded):
+    assert ids(seeded.query(date_from='2024-03-01', date_to='2024-04-30')) == ['c', 'b', 'a']
+    first = list(seeded.query(name='甲', limit=1))
+    after = (first[-1]['createTime'], str(first[-1]['id']))
+    rest = list(seeded.query(name='甲', after=after))
+    assert ids(first + rest) == ['c', 'a']
+
+
+def test_aggregate_stats_matches_reference(seeded):
+    assert seeded.aggregate_stats() == LeaveAggregates.from_records([A, B, C]).to_dict()
+
+
+# ---------------------------------------------------------------- 重疊檢查
+
+def test_find_conflicts_includes_touching_days_and_excludes_self(seeded):
+    assert sorted(ids(seeded.find_conflicts('甲', '2024-03-05', '2024-04-01'))) == ['a', 'c']
+    assert seeded.find_conflicts('甲', '2024-03-01', '2024-03-05', exclude_id='a') == []
+
+
+def test_upsert_checked_rejects_overlap_without_writing(seeded):
+    version = seeded.version()
+    with pytest.raises(ConflictError) as excinfo:
+        seeded.upsert_checked(make('d', '乙', '2024-03-09', '2024-03-11'))
+    assert [conflict['id'] for conflict in excinfo.value.conflicts] == ['b']
+    assert seeded.get('d') is None
+    assert seeded.version() == version
+
+
+def test_upsert_checked_allows_updating_itself(seeded):
+    version = seeded.version()
+    assert seeded.upsert_checked(dict(B, reason='checked')) != version
+    assert seeded.get('b')['reason'] == 'checked'
+
+
+def test_insert_checked_never_replaces_an_existing_id(seeded):
+    version = seeded.version()
+    with pytest.raises(DuplicateIdError) as excinfo:
+        seeded.insert_checked(dict(B, reason='duplicate', startDate='2030-01-01', endDate='2030-01-01'))
+    assert excinfo.value.record_id == 'b'
+    assert seeded.get('b')['reason'] == 'r'
+    assert seeded.version() == version
+    seeded.insert_checked(make('e', '乙', '2030-01-01', '2030-01-01'))
+    assert seeded.get('e') is not None
+
+
+def test_find_batch_conflicts_ignores_ids_replaced_by_the_batch(seeded):
+    batch = [make('n1', '甲', '2024-03-04', '2024-03-04'), dict(C, startDate='2024-03-20', endDate='2024-03-20'),
+             make('n2', '甲', '2024-04-01', '2024-04-01')]
+    found = seeded.find_batch_conflicts(batch)
+    assert sorted(found) == ['n1']
+    assert ids(found['n1']) == ['a']
+
+
+# ---------------------------------------------------------------- 刪除與差異同步
+
+def test_delete_returns_only_existing_ids(seeded):
+    assert [str(record_id) for record_id in seeded.delete(['b', 'missing'])] == ['b']
+    assert seeded.get('b') is None
+    assert seeded.delete(['missing']) == []
+
+
+def test_changes_since_reports_upserts_and_deletes(store):
+    v1 = store.upsert(A)
+    store.upsert_many([B, C])
+    cursor, changes, deleted = store.changes_since(v1)
+    assert cursor == store.version()
+    assert sorted(ids(changes)) == ['b', 'c'] and deleted == []
+
+    v2 = store.version()
+    store.delete(['b'])
+    _, changes, deleted = store.changes_since(v2)
+    assert changes == [] and [str(record_id) for record_id in deleted] == ['b']
+
+    _, changes, deleted = store.changes_since(store.version())
+    assert changes == [] and deleted == []
+
+
+def test_changes_since_rejects_unparseable_cursor(seeded):
+    assert seeded.changes_since('not-a-cursor') is None
+
+
+def test_purge_tombstones_invalidates_older_cursors(seeded):
+    cursor = seeded.version()
+    seeded.delete(['b'])
+    if seeded.purge_tombstones(retention_days=-1):
+        assert seeded.changes_since(cursor) is None
+    _, changes, deleted = seeded.changes_since(seeded.version())
+    assert changes == [] and deleted == []